@@ -1,35 +1,173 @@
 import os
-import glob
+import sys
+import json
+import time
+import threading
+import subprocess
 import streamlit as st
-import pandas as pd
-from mea_pipeline.pipeline import run_pipeline
+from mea_pipeline.config import load_config
+from mea_pipeline.featureStore import FeatureStore, feature_store_path
+from mea_pipeline.preProcessing import raw_files
+from mea_pipeline.signalStore import load_cleaned, to_dataframe, recording_base, store_paths
+from mea_pipeline.spikeTrains import load_spike_train, spike_events_frame
+
+# The pipeline runs on the selected recording in its own process (run_pipeline.py
+# --files ... --progress-file ...), one at a time across sessions since every run writes
+# the same output/; the page polls the progress file. Everything read back from output/
+# goes through st.cache_data keyed on the file path and modification time, so toggling
+# checkboxes never reloads a file that has not changed.
+
+RUN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_pipeline.py")
+
+FEATURES = ["spike_count", "firing_rate", "isi_mean", "burst_count", "mean_spikes_per_burst", "mean_burst_duration"]
+
+STAGE_LABELS = {
+    "clean_signals": "Cleaning",
+    "detect_spikes": "Detecting spikes",
+    "compute_snr": "Computing SNR",
+    "extract_features": "Extracting features",
+    "run_fused": "Processing (fused)",
+    "run_streaming": "Processing (streaming)",
+    "feature_comparison": "Comparing groups",
+    "render_plots": "Rendering plots",
+    "done": "Done"
+}
+
+
+def _mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+@st.cache_data(show_spinner=False)
+def read_bytes(path, mtime):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@st.cache_data(show_spinner=False)
+def list_outputs(directory, prefix, suffix, mtime):
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.startswith(prefix) and f.endswith(suffix)]
+
+
+@st.cache_data(show_spinner=False)
+def query_features(store_path, mtime, recordings):
+    # Latest rows of each recording, whatever config computed them
+    store = FeatureStore(store_path)
+    try:
+        return store.query(recordings=list(recordings)), store.group_means(recordings=list(recordings))
+    finally:
+        store.close()
+
+
+@st.cache_data(show_spinner=False)
+def cleaned_csv(store, mtime):
+    return to_dataframe(load_cleaned(store)).to_csv(index=False)
+
+
+@st.cache_data(show_spinner=False)
+def spikes_csv(train_file, mtime):
+    return spike_events_frame(load_spike_train(train_file)).to_csv(index=False)
+
+
+def show_image(path, caption=None):
+    if os.path.exists(path):
+        st.image(read_bytes(path, _mtime(path)), caption=caption or os.path.basename(path))
+
+
+def show_images(directory, prefix, suffix):
+    if not os.path.exists(directory):
+        return
+    for path in list_outputs(directory, prefix, suffix, _mtime(directory)):
+        show_image(path)
+
+
+@st.cache_resource
+def pipeline_runs():
+    # Shared by every session of this server
+    return {"lock": threading.Lock(), "job": None}
+
+
+def start_run(selected_file, output_dir):
+    # -> the new job, or None while another session's run is still going
+    runs = pipeline_runs()
+    with runs["lock"]:
+        active = runs["job"]
+        if active is not None and active["process"].poll() is None:
+            return None
+        run_dir = os.path.join(output_dir, ".demo")
+        os.makedirs(run_dir, exist_ok=True)
+        job = {"file": selected_file, "progress": os.path.join(run_dir, "progress.json"),
+               "log": os.path.join(run_dir, "run.log")}
+        if os.path.exists(job["progress"]):
+            os.remove(job["progress"])
+        with open(job["log"], "w") as log_file:
+            job["process"] = subprocess.Popen([sys.executable, RUN_SCRIPT, "--files", selected_file,
+                                               "--progress-file", job["progress"]],
+                                              stdout=log_file, stderr=subprocess.STDOUT)
+        runs["job"] = job
+        return job
+
+
+def job_status(job):
+    # Last progress the run's process wrote, plus its exit state
+    status = {"stage": "queued", "index": 0, "total": 1, "error": None}
+    if os.path.exists(job["progress"]):
+        with open(job["progress"]) as f:
+            status.update(json.load(f))
+    code = job["process"].poll()
+    status["finished"] = code is not None
+    if code:
+        with open(job["log"]) as f:
+            lines = f.read().strip().splitlines()
+        status["error"] = lines[-1] if lines else f"exit code {code}"
+    return status
+
 
 st.set_page_config(page_title="Spike Analysis Pipeline", layout="wide")
 
 st.title("Spike Analysis Pipeline")
 st.markdown("Select a raw file")
 
-input_dir = "data/raw"
+cfg = load_config()
+input_dir, output_dir = cfg["input_dir"], cfg["output_dir"]
 os.makedirs(input_dir, exist_ok=True)
 
-files = glob.glob(os.path.join(input_dir, "*.csv"))
+files = raw_files(cfg)
 if not files:
-    st.warning("No CSV files found in data/raw/. Please place your recordings there first.")
+    st.warning(f"No raw recordings (.csv, .npy, .npz, .h5) found in {input_dir}/. Please place your recordings there first.")
 else:
     selected_file = st.selectbox("Choose a raw file to process", files)
 
-   
-    if "pipeline_done" not in st.session_state:
-        st.session_state.pipeline_done = False
+    job = st.session_state.get("job")
+    status = job_status(job) if job is not None else None
+    running = status is not None and not status["finished"]
+
+    if st.button("Run Pipeline", disabled=running):
+        new_job = start_run(selected_file, output_dir)
+        if new_job is None:
+            st.warning("Another session is running the pipeline; try again when it has finished.")
+        else:
+            st.session_state.job = job = new_job
+            status = job_status(job)
+            running = True
 
- 
-    if st.button("Run Pipeline"):
-        with st.spinner(f"Running pipeline on {selected_file}..."):
-            run_pipeline()
-        st.success("Pipeline finished!")
-        st.session_state.pipeline_done = True
+    if running:
+        st.progress(status["index"] / max(status["total"], 1),
+                    text=f"{os.path.basename(job['file'])}: {STAGE_LABELS.get(status['stage'], status['stage'])}")
+        time.sleep(0.5)
+        st.rerun()
 
-    if st.session_state.pipeline_done:
+    if job is not None and status["finished"]:
+        if status["error"]:
+            st.error(f"Pipeline failed on {os.path.basename(job['file'])}: {status['error']}")
+        else:
+            st.success(f"Pipeline finished for {os.path.basename(job['file'])}")
+
+    if job is not None and status["finished"] and not status["error"]:
+        # Outputs of the recording that was run, even if the selection changed since
+        base = recording_base(job["file"])
+        name = f"{base}_cleaned"
         st.subheader("Choose Outputs to Display")
 
         show_artifacts = st.checkbox("Show Artifact Detection")
@@ -38,71 +176,54 @@ else:
         show_snr = st.checkbox("Show SNR Plots")
         show_features = st.checkbox("Show Feature Comparisons")
 
+        plot_dir = os.path.join(output_dir, "cleaned_plots")
+
         if show_artifacts:
             st.subheader("Artifact Detection")
-            art_dir = "output/cleaned_plots"
-            if os.path.exists(art_dir):
-                for f in sorted(os.listdir(art_dir)):
-                    if f.endswith("_artifact_debug.png"):
-                        st.image(os.path.join(art_dir, f), caption=f)
-            cleaned_file = selected_file.replace("data/raw", "data/cleaned").replace(".csv", "_cleaned.csv")
-            if os.path.exists(cleaned_file):
-                with open(cleaned_file, "rb") as f:
-                    st.download_button("Download Cleaned CSV", f, file_name=os.path.basename(cleaned_file))
-
-    
+            show_image(os.path.join(plot_dir, f"{base}_artifact_debug.png"))
+            cleaned_store = store_paths(os.path.join(output_dir, "cleaned"), base)["signals"]
+            if os.path.exists(cleaned_store):
+                st.download_button("Download Cleaned CSV", cleaned_csv(cleaned_store, _mtime(cleaned_store)),
+                                   file_name=f"{name}.csv")
+
         if show_cleaned:
             st.subheader("Cleaned Signals")
-            clean_dir = "output/cleaned_plots"
-            if os.path.exists(clean_dir):
-                for f in sorted(os.listdir(clean_dir)):
-                    if f.endswith("_CLEANED_SAMPLE.png"):
-                        st.image(os.path.join(clean_dir, f), caption=f)
+            show_image(os.path.join(plot_dir, f"{base}_CLEANED_SAMPLE.png"))
 
-    
         if show_spikes:
             st.subheader("Spike Plots")
-            spike_dir = "output/spike/info"
-            if os.path.exists(spike_dir):
-                for f in sorted(os.listdir(spike_dir)):
-                    if f.endswith("_spikes.png"):
-                        st.image(os.path.join(spike_dir, f), caption=f)
-            spike_file = selected_file.replace("data/raw", "output/spike").replace(".csv", "_spikes.csv")
+            show_images(os.path.join(output_dir, "spike", "info"), f"{name}_", "_spikes.png")
+            spike_file = os.path.join(output_dir, "spike", "trains", f"{name}_spikes.npz")
             if os.path.exists(spike_file):
-                with open(spike_file, "rb") as f:
-                    st.download_button("Download Spikes CSV", f, file_name=os.path.basename(spike_file))
+                st.download_button("Download Spikes CSV", spikes_csv(spike_file, _mtime(spike_file)),
+                                   file_name=f"{name}_spikes.csv")
 
-    
         if show_snr:
             st.subheader("SNR Plots")
-            snr_dir = "output/snr"
-            if os.path.exists(snr_dir):
-                for f in sorted(os.listdir(snr_dir)):
-                    if f.endswith("_snr.png"):
-                        st.image(os.path.join(snr_dir, f), caption=f)
-            snr_file = "output/snr/snr_summary.csv"
+            show_image(os.path.join(output_dir, "snr", f"{name}_snr.png"))
+            snr_file = os.path.join(output_dir, "snr", "snr_summary.csv")
             if os.path.exists(snr_file):
-                with open(snr_file, "rb") as f:
-                    st.download_button("Download SNR Summary", f, file_name="snr_summary.csv")
+                st.download_button("Download SNR Summary", read_bytes(snr_file, _mtime(snr_file)),
+                                   file_name="snr_summary.csv")
 
-       
         if show_features:
             st.subheader("Feature Comparisons")
-            features_file = "output/features/features_summary.csv"
-            if os.path.exists(features_file):
-                df = pd.read_csv(features_file)
+            store_path = feature_store_path(cfg)
+            if os.path.exists(store_path):
+                df, group_means = query_features(store_path, _mtime(store_path), (base,))
                 st.write("### Features Summary")
                 st.dataframe(df.head(20))
-                st.write("### Group Means")
-                st.dataframe(df.groupby("group").mean(numeric_only=True))
+                st.write("### Group Means (this recording)")
+                st.dataframe(group_means)
 
-                features = ["spike_count", "firing_rate", "isi_mean", "burst_count", "mean_spikes_per_burst"]
+                # The comparison plots cover every recording of the project
+                st.write("### Group Comparison (all recordings)")
                 cols = st.columns(2)
-                for i, feat in enumerate(features):
-                    plot_path = f"output/features/{feat}_barplot.png"
+                for i, feat in enumerate(FEATURES):
+                    plot_path = os.path.join(output_dir, "features", f"{feat}_barplot.png")
                     if os.path.exists(plot_path):
                         with cols[i % 2]:
-                            st.image(plot_path, caption=f"{feat} – Healthy vs SMA")
+                            show_image(plot_path, f"{feat} by group")
 
-                with open(features_file, "rb") as f:
-                    st.download_button("Download Features CSV", f, file_name="features_summary.csv")
+                st.download_button("Download Features CSV", df.to_csv(index=False),
+                                   file_name=f"{base}_features.csv")
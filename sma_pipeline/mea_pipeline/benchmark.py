@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import yaml
+from mea_pipeline.config import load_config, CONFIG_PATH
+from mea_pipeline.instrumentation import setup_logging
+from mea_pipeline.synthetic import generate_dataset, load_truth, match_spikes
+from mea_pipeline.signalStore import list_cleaned, store_base
+from mea_pipeline.spikes import train_path
+from mea_pipeline.spikeTrains import load_spike_train, split_channels
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Per-stage benchmark over a sweep of synthetic recording sizes. Each size gets its
+# own working directory (raw CSVs + config/config.yaml, plots and cache off); every
+# stage runs in a forked child so its peak RSS is measured on its own. Results are
+# written as JSON; `--compare old.json new.json` prints the per-stage speed ratios.
+
+STAGES = ("clean_signals", "detect_spikes", "compute_snr", "extract_features")
+
+
+def _run_stage(name, cfg, workers):
+    if name == "clean_signals":
+        from mea_pipeline.preProcessing import clean_signals
+        clean_signals(workers)
+    elif name == "detect_spikes":
+        from mea_pipeline.spikes import detect_spikes
+        detect_spikes(workers)
+    elif name == "compute_snr":
+        from mea_pipeline.snr import compute_snr
+        compute_snr(workers)
+    else:
+        from mea_pipeline.features import features_from_config
+        features_from_config(cfg, workers)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _stage_child(conn, name, cfg, workers):
+    try:
+        wall, cpu = time.perf_counter(), time.process_time()
+        _run_stage(name, cfg, workers)
+        conn.send({"seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu,
+                   "peak_rss_mb": _peak_rss_mb()})
+    except Exception as e:
+        conn.send({"error": repr(e)})
+    finally:
+        conn.close()
+
+
+def measure_stage(name, cfg, workers=1):
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(child, name, cfg, workers))
+    proc.start()
+    child.close()
+    result = parent.recv()
+    proc.join()
+    if "error" in result:
+        raise RuntimeError(f"{name} failed: {result['error']}")
+    return result
+
+
+def spike_accuracy(cfg, raw_dir, tolerance_ms=0.5):
+    # Detected trains against the generator's ground truth, pooled over files and channels
+    hits = misses = false_pos = 0
+    for store in list_cleaned(os.path.join(cfg["output_dir"], "cleaned")):
+        train = load_spike_train(train_path(cfg, f"{store_base(store)}_cleaned"))
+        truth = load_truth(os.path.join(raw_dir, store_base(store) + ".csv"))
+        tol = int(tolerance_ms * 1e-3 * truth["fs"])
+        for idx, true_idx in zip(split_channels(train), truth["spikes"]):
+            h, m, f = match_spikes(idx, true_idx, tol)
+            hits, misses, false_pos = hits + h, misses + m, false_pos + f
+    return {"recall": hits / max(hits + misses, 1), "precision": hits / max(hits + false_pos, 1)}
+
+
+def bench_size(work_dir, base_cfg, duration, n_channels=16, n_files=2, fs=30000, workers=1, seed=0):
+    raw_dir = os.path.join(work_dir, "Data", "raw")
+    generate_dataset(raw_dir, n_files, seed, n_channels=n_channels, fs=fs, duration=duration)
+
+    cfg = dict(base_cfg, input_dir="Data/raw", output_dir="output", fs=fs, workers=workers,
+               cache=False, plots=False, write_cleaned_csv=False, write_dense_spike_mask=False)
+    os.makedirs(os.path.join(work_dir, "config"), exist_ok=True)
+    with open(os.path.join(work_dir, "config", "config.yaml"), "w") as f:
+        yaml.safe_dump(cfg, f)
+
+    n_samples = n_files * int(duration * fs)
+    run = {"duration_s": duration, "channels": n_channels, "files": n_files, "fs": fs, "workers": workers,
+           "samples": n_samples, "channel_samples": n_samples * n_channels, "stages": {}}
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for name in STAGES:
+            res = measure_stage(name, cfg, workers)
+            res["samples_per_s"] = n_samples / res["seconds"]
+            res["channel_samples_per_s"] = n_samples * n_channels / res["seconds"]
+            run["stages"][name] = res
+            print(f"  {name:>16}: {res['seconds']:7.2f} s  {res['channel_samples_per_s'] / 1e6:7.2f} M ch-samples/s"
+                  f"  peak {res['peak_rss_mb'] or float('nan'):7.1f} MB")
+        run["spike_accuracy"] = spike_accuracy(cfg, "Data/raw")
+    finally:
+        os.chdir(cwd)
+    return run
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def run_benchmarks(durations=(10, 30, 60), n_channels=16, n_files=2, fs=30000, workers=1,
+                   out_path="output/benchmarks/benchmark.json", config_path=CONFIG_PATH, work_root=None):
+    base_cfg = load_config(config_path)
+    setup_logging(base_cfg)
+    results = {"environment": _environment(), "runs": []}
+    for duration in durations:
+        print(f"Benchmark: {n_files} files x {n_channels} channels x {duration} s")
+        with tempfile.TemporaryDirectory(dir=work_root) as work_dir:
+            results["runs"].append(bench_size(work_dir, base_cfg, duration, n_channels, n_files, fs, workers))
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Saved benchmark results: {out_path}")
+    return results
+
+
+def compare(old_path, new_path):
+    # Speedup (old seconds / new seconds) per stage for the sizes both files contain
+    with open(old_path) as f:
+        old = {(r["duration_s"], r["channels"], r["files"]): r for r in json.load(f)["runs"]}
+    with open(new_path) as f:
+        new = {(r["duration_s"], r["channels"], r["files"]): r for r in json.load(f)["runs"]}
+
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        for name in STAGES:
+            a, b = old[key]["stages"].get(name), new[key]["stages"].get(name)
+            if a and b:
+                rows.append({"duration_s": key[0], "channels": key[1], "files": key[2], "stage": name,
+                             "old_s": a["seconds"], "new_s": b["seconds"], "speedup": a["seconds"] / b["seconds"]})
+                print(f"{key[0]:>6} s {key[1]:>4} ch {name:>16}: {a['seconds']:7.2f} -> {b['seconds']:7.2f} s"
+                      f"  ({rows[-1]['speedup']:.2f}x)")
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic recordings")
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 30, 60], help="seconds per recording")
+    parser.add_argument("--channels", type=int, default=16)
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--fs", type=float, default=30000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--out", default="output/benchmarks/benchmark.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run_benchmarks(args.durations, args.channels, args.files, args.fs, args.workers, args.out)
@@ -0,0 +1,44 @@
+import numpy as np
+
+# ISI-threshold burst detection as run-length encoding over the ISI array: a burst is a
+# maximal run of consecutive spikes whose ISIs are all <= burst_isi.
+
+
+def detect_bursts(spike_times, burst_isi=0.1, min_spikes=2):
+    # Returns first and last spike index (inclusive) of every burst
+    linked = np.diff(spike_times) <= burst_isi
+    edges = np.diff(np.concatenate([[False], linked, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts + 1 >= min_spikes
+    return starts[keep], ends[keep]
+
+
+def burst_metrics(spike_times, burst_isi=0.1, min_spikes=2):
+    spike_times = np.asarray(spike_times)
+    starts, ends = detect_bursts(spike_times, burst_isi, min_spikes)
+    burst_count = len(starts)
+    if burst_count == 0:
+        return {
+            "burst_count": 0,
+            "mean_spikes_per_burst": np.nan,
+            "mean_burst_duration": np.nan,
+            "mean_intra_burst_freq": np.nan,
+            "mean_inter_burst_interval": np.nan,
+            "pct_spikes_in_bursts": 0.0 if len(spike_times) > 0 else np.nan
+        }
+
+    spikes_per_burst = ends - starts + 1
+    durations = spike_times[ends] - spike_times[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intra_freq = np.where(durations > 0, (spikes_per_burst - 1) / durations, np.nan)
+    inter_burst = spike_times[starts[1:]] - spike_times[ends[:-1]]
+
+    return {
+        "burst_count": burst_count,
+        "mean_spikes_per_burst": spikes_per_burst.mean(),
+        "mean_burst_duration": durations.mean(),
+        "mean_intra_burst_freq": np.nanmean(intra_freq) if np.isfinite(intra_freq).any() else np.nan,
+        "mean_inter_burst_interval": inter_burst.mean() if len(inter_burst) > 0 else np.nan,
+        "pct_spikes_in_bursts": 100.0 * spikes_per_burst.sum() / len(spike_times)
+    }
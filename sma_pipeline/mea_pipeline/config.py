@@ -0,0 +1,18 @@
+import os
+import yaml
+
+CONFIG_PATH = "config/config.yaml"
+
+_cache = {}
+
+
+def load_config(path=CONFIG_PATH):
+    # Parsed once per file version; edits to config.yaml are picked up on the next call
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _cache:
+        with open(path, "r") as f:
+            cfg = yaml.safe_load(f)
+        cfg["noise_threshold"] = float(cfg["noise_threshold"])
+        _cache.clear()
+        _cache[key] = cfg
+    return dict(_cache[key])
@@ -1,45 +1,42 @@
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.stats import mannwhitneyu
+import logging
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging
+from mea_pipeline.featureStore import FeatureStore, feature_store_path
+from mea_pipeline.groupStats import compare_groups, group_order
+from mea_pipeline.parallel import resolve_workers
+from mea_pipeline.plotting import feature_bar_job
+from mea_pipeline.plotQueue import submit_plot
 
-def run_feature_comparison(features_file="output/features/features_summary.csv", output_dir="output/features"):
-    if not os.path.exists(features_file):
-        return
-
-    df = pd.read_csv(features_file)
-    grouped = df.groupby("group").mean(numeric_only=True)
-    grouped.to_csv(os.path.join(output_dir, "grouped_features.csv"))
-
-    features = ["spike_count", "firing_rate", "isi_mean", "burst_count", "mean_spikes_per_burst"]
+log = logging.getLogger(__name__)
 
-    sns.set_theme(style="whitegrid")
-    sns.set_context("talk")
+def run_feature_comparison(output_dir="output/features", cfg=None, store=None, recordings=None):
+    # Reads the latest feature rows of `recordings` (all recordings by default) from the feature store
+    cfg = cfg if cfg is not None else load_config()
+    setup_logging(cfg)
+    if store is None:
+        store = FeatureStore(feature_store_path(cfg), cfg)
+    features = cfg.get("stats_features") or store.feature_columns()
+    features = [feat for feat in features if feat in set(store.columns())]
+    df = store.query(columns=["group"] + features, recordings=recordings)
+    if df.empty:
+        return
 
-    for feat in features:
-        if feat in df.columns:
-            plt.figure(figsize=(7,6))
-            ax = sns.barplot(data=df, x="group", y=feat, palette=["#4C72B0", "#55A868"], errorbar=None)
-            for patch in ax.patches:
-                patch.set_edgecolor("black")
-                patch.set_linewidth(1.2)
-            plt.title(f"{feat.replace('_',' ').title()} – Healthy vs SMA", fontsize=16, weight="bold")
-            plt.ylabel(feat.replace("_"," ").title(), fontsize=14)
-            plt.xlabel("")
-            plt.xticks(fontsize=13, weight="bold")
-            plt.yticks(fontsize=12)
-            out_path = os.path.join(output_dir, f"{feat}_barplot.png")
-            plt.savefig(out_path, dpi=300, bbox_inches="tight")
-            plt.close()
+    grouped = store.group_means(recordings=recordings)
+    grouped.reindex(group_order(grouped.index, cfg.get("groups"))).to_csv(
+        os.path.join(output_dir, "grouped_features.csv"))
 
-    results = []
     for feat in features:
-        if feat in df.columns:
-            h_vals = df[df["group"]=="Healthy"][feat].dropna()
-            s_vals = df[df["group"]=="SMA"][feat].dropna()
-            if len(h_vals) > 0 and len(s_vals) > 0:
-                _, p = mannwhitneyu(h_vals, s_vals, alternative="two-sided")
-                results.append({"feature": feat, "p_value": p})
+        out_path = os.path.join(output_dir, f"{feat}_barplot.png")
+        submit_plot(cfg, "features", feature_bar_job, df, feat, out_path)
 
-    pd.DataFrame(results).to_csv(os.path.join(output_dir, "feature_stats.csv"), index=False)
+    pairwise, omnibus = compare_groups(df, features, cfg.get("groups"),
+                                       n_permutations=int(cfg.get("stats_permutations", 10000)),
+                                       n_bootstrap=int(cfg.get("stats_bootstrap", 2000)),
+                                       ci=float(cfg.get("stats_ci", 0.95)),
+                                       correction=cfg.get("stats_correction", "fdr_bh"),
+                                       seed=cfg.get("stats_seed", 0), workers=resolve_workers(cfg))
+    pairwise.to_csv(os.path.join(output_dir, "feature_stats.csv"), index=False)
+    if omnibus is not None:
+        omnibus.to_csv(os.path.join(output_dir, "feature_stats_omnibus.csv"), index=False)
+    log.info("Saved group statistics for %s features: %s", len(features), os.path.join(output_dir, 'feature_stats.csv'))
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import pandas as pd
+from mea_pipeline.runCache import STAGE_CONFIG
+
+# Append-only SQLite store of per-channel features. Every pipeline run gets a run ID;
+# each recording it computes is appended as one batch of rows tagged with the run ID,
+# the recording's date and the hash of the config values that shape its features.
+# Nothing is overwritten: queries return the latest batch per recording (for the
+# current config hash by default), or the full history with latest=False. Indexes on
+# recording, date, group and channel keep those queries off full scans.
+
+log = logging.getLogger(__name__)
+
+KEY_COLUMNS = ("file", "channel", "group")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, started TEXT, mode TEXT, config_hash TEXT, config TEXT);
+CREATE TABLE IF NOT EXISTS batches (
+    batch INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT, recording TEXT, date TEXT, config_hash TEXT,
+    written TEXT);
+CREATE TABLE IF NOT EXISTS features (
+    batch INTEGER REFERENCES batches(batch), "file" TEXT, "channel" TEXT, "group" TEXT);
+CREATE INDEX IF NOT EXISTS batches_recording ON batches (recording, config_hash);
+CREATE INDEX IF NOT EXISTS batches_date ON batches (date);
+CREATE INDEX IF NOT EXISTS features_batch ON features (batch);
+CREATE INDEX IF NOT EXISTS features_group ON features ("group");
+CREATE INDEX IF NOT EXISTS features_channel ON features ("channel");
+"""
+
+
+def feature_store_path(cfg):
+    return cfg.get("feature_store") or os.path.join(cfg["output_dir"], "features", "features.sqlite")
+
+
+def config_hash(cfg):
+    # Hash of every config value the features depend on (clean, spike and feature stages)
+    params = {k: cfg.get(k) for stage in ("clean", "spikes", "features") for k in STAGE_CONFIG[stage]}
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def recording_date(name):
+    # Recording date from a YYYY-MM-DD / YYYYMMDD part of the file name, if there is one
+    m = re.search(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)", name)
+    return f"{m.group(1)}-{m.group(2)}-{m.group(3)}" if m else None
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _value(v):
+    # sqlite3 binds Python scalars only; NaN is stored as NULL
+    if v is None or pd.isna(v):
+        return None
+    return v.item() if hasattr(v, "item") else v
+
+
+class FeatureStore:
+    # With cfg, queries default to rows computed under its config hash
+    def __init__(self, path, cfg=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.run_id = None
+        self.config_hash = config_hash(cfg) if cfg is not None else None
+
+    def close(self):
+        self.conn.close()
+
+    def columns(self):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(features)")]
+
+    def feature_columns(self):
+        return [c for c in self.columns() if c != "batch" and c not in KEY_COLUMNS]
+
+    def begin_run(self, cfg, mode=None):
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.config_hash = config_hash(cfg)
+        with self.conn:
+            self.conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+                              (self.run_id, time.strftime("%Y-%m-%dT%H:%M:%S"), mode, self.config_hash,
+                               json.dumps(cfg, default=str)))
+        return self.run_id
+
+    def has(self, recording):
+        return self.conn.execute("SELECT 1 FROM batches WHERE recording = ? AND config_hash = ? LIMIT 1",
+                                 (recording, self.config_hash)).fetchone() is not None
+
+    def add_rows(self, recording, rows):
+        # One transaction per recording; new feature names become new columns
+        known = set(self.columns())
+        with self.conn:
+            for name in dict.fromkeys(k for row in rows for k in row):
+                if name not in known:
+                    self.conn.execute(f"ALTER TABLE features ADD COLUMN {_quote(name)}")
+                    known.add(name)
+            batch = self.conn.execute(
+                "INSERT INTO batches (run_id, recording, date, config_hash, written) VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, recording, recording_date(recording), self.config_hash,
+                 time.strftime("%Y-%m-%dT%H:%M:%S"))).lastrowid
+            for row in rows:
+                names = ["batch"] + list(row)
+                self.conn.execute(f"INSERT INTO features ({', '.join(map(_quote, names))}) "
+                                  f"VALUES ({', '.join('?' * len(names))})",
+                                  [batch] + [_value(v) for v in row.values()])
+        log.debug("Stored %s feature rows for %s (run %s)", len(rows), recording, self.run_id)
+
+    def _where(self, recordings=None, groups=None, channels=None, date_from=None, date_to=None,
+               config_hash="current", latest=True):
+        # SQL condition on `features f JOIN batches b` for the query filters
+        clauses, params = [], []
+
+        def isin(column, values):
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+        if config_hash == "current":
+            config_hash = self.config_hash
+        batch_clauses, batch_params = [], []
+        if config_hash is not None:
+            batch_clauses.append("config_hash = ?")
+            batch_params.append(config_hash)
+        if recordings is not None:
+            batch_clauses.append(f"recording IN ({', '.join('?' * len(recordings))})")
+            batch_params.extend(recordings)
+        if date_from is not None:
+            batch_clauses.append("date >= ?")
+            batch_params.append(date_from)
+        if date_to is not None:
+            batch_clauses.append("date <= ?")
+            batch_params.append(date_to)
+        batch_where = f"WHERE {' AND '.join(batch_clauses)}" if batch_clauses else ""
+        if latest:
+            clauses.append(f"f.batch IN (SELECT MAX(batch) FROM batches {batch_where} GROUP BY recording)")
+        else:
+            clauses.append(f"f.batch IN (SELECT batch FROM batches {batch_where})")
+        params.extend(batch_params)
+
+        if groups is not None:
+            isin('f."group"', list(groups))
+        if channels is not None:
+            isin('f."channel"', list(channels))
+        return " AND ".join(clauses), params
+
+    def query(self, columns=None, **filters):
+        # Feature rows matching the filters (recordings, groups, channels, date_from, date_to,
+        # config_hash, latest), by recording and then in the order they were written
+        columns = [c for c in self.columns() if c != "batch"] if columns is None else list(columns)
+        where, params = self._where(**filters)
+        select = ", ".join(["b.run_id", "b.recording", "b.date"] + [f"f.{_quote(c)}" for c in columns])
+        sql = (f"SELECT {select} FROM features f JOIN batches b ON f.batch = b.batch "
+               f"WHERE {where} ORDER BY b.recording, f.batch, f.rowid")
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def group_means(self, **filters):
+        # Per-group means of every feature column, aggregated inside SQLite over the rows in
+        # recording order, so rewriting one recording does not change the sums
+        features = self.feature_columns()
+        where, params = self._where(**filters)
+        inner = ", ".join(['f."group" AS "group"'] + [f"f.{_quote(c)} AS {_quote(c)}" for c in features])
+        select = ", ".join(['"group"'] + [f"AVG({_quote(c)}) AS {_quote(c)}" for c in features])
+        sql = (f"SELECT {select} FROM (SELECT {inner} FROM features f JOIN batches b ON f.batch = b.batch "
+               f'WHERE {where} ORDER BY b.recording, f.batch, f.rowid) GROUP BY "group" ORDER BY "group"')
+        return pd.read_sql_query(sql, self.conn, params=params).set_index("group")
+
+    def version(self, **filters):
+        # Identifies the selected batches; changes whenever a matching recording is appended
+        where, params = self._where(**filters)
+        batches = self.conn.execute(f"SELECT DISTINCT f.batch FROM features f JOIN batches b ON f.batch = b.batch "
+                                    f"WHERE {where} ORDER BY f.batch", params).fetchall()
+        return hashlib.sha256(json.dumps([b[0] for b in batches]).encode()).hexdigest()
@@ -1,89 +1,196 @@
 import os
+import logging
+from functools import partial
 import numpy as np
 import pandas as pd
-from scipy.signal import find_peaks
-
-def extract_features(output_dir="output/features", cleaned_dir="output/cleaned", fs=30000, thresh_mult=4, burst_isi=0.1):
-    os.makedirs(output_dir, exist_ok=True)
-    all_results = []
-
-    for fname in sorted(os.listdir(cleaned_dir)):
-        if not fname.endswith("_cleaned.csv"):
-            continue
-
-        cleaned_file = os.path.join(cleaned_dir, fname)
-        df = pd.read_csv(cleaned_file)
-        if "timestamps" not in df.columns:
-            continue
-
-        timestamps = df["timestamps"].values
-        ts_sec = timestamps if timestamps[1] - timestamps[0] < 1 else timestamps / fs
-        duration = ts_sec[-1] - ts_sec[0]
-
-        all_signals = df.drop(columns=["timestamps"]).values.flatten()
-        global_noise_std = np.std(all_signals)
-        global_threshold = thresh_mult * global_noise_std
-
-        for col in df.columns:
-            if col == "timestamps":
-                continue
-
-            signal = df[col].values
-
-            pos_peaks, _ = find_peaks(signal, height=global_threshold, distance=int(0.001 * fs))
-            neg_peaks, _ = find_peaks(-signal, height=global_threshold, distance=int(0.001 * fs))
-            spike_idx = np.sort(np.concatenate([pos_peaks, neg_peaks]))
-
-            spike_times = ts_sec[spike_idx]
-            spike_count = len(spike_times)
-            firing_rate = spike_count / duration if duration > 0 else np.nan
-
-            isi = np.diff(spike_times)
-            isi_mean = np.mean(isi) if len(isi) > 0 else np.nan
-
-            bursts = []
-            if len(isi) > 0:
-                current_burst = [spike_times[0]]
-                for i in range(1, len(spike_times)):
-                    if (spike_times[i] - spike_times[i-1]) <= burst_isi:
-                        current_burst.append(spike_times[i])
-                    else:
-                        if len(current_burst) > 1:
-                            bursts.append(current_burst)
-                        current_burst = [spike_times[i]]
-                if len(current_burst) > 1:
-                    bursts.append(current_burst)
-
-            burst_count = len(bursts)
-            mean_spikes_per_burst = np.mean([len(b) for b in bursts]) if burst_count > 0 else np.nan
-
-            group = "Healthy" if col.startswith(("highpass_C", "highpass_D")) else "SMA"
-
-        
-            if firing_rate > 100 or (isi_mean is not np.nan and isi_mean < 0.002):
-                continue
-
-            all_results.append({
-                "file": fname,
-                "channel": col,
-                "spike_count": spike_count,
-                "firing_rate": firing_rate,
-                "isi_mean": isi_mean,
-                "burst_count": burst_count,
-                "mean_spikes_per_burst": mean_spikes_per_burst,
-                "group": group
-            })
-
+from mea_pipeline.bursts import burst_metrics
+from mea_pipeline.groupStats import assign_group
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging, span, add_samples
+from mea_pipeline.network import network_params, add_network_features, save_network_summary
+from mea_pipeline.waveforms import waveform_params, add_unit_features, save_unit_summary
+from mea_pipeline.parallel import split_workers, imap_files
+from mea_pipeline.preProcessing import recording_bases
+from mea_pipeline.snr import save_snr_summary
+from mea_pipeline.spikeEngine import spike_thresholds, detect_multichannel
+from mea_pipeline.runCache import feature_rows_path
+from mea_pipeline.signalStore import list_cleaned, load_cleaned, store_base
+from mea_pipeline.spikeTrains import load_spike_train, as_spikes
+
+log = logging.getLogger(__name__)
+
+def channel_features(fname, col, spike_times, duration, burst_isi=0.1, burst_min_spikes=2, groups=None):
+    spike_count = len(spike_times)
+    firing_rate = spike_count / duration if duration > 0 else np.nan
+
+    isi = np.diff(spike_times)
+    isi_mean = np.mean(isi) if len(isi) > 0 else np.nan
+
+    group = assign_group(fname, col, groups)
+
+    if firing_rate > 100 or (isi_mean is not np.nan and isi_mean < 0.002):
+        return None
+
+    return {
+        "file": fname,
+        "channel": col,
+        "spike_count": spike_count,
+        "firing_rate": firing_rate,
+        "isi_mean": isi_mean,
+        **burst_metrics(spike_times, burst_isi, burst_min_spikes),
+        "group": group
+    }
+
+def extract_recording_features(rec, fs=30000, thresh_mult=4, burst_isi=0.1, workers=1, min_samples=0,
+                               policy="channel", estimator="std", spikes=None, burst_min_spikes=2, groups=None,
+                               network=None, waveforms=None):
+    # `spikes` is detect_recording_spikes' result for this recording; without it the
+    # recording is detected here with the same engine and threshold policy. `network` and
+    # `waveforms` are network_params(cfg) / waveform_params(cfg): their per-channel
+    # features are merged into the rows
+    fname = rec["name"]
+    results = []
+
+    timestamps = rec["timestamps"]
+    ts_sec = timestamps if timestamps[1] - timestamps[0] < 1 else timestamps / fs
+    duration = ts_sec[-1] - ts_sec[0]
+
+    if spikes is None:
+        thresholds = spike_thresholds(rec["signals"], thresh_mult, policy, estimator)
+        all_indices, _ = detect_multichannel(rec["signals"], thresholds, int(0.001 * fs), workers, min_samples)
+    else:
+        all_indices = spikes["indices"]
+
+    for col, spike_idx in zip(rec["channels"], all_indices):
+        row = channel_features(fname, col, ts_sec[spike_idx], duration, burst_isi, burst_min_spikes, groups)
+        if row is not None:
+            results.append(row)
+
+    results = add_unit_features(results, fname, rec["signals"], list(rec["channels"]), all_indices, ts_sec, waveforms,
+                                workers, min_samples)
+    spike_times = [np.asarray(ts_sec[idx]) for idx in all_indices]
+    return add_network_features(results, fname, list(rec["channels"]), spike_times, ts_sec[0], ts_sec[-1], network)
+
+def save_features(all_results, output_dir="output/features", write_csv=True):
     if not all_results:
-        print(" No valid features extracted")
+        log.warning(" No valid features extracted")
         return
+    if not write_csv:
+        return pd.DataFrame(all_results)
 
+    os.makedirs(output_dir, exist_ok=True)
     df_out = pd.DataFrame(all_results)
     out_file = os.path.join(output_dir, "features_summary.csv")
     df_out.to_csv(out_file, index=False)
-    print(f"Features saved to {out_file}")
+    log.info("Features saved to %s", out_file)
     return df_out
 
+def _features_file(cleaned_file, spikes_dir=None, **kwargs):
+    # Reuse the spike train detect_spikes saved for this recording instead of detecting again
+    rec = load_cleaned(cleaned_file)
+    with span("features", file=rec["name"]):
+        add_samples(rec["signals"].size)
+        train_file = os.path.join(spikes_dir, f"{rec['name']}_spikes.npz") if spikes_dir else None
+        if train_file and os.path.exists(train_file):
+            kwargs["spikes"] = as_spikes(load_spike_train(train_file))
+        return extract_recording_features(rec, **kwargs)
+
+def save_feature_rows(rows, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(rows, columns=list(rows[0]) if rows else ["file"]).to_csv(path, index=False)
+
+def load_feature_rows(path):
+    return pd.read_csv(path, float_precision="round_trip").to_dict("records")
+
+def project_feature_rows(cfg, rows_by_base):
+    # features_summary.csv covers every recording of the project, so a run over some of them
+    # takes the other recordings' rows from the per-file tables of their last run
+    rows = []
+    for base in recording_bases(cfg, rows_by_base):
+        if base in rows_by_base:
+            rows.extend(rows_by_base[base])
+        elif os.path.exists(feature_rows_path(cfg, base)):
+            rows.extend(load_feature_rows(feature_rows_path(cfg, base)))
+    return rows
+
+def store_recording_rows(cfg, base, rows, store=None, cache=None, keys=None, save_store=True):
+    # Keeps one finished recording: its per-file rows (cfg), run cache entries ({stage: key})
+    # and FeatureStore batch
+    if cfg is not None:
+        save_feature_rows(rows, feature_rows_path(cfg, base))
+    if cache is not None and keys is not None:
+        cache.record_file(base, keys, save_store)
+    if store is not None:
+        store.add_rows(base, rows)
+
+def keep_feature_rows(cfg, bases, computed, store=None, cache=None, keys=None, save_store=True):
+    # computed: (base, rows) pairs, stored as each recording finishes rather than after the
+    # whole batch; the other bases are up to date and reuse the rows of their last run.
+    # keys: {base: {stage: key}} to record in the cache. -> {base: rows} for every base
+    rows_by_base = {}
+    for base, rows in computed:
+        store_recording_rows(cfg, base, rows, store, cache, (keys or {}).get(base), save_store)
+        rows_by_base[base] = rows
+    for base in bases:
+        if base not in rows_by_base:
+            rows = load_feature_rows(feature_rows_path(cfg, base))
+            if store is not None and not store.has(base):
+                store.add_rows(base, rows)
+            rows_by_base[base] = rows
+    return rows_by_base
+
+def save_project_summaries(cfg, rows_by_base):
+    # features_summary.csv plus the SNR, network and unit summaries, each over the whole project
+    names = [f"{base}_cleaned" for base in rows_by_base]
+    df = save_features(project_feature_rows(cfg, rows_by_base), os.path.join(cfg["output_dir"], "features"),
+                       cfg.get("write_features_csv", True))
+    save_snr_summary(cfg, names)
+    save_network_summary(cfg, names)
+    save_unit_summary(cfg, names)
+    return df
+
+def extract_features(output_dir="output/features", cleaned_dir="output/cleaned", fs=30000, thresh_mult=4, burst_isi=0.1,
+                     workers=1, min_samples=0, policy="channel", estimator="std", spikes_dir="output/spike/trains",
+                     burst_min_spikes=2, cache=None, bases=None, store=None, write_csv=True, groups=None,
+                     network=None, waveforms=None, cfg=None):
+    # With a FeatureStore, the rows of every recording computed here (or missing from the
+    # store) are appended to it. With cfg, per-file rows are kept and the summaries are
+    # project-wide (save_project_summaries).
+    files = list_cleaned(cleaned_dir, bases)
+    todo_files, keys = files, None
+    if cache is not None:
+        # Up-to-date recordings contribute the rows saved by their last run
+        todo = cache.stale("features", {store_base(f): f for f in files})
+        todo_files = [f for f, _ in todo.values()]
+        keys = {base: {"features": key} for base, (_, key) in todo.items()}
+        cfg = cfg if cfg is not None else cache.cfg
+
+    file_workers, channel_workers = split_workers(len(todo_files), workers)
+    computed = imap_files(partial(_features_file, spikes_dir=spikes_dir, fs=fs, thresh_mult=thresh_mult,
+                                  burst_isi=burst_isi, workers=channel_workers, min_samples=min_samples,
+                                  policy=policy, estimator=estimator, burst_min_spikes=burst_min_spikes, groups=groups,
+                                  network=network, waveforms=waveforms),
+                          todo_files, file_workers)
+
+    rows_by_base = keep_feature_rows(cfg, [store_base(f) for f in files],
+                                     zip([store_base(f) for f in todo_files], computed), store, cache, keys)
+    if cfg is None:
+        return save_features([row for rows in rows_by_base.values() for row in rows], output_dir, write_csv)
+    return save_project_summaries(cfg, rows_by_base)
+
+def features_from_config(cfg, workers=1, cache=None, bases=None, store=None):
+    setup_logging(cfg)
+    return extract_features(os.path.join(cfg["output_dir"], "features"), os.path.join(cfg["output_dir"], "cleaned"),
+                            fs=cfg["fs"], thresh_mult=cfg["spike_threshold_multiplier"],
+                            burst_isi=cfg.get("burst_isi", 0.1), burst_min_spikes=cfg.get("burst_min_spikes", 2),
+                            workers=workers, min_samples=cfg.get("parallel_min_samples", 0),
+                            policy=cfg.get("spike_threshold_policy", "channel"),
+                            estimator=cfg.get("spike_noise_estimator", "std"),
+                            spikes_dir=os.path.join(cfg["output_dir"], "spike", "trains"), cache=cache, bases=bases,
+                            store=store, write_csv=cfg.get("write_features_csv", True), groups=cfg.get("groups"),
+                          network=network_params(cfg), waveforms=waveform_params(cfg), cfg=cfg)
+
 
 if __name__ == "__main__":
+    setup_logging(load_config())
     extract_features()
@@ -0,0 +1,202 @@
+import fnmatch
+from functools import partial
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu, kruskal
+from mea_pipeline.parallel import map_files
+
+# Group comparisons over the feature table. Channels get their group from the `groups`
+# config mapping; every numeric feature is tested at once per pair of groups:
+#   - Mann-Whitney U (scipy, vectorized over the feature axis), plus Kruskal-Wallis
+#     across all groups when there are more than two
+#   - a permutation test on the difference of means: label permutations are a 0/1
+#     matrix, so every permutation of a block is one matrix product with the
+#     (channels x features) table
+#   - a bootstrap percentile CI for the difference of means, from resampling count
+#     weights the same way
+# Resampling runs in blocks whose generators are spawned from one SeedSequence, so the
+# results depend on the seed only, not on the number of workers. p-values are corrected
+# for multiple comparisons over the whole table (Benjamini-Hochberg, Holm or Bonferroni).
+
+DEFAULT_GROUPS = {"Healthy": ["highpass_C*", "highpass_D*"], "SMA": ["*"]}
+
+UNASSIGNED = "unassigned"
+
+
+def assign_group(recording, channel, groups=None):
+    # First group with a glob pattern matching the channel or recording name
+    for group, patterns in (groups or DEFAULT_GROUPS).items():
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        if any(fnmatch.fnmatchcase(channel, p) or fnmatch.fnmatchcase(recording, p) for p in patterns):
+            return group
+    return UNASSIGNED
+
+
+def group_order(labels, groups=None):
+    # Configured order first, then any other labels present
+    present = list(dict.fromkeys(labels))
+    ordered = [g for g in (groups or DEFAULT_GROUPS) if g in present]
+    return ordered + sorted(g for g in present if g not in ordered and g != UNASSIGNED)
+
+
+def adjust_pvalues(p, method="fdr_bh"):
+    # Multiple-comparison correction over one family; NaNs are left out
+    p = np.asarray(p, dtype=float)
+    out = np.full(p.shape, np.nan)
+    ok = np.isfinite(p)
+    m = int(ok.sum())
+    if m == 0 or method in (None, "none"):
+        out[ok] = p[ok]
+        return out
+    values = p[ok]
+    order = np.argsort(values)
+    ranked = values[order]
+    if method == "bonferroni":
+        adj = np.minimum(values * m, 1.0)
+    elif method == "holm":
+        steps = np.maximum.accumulate(ranked * (m - np.arange(m)))
+        adj = np.empty(m)
+        adj[order] = np.minimum(steps, 1.0)
+    elif method == "fdr_bh":
+        steps = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+        adj = np.empty(m)
+        adj[order] = np.minimum(steps, 1.0)
+    else:
+        raise ValueError(f"Unknown multiple-comparison correction: {method}")
+    out[ok] = adj
+    return out
+
+
+def _weighted_means(weights, x0, valid):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (weights @ x0) / (weights @ valid)
+
+
+def _permutation_block(seed, size, x, n_a, observed):
+    # Count of label permutations with |mean_a - mean_b| >= |observed|, per feature
+    rng = np.random.default_rng(seed)
+    valid = np.isfinite(x).astype(float)
+    x0 = np.where(valid > 0, x, 0.0)
+    # Each row labels a random n_a-subset: the rows holding its n_a smallest random keys
+    keys = rng.random((size, len(x)))
+    labels = (keys < np.partition(keys, n_a, axis=1)[:, n_a:n_a + 1]).astype(float) if n_a < len(x) \
+        else np.ones((size, len(x)))
+    sum_a, count_a = labels @ x0, labels @ valid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diff = sum_a / count_a - (x0.sum(axis=0) - sum_a) / (valid.sum(axis=0) - count_a)
+    # Relative tolerance so permutations that reproduce the observed split count as extreme
+    return (np.abs(diff) >= np.abs(observed) * (1 - 1e-12)).sum(axis=0)
+
+
+def _bootstrap_block(seed, size, xa, xb):
+    # Differences of means for `size` bootstrap resamples of each group
+    rng = np.random.default_rng(seed)
+    out = []
+    for x in (xa, xb):
+        valid = np.isfinite(x).astype(float)
+        # Resampling counts per row, from one flat bincount of the drawn indices
+        n = len(x)
+        draws = rng.integers(0, n, (size, n)) + n * np.arange(size)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(float)
+        out.append(_weighted_means(weights, np.where(valid > 0, x, 0.0), valid))
+    return out[0] - out[1]
+
+
+def _blocks(seed_seq, total, block_size):
+    sizes = [block_size] * (total // block_size) + ([total % block_size] if total % block_size else [])
+    return list(zip(seed_seq.spawn(len(sizes)), sizes))
+
+
+def _resample_block(task, pairs):
+    kind, i, seed, size = task
+    xa, xb = pairs[i]
+    if kind == "perm":
+        with np.errstate(invalid="ignore"):
+            observed = np.nanmean(xa, axis=0) - np.nanmean(xb, axis=0)
+        return _permutation_block(seed, size, np.vstack([xa, xb]), len(xa), observed)
+    return _bootstrap_block(seed, size, xa, xb)
+
+
+def resample_pairs(pairs, n_permutations=10000, n_bootstrap=2000, ci=0.95, seed=0, workers=1, block_size=500):
+    # pairs: [(xa, xb)] -> [(permutation p-values, ci_low, ci_high)], per feature column.
+    # All blocks of all pairs go through one pool; each pair's permutation and bootstrap
+    # streams are spawned from `seed`, so the result does not depend on `workers`.
+    tasks = []
+    for i, pair_seed in enumerate(np.random.SeedSequence(seed).spawn(len(pairs))):
+        perm_seed, boot_seed = pair_seed.spawn(2)
+        tasks += [("perm", i, s, n) for s, n in _blocks(perm_seed, n_permutations, block_size)]
+        tasks += [("boot", i, s, n) for s, n in _blocks(boot_seed, n_bootstrap, block_size)]
+    results = map_files(partial(_resample_block, pairs=pairs), tasks, workers)
+
+    alpha = (1 - ci) / 2
+    out = []
+    for i, (xa, xb) in enumerate(pairs):
+        counts = [r for t, r in zip(tasks, results) if t[:2] == ("perm", i)]
+        diffs = [r for t, r in zip(tasks, results) if t[:2] == ("boot", i)]
+        with np.errstate(invalid="ignore"):
+            observed = np.nanmean(xa, axis=0) - np.nanmean(xb, axis=0)
+        p = np.full(xa.shape[1], np.nan)
+        if counts:
+            p = np.where(np.isfinite(observed), (1 + np.sum(counts, axis=0)) / (1 + n_permutations), np.nan)
+        low = high = np.full(xa.shape[1], np.nan)
+        if diffs:
+            diffs = np.vstack(diffs)
+            low, high = np.nanquantile(diffs, alpha, axis=0), np.nanquantile(diffs, 1 - alpha, axis=0)
+        out.append((p, low, high))
+    return out
+
+
+def rank_test(xa, xb):
+    # Mann-Whitney U per feature column. Large columns go through one vectorized
+    # asymptotic call; columns where scipy would pick the exact test (a group of at most
+    # 8 values) are tested one by one so their p-values match a per-feature call.
+    u, p = mannwhitneyu(xa, xb, alternative="two-sided", axis=0, nan_policy="omit", method="asymptotic")
+    u, p = np.array(u, dtype=float, ndmin=1), np.array(p, dtype=float, ndmin=1)
+    for c in range(xa.shape[1]):
+        a, b = xa[:, c][np.isfinite(xa[:, c])], xb[:, c][np.isfinite(xb[:, c])]
+        if min(len(a), len(b)) <= 8:
+            u[c], p[c] = mannwhitneyu(a, b, alternative="two-sided")
+    return u, p
+
+
+def compare_groups(df, features, groups=None, n_permutations=10000, n_bootstrap=2000, ci=0.95,
+                   correction="fdr_bh", seed=0, workers=1):
+    # -> (pairwise table, omnibus table or None); one row per (feature, pair of groups)
+    order = group_order(df["group"], groups)
+    data = {g: df.loc[df["group"] == g, features].to_numpy(dtype=float) for g in order}
+
+    pairs, tests = [], []
+    for a, b in combinations(order, 2):
+        n_a, n_b = np.isfinite(data[a]).sum(axis=0), np.isfinite(data[b]).sum(axis=0)
+        cols = np.flatnonzero((n_a > 0) & (n_b > 0))
+        if len(cols):
+            pairs.append((data[a][:, cols], data[b][:, cols]))
+            tests.append((a, b, cols, n_a, n_b))
+    resampled = resample_pairs(pairs, n_permutations, n_bootstrap, ci, seed, workers)
+
+    rows = []
+    for (xa, xb), (a, b, cols, n_a, n_b), (p_perm, low, high) in zip(pairs, tests, resampled):
+        u, p = rank_test(xa, xb)
+        with np.errstate(invalid="ignore"):
+            mean_a, mean_b = np.nanmean(xa, axis=0), np.nanmean(xb, axis=0)
+        for j, c in enumerate(cols):
+            rows.append({"feature": features[c], "group_a": a, "group_b": b, "n_a": int(n_a[c]), "n_b": int(n_b[c]),
+                         "mean_a": mean_a[j], "mean_b": mean_b[j], "mean_diff": mean_a[j] - mean_b[j],
+                         "ci_low": low[j], "ci_high": high[j], "U": u[j], "p_value": p[j], "p_perm": p_perm[j]})
+
+    pairwise = pd.DataFrame(rows, columns=["feature", "group_a", "group_b", "n_a", "n_b", "mean_a", "mean_b",
+                                           "mean_diff", "ci_low", "ci_high", "U", "p_value", "p_perm"])
+    pairwise["p_value_adj"] = adjust_pvalues(pairwise["p_value"], correction)
+    pairwise["p_perm_adj"] = adjust_pvalues(pairwise["p_perm"], correction)
+
+    omnibus = None
+    if len(order) > 2:
+        samples = [data[g] for g in order]
+        with np.errstate(invalid="ignore"):
+            h, p = kruskal(*samples, axis=0, nan_policy="omit")
+        omnibus = pd.DataFrame({"feature": features, "groups": len(order), "H": np.atleast_1d(h),
+                                "p_value": np.atleast_1d(p)})
+        omnibus["p_value_adj"] = adjust_pvalues(omnibus["p_value"], correction)
+    return pairwise, omnibus
@@ -0,0 +1,245 @@
+import os
+import csv
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (enables pandas' pyarrow CSV engine)
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Raw recording loader. A recording is timestamps (float64, seconds) plus a
+# (samples x channels) signal array with its `*_values` channel names, whatever the
+# file format:
+#   .csv        timestamp column first, then the channel columns; only the timestamp
+#               and `_values` columns are parsed, with the pyarrow engine when installed
+#   .npy        2-D array, column 0 timestamps; channel names from {stem}_channels.txt
+#               (one per line) when present
+#   .npz        arrays `timestamps`, `signals` and optionally `channels`
+#   .h5/.hdf5   datasets `timestamps`, `signals` and optionally `channels` (needs h5py)
+# A CSV is converted on first read to raw binary files in the raw cache, keyed on its
+# path, size and mtime, and memory-mapped from there on later runs.
+
+log = logging.getLogger(__name__)
+
+RAW_EXTENSIONS = (".csv", ".npy", ".npz", ".h5", ".hdf5")
+
+
+def is_raw(filename):
+    # Ground-truth sidecars of synthetic recordings ({base}_truth.npz) are not recordings
+    name = filename.lower()
+    return name.endswith(RAW_EXTENSIONS) and not name.endswith("_truth.npz")
+
+
+def raw_dtype(cfg=None):
+    return np.dtype((cfg or {}).get("raw_dtype", "float64"))
+
+
+def csv_engine(cfg=None):
+    engine = (cfg or {}).get("csv_engine", "auto")
+    if engine == "auto":
+        return "pyarrow" if HAVE_PYARROW else "c"
+    return engine
+
+
+def csv_columns(path):
+    # Raw header names (as pandas sees them, without a UTF-8 BOM) of the timestamp and
+    # `_values` columns
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        return header_columns(next(csv.reader(f)))
+
+
+def header_columns(header):
+    values = [c for c in header[1:] if c.strip().endswith("_values")]
+    return [header[0]] + values, [c.strip() for c in values]
+
+
+def _default_channels(n):
+    return [f"ch{i:02d}_values" for i in range(n)]
+
+
+def _as_recording(timestamps, signals, channels, dtype):
+    channels = [str(c) for c in channels] if channels is not None else _default_channels(signals.shape[1])
+    return {"timestamps": np.asarray(timestamps, dtype=np.float64),
+            "signals": np.asarray(signals, dtype=dtype),
+            "channels": channels}
+
+
+def _read_npy(path, dtype):
+    data = np.load(path, mmap_mode="r")
+    names_file = os.path.splitext(path)[0] + "_channels.txt"
+    channels = None
+    if os.path.exists(names_file):
+        with open(names_file) as f:
+            channels = [line.strip() for line in f if line.strip()]
+    return _as_recording(data[:, 0], data[:, 1:], channels, dtype)
+
+
+def _read_npz(path, dtype):
+    with np.load(path) as z:
+        channels = list(z["channels"]) if "channels" in z.files else None
+        return _as_recording(z["timestamps"], z["signals"], channels, dtype)
+
+
+def _read_h5(path, dtype):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError(f"Reading {path} needs h5py (pip install h5py)")
+    with h5py.File(path, "r") as f:
+        channels = [c.decode() if isinstance(c, bytes) else c for c in f["channels"][()]] if "channels" in f else None
+        return _as_recording(f["timestamps"][()], f["signals"][()], channels, dtype)
+
+
+def _read_csv(path, dtype, engine="c", chunksize=None):
+    usecols, channels = csv_columns(path)
+    kwargs = {"usecols": usecols, "dtype": {c: (np.float64 if i == 0 else dtype) for i, c in enumerate(usecols)}}
+    if chunksize is not None:
+        # The pyarrow engine cannot stream; chunked reads use the C parser
+        return pd.read_csv(path, chunksize=chunksize, **kwargs), usecols, channels
+    return pd.read_csv(path, engine=engine, **kwargs), usecols, channels
+
+
+# Binary cache
+
+def cache_dir(cfg):
+    if not cfg or not cfg.get("raw_cache", True):
+        return None
+    return cfg.get("raw_cache_dir") or os.path.join(cfg["output_dir"], ".raw_cache")
+
+
+def _source_id(path):
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+
+
+def _cache_key(path, dtype):
+    # Files of the same name in different directories get separate entries
+    st = os.stat(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem, f"{stem}-{_source_id(path)}-{st.st_size}-{st.st_mtime_ns}-{dtype.name}"
+
+
+def _cache_path(cfg, path, dtype):
+    root = cache_dir(cfg)
+    if root is None:
+        return None, None
+    _, key = _cache_key(path, dtype)
+    return root, os.path.join(root, key)
+
+
+def _load_cached(entry):
+    with open(os.path.join(entry, "meta.json")) as f:
+        meta = json.load(f)
+    n, dtype = meta["n_samples"], np.dtype(meta["dtype"])
+    timestamps = np.memmap(os.path.join(entry, "timestamps.bin"), dtype=np.float64, mode="r", shape=(n,))
+    signals = np.memmap(os.path.join(entry, "signals.bin"), dtype=dtype, mode="r", shape=(n, len(meta["channels"])))
+    return {"timestamps": timestamps, "signals": signals, "channels": meta["channels"]}
+
+
+class _CacheWriter:
+    # Appends chunks to a temporary entry; commit() renames it into place and drops
+    # entries of older versions of the same source path and dtype
+    def __init__(self, root, entry, channels, dtype, source):
+        self.root, self.entry, self.channels, self.dtype, self.source = root, entry, channels, dtype, source
+        self.tmp = entry + f".tmp{os.getpid()}"
+        os.makedirs(self.tmp, exist_ok=True)
+        self.ts = open(os.path.join(self.tmp, "timestamps.bin"), "wb")
+        self.sig = open(os.path.join(self.tmp, "signals.bin"), "wb")
+        self.n = 0
+
+    def write(self, timestamps, signals):
+        np.ascontiguousarray(timestamps, dtype=np.float64).tofile(self.ts)
+        np.ascontiguousarray(signals, dtype=self.dtype).tofile(self.sig)
+        self.n += len(timestamps)
+
+    def commit(self):
+        self.ts.close()
+        self.sig.close()
+        with open(os.path.join(self.tmp, "meta.json"), "w") as f:
+            json.dump({"n_samples": self.n, "dtype": self.dtype.name, "channels": self.channels,
+                       "source": os.path.abspath(self.source)}, f)
+        _, source_id, _, _, dtype = os.path.basename(self.entry).rsplit("-", 4)
+        for old in os.listdir(self.root):
+            old_path = os.path.join(self.root, old)
+            parts = old.rsplit("-", 4)
+            if len(parts) == 5 and (parts[1], parts[4]) == (source_id, dtype) and old_path != self.entry:
+                shutil.rmtree(old_path, ignore_errors=True)
+        shutil.rmtree(self.entry, ignore_errors=True)
+        os.replace(self.tmp, self.entry)
+        log.info("  Cached raw binary: %s", self.entry)
+
+    def abort(self):
+        self.ts.close()
+        self.sig.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+# Loader interface
+
+def load_raw(path, cfg=None):
+    # -> {"timestamps", "signals", "channels"}; CSVs come from the binary cache when current
+    dtype = raw_dtype(cfg)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return _read_npy(path, dtype)
+    if ext == ".npz":
+        return _read_npz(path, dtype)
+    if ext in (".h5", ".hdf5"):
+        return _read_h5(path, dtype)
+
+    root, entry = _cache_path(cfg, path, dtype)
+    if entry is not None and os.path.exists(entry):
+        return _load_cached(entry)
+
+    df, usecols, channels = _read_csv(path, dtype, csv_engine(cfg))
+    rec = {"timestamps": df[usecols[0]].to_numpy(np.float64), "signals": df[usecols[1:]].to_numpy(dtype),
+           "channels": channels}
+    if entry is not None:
+        os.makedirs(root, exist_ok=True)
+        writer = _CacheWriter(root, entry, channels, dtype, path)
+        try:
+            writer.write(rec["timestamps"], rec["signals"])
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+    return rec
+
+
+def iter_raw_chunks(path, chunk_size, cfg=None):
+    # Yields (timestamps, signals, channels) blocks of chunk_size samples. A CSV without a
+    # current cache entry is parsed in chunks and converted to the cache on the way.
+    dtype = raw_dtype(cfg)
+    root, entry = _cache_path(cfg, path, dtype)
+    if not path.lower().endswith(".csv") or (entry is not None and os.path.exists(entry)):
+        rec = load_raw(path, cfg)
+        for start in range(0, len(rec["timestamps"]), chunk_size):
+            yield (np.asarray(rec["timestamps"][start:start + chunk_size]),
+                   np.asarray(rec["signals"][start:start + chunk_size]), rec["channels"])
+        return
+
+    reader, usecols, channels = _read_csv(path, dtype, chunksize=chunk_size)
+    writer = None
+    if entry is not None:
+        os.makedirs(root, exist_ok=True)
+        writer = _CacheWriter(root, entry, channels, dtype, path)
+    try:
+        for df in reader:
+            ts, x = df[usecols[0]].to_numpy(np.float64), df[usecols[1:]].to_numpy(dtype)
+            if writer is not None:
+                writer.write(ts, x)
+            yield ts, x, channels
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    else:
+        if writer is not None:
+            writer.commit()
+    finally:
+        reader.close()
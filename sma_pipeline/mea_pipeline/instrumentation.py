@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Nested timing spans for a pipeline run. Each span records wall and CPU time, bytes
+# read/written by the process, peak RSS and the channel-samples it processed; spans
+# opened inside file or channel workers are shipped back with the result (see
+# parallel.map_files) and attached under the span that launched them. run_pipeline
+# writes the tree as a JSON run report in output/reports.
+
+log = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(message)s"
+
+_recorder = None
+
+
+def setup_logging(cfg):
+    # Stage messages go through `logging`; log_level applies to the pipeline loggers,
+    # log_levels overrides single modules (e.g. mea_pipeline.plotting: WARNING)
+    logger = logging.getLogger("mea_pipeline")
+    logger.setLevel(str(cfg.get("log_level", "INFO")).upper())
+    for name, level in (cfg.get("log_levels") or {}).items():
+        logging.getLogger(name).setLevel(str(level).upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+        logger.propagate = False
+    if cfg.get("log_file") and not any(isinstance(h, logging.FileHandler) for h in logger.handlers):
+        os.makedirs(os.path.dirname(cfg["log_file"]) or ".", exist_ok=True)
+        handler = logging.FileHandler(cfg["log_file"])
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+def _io_bytes():
+    # Bytes passed through read/write calls (page-cache hits included); Linux only
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _sample():
+    read, written = _io_bytes()
+    return {"wall": time.perf_counter(), "cpu": time.process_time(), "read": read, "written": written,
+            "rss": _peak_rss_mb()}
+
+
+def _delta(a, b):
+    return b - a if a is not None and b is not None else None
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.samples = 0
+        self.metrics = {}
+        self._start = _sample()
+
+    def close(self):
+        end = _sample()
+        self.samples += sum(c["samples"] for c in self.children)
+        self.metrics = {
+            "wall_s": end["wall"] - self._start["wall"],
+            "cpu_s": end["cpu"] - self._start["cpu"],
+            "read_bytes": _delta(self._start["read"], end["read"]),
+            "written_bytes": _delta(self._start["written"], end["written"]),
+            "peak_rss_mb": end["rss"],
+            "rss_growth_mb": _delta(self._start["rss"], end["rss"]),
+            "pid": os.getpid()
+        }
+
+    def to_dict(self):
+        out = {"name": self.name, **self.attrs, **self.metrics, "samples": self.samples}
+        if self.metrics.get("wall_s") and self.samples:
+            out["samples_per_s"] = self.samples / self.metrics["wall_s"]
+        out["children"] = self.children
+        return out
+
+
+class Recorder:
+    def __init__(self, profile_stage=None, profiler="cprofile", profile_dir=None):
+        self.pid = os.getpid()
+        self.root = Span("run", {})
+        self.stack = [self.root]
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.profiles = []
+
+    def open(self, name, attrs):
+        span = Span(name, attrs)
+        self.stack.append(span)
+        return span
+
+    def close(self, span):
+        span.close()
+        self.stack.pop()
+        self.stack[-1].children.append(span.to_dict())
+
+
+def _active():
+    return _recorder if _recorder is not None and _recorder.pid == os.getpid() else None
+
+
+def tracing():
+    return _active() is not None
+
+
+@contextmanager
+def span(name, **attrs):
+    rec = _active()
+    if rec is None:
+        yield None
+        return
+    s = rec.open(name, attrs)
+    profile = _profiler(rec, name) if len(rec.stack) == 2 and name == rec.profile_stage else nullcontext()
+    try:
+        with profile:
+            yield s
+    finally:
+        rec.close(s)
+
+
+def add_samples(n):
+    # Channel-samples processed by the innermost open span
+    rec = _active()
+    if rec is not None:
+        rec.stack[-1].samples += int(n)
+
+
+def attach(spans):
+    # Spans recorded in a worker process, added under the current span
+    rec = _active()
+    if rec is not None and spans:
+        rec.stack[-1].children.extend(spans)
+
+
+def traced_call(func, *args):
+    # Runs func in a worker with its own recorder -> (result, spans)
+    global _recorder
+    outer, _recorder = _recorder, Recorder()
+    try:
+        result = func(*args)
+        return result, _recorder.root.children
+    finally:
+        _recorder = outer
+
+
+@contextmanager
+def _profiler(rec, name):
+    os.makedirs(rec.profile_dir, exist_ok=True)
+    if rec.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            log.warning("pyinstrument is not installed; profiling %s with cProfile", name)
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = os.path.join(rec.profile_dir, f"profile_{name}.html")
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+                rec.profiles.append(path)
+                log.info("Saved profile: %s", path)
+            return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(rec.profile_dir, f"profile_{name}.prof")
+        profiler.dump_stats(path)
+        rec.profiles.append(path)
+        log.info("Saved profile: %s (view with python -m pstats or snakeviz)", path)
+
+
+def start_run(cfg, profile_stage=None):
+    global _recorder
+    report_dir = os.path.join(cfg["output_dir"], "reports")
+    _recorder = Recorder(profile_stage or cfg.get("profile_stage"), cfg.get("profiler", "cprofile"), report_dir)
+    _recorder.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return _recorder
+
+
+def totals_by_name(spans, prefix="", out=None):
+    # Wall time and samples summed per span path (e.g. clean/file/interpolate) over the tree
+    out = {} if out is None else out
+    for s in spans:
+        key = f"{prefix}/{s['name']}" if prefix else s["name"]
+        t = out.setdefault(key, {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "samples": 0})
+        t["count"] += 1
+        t["wall_s"] += s.get("wall_s") or 0.0
+        t["cpu_s"] += s.get("cpu_s") or 0.0
+        t["samples"] += s.get("samples") or 0
+        totals_by_name(s["children"], key, out)
+    return out
+
+
+def finish_run(cfg, **extra):
+    # Closes the run span and writes output/reports/run_<timestamp>.json
+    global _recorder
+    rec, _recorder = _recorder, None
+    if rec is None or rec.pid != os.getpid():
+        return None
+    rec.root.close()
+    report = {
+        "started": rec.started,
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **extra,
+        "config": cfg,
+        "run": {k: v for k, v in rec.root.to_dict().items() if k != "children"},
+        "totals": totals_by_name(rec.root.children),
+        "profiles": rec.profiles,
+        "spans": rec.root.children
+    }
+    os.makedirs(rec.profile_dir, exist_ok=True)
+    path = os.path.join(rec.profile_dir, f"run_{rec.started.replace(':', '').replace('-', '')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1, default=str)
+    log.info("Saved run report: %s", path)
+    return path
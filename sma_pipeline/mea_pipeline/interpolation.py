@@ -0,0 +1,119 @@
+import time
+import numpy as np
+import pandas as pd
+
+# Segment-local artifact filling. Contiguous artifact runs are found once from the
+# artifact mask; each run is filled from `context` clean samples on either side,
+# for all channels at once, so the cost scales with the number of masked samples
+# rather than with recording length x channels.
+
+METHODS = ("spline", "linear", "zero")
+
+
+def artifact_segments(artifact_mask):
+    # [start, end) sample ranges of every contiguous run of True
+    edges = np.diff(np.concatenate([[False], np.asarray(artifact_mask, dtype=bool), [False]]).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _context_rows(artifact_mask, start, end, context):
+    n = len(artifact_mask)
+    rows = np.concatenate([np.arange(max(start - context, 0), start), np.arange(end, min(end + context, n))])
+    return rows[~artifact_mask[rows]]
+
+
+def _fill_segment(signals, artifact_mask, start, end, method, context, order):
+    if method == "zero":
+        signals[start:end] = 0.0
+        return
+
+    rows = _context_rows(artifact_mask, start, end, context)
+    if len(rows) == 0:
+        # No clean sample within reach (e.g. the whole recording is artifact): zero the run
+        # rather than leave the artifact, or NaN in the chunked modes, in place
+        signals[start:end] = 0.0
+        return
+    two_sided = rows[0] < start and rows[-1] >= end
+
+    if method == "linear":
+        if two_sided:
+            left, right = start - 1, end
+            w = (np.arange(start, end) - left)[:, None] / (right - left)
+            signals[start:end] = (1 - w) * signals[left] + w * signals[right]
+        else:
+            # Run touches the recording edge: hold the nearest clean sample, like bfill/ffill
+            signals[start:end] = signals[end] if start == 0 else signals[start - 1]
+        return
+
+    # "spline": least-squares polynomial of degree `order` through the context on both
+    # sides (a spline without interior knots over this window), one lstsq for all
+    # channels. One-sided edge runs fall back to the context mean.
+    deg = min(order, len(rows) - 1) if two_sided else 0
+    scale = max(context, 1)
+    x = (rows - start) / scale
+    vander = np.vander(x, deg + 1)
+    coef, *_ = np.linalg.lstsq(vander, signals[rows], rcond=None)
+    signals[start:end] = np.vander((np.arange(start, end) - start) / scale, deg + 1) @ coef
+
+
+def fill_artifacts(signals, artifact_mask, method="spline", context=300, order=2):
+    # Returns a filled float copy of a (samples x channels) array
+    if method not in METHODS:
+        raise ValueError(f"Unknown interpolation method: {method}")
+    if method != "zero" and int(context) < 1:
+        raise ValueError(f"interpolation_context must be at least 1 for method {method}, got {context}")
+    filled = np.array(signals, dtype=float, order="F")
+    artifact_mask = np.asarray(artifact_mask, dtype=bool)
+    for start, end in zip(*artifact_segments(artifact_mask)):
+        _fill_segment(filled, artifact_mask, start, end, method, int(context), int(order))
+    return filled
+
+
+def fill_from_config(signals, artifact_mask, cfg):
+    return fill_artifacts(signals, artifact_mask, cfg.get("interpolation_method", "spline"),
+                          cfg.get("interpolation_context", 300), cfg.get("interpolation_order", 2))
+
+
+def _pandas_fill(signals, artifact_mask):
+    # The previous whole-column method, kept as the reference for compare_with_pandas
+    df = pd.DataFrame(signals)
+    for col in df.columns:
+        df.loc[artifact_mask, col] = np.nan
+        df[col] = df[col].interpolate(method="spline", order=2).bfill().ffill()
+    return df.values
+
+
+def compare_with_pandas(n_channels=16, seconds=10, fs=30000, n_artifacts=20, seed=0):
+    # Regression check against the full-column pandas spline: the fill may differ only
+    # within the noise band of the clean signal
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fs)
+    signals = rng.normal(0, 1e-5, (n, n_channels))
+    artifact_mask = np.zeros(n, dtype=bool)
+    for start in rng.integers(0, n - 300, n_artifacts):
+        artifact_mask[start:start + rng.integers(10, 300)] = True
+    signals[artifact_mask] += 5e-3
+
+    start = time.perf_counter()
+    reference = _pandas_fill(signals, artifact_mask)
+    t_ref = time.perf_counter() - start
+    start = time.perf_counter()
+    filled = fill_artifacts(signals, artifact_mask)
+    t_new = time.perf_counter() - start
+
+    noise = signals[~artifact_mask].std()
+    return {
+        "max_abs_diff": float(np.abs(filled - reference).max()),
+        "max_diff_in_noise_std": float(np.abs(filled - reference).max() / noise),
+        "clean_samples_unchanged": bool(np.array_equal(filled[~artifact_mask], signals[~artifact_mask])),
+        "pandas_seconds": t_ref,
+        "segment_local_seconds": t_new
+    }
+
+
+if __name__ == "__main__":
+    result = compare_with_pandas()
+    for key, value in result.items():
+        print(f"{key:>22}: {value}")
+    assert result["clean_samples_unchanged"]
+    assert result["max_diff_in_noise_std"] < 1.0, "segment-local fill drifted from the pandas spline"
@@ -0,0 +1,214 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from mea_pipeline.groupStats import assign_group, group_order
+from mea_pipeline.preProcessing import recording_names
+
+# Network-level analysis of one recording from its sparse spike trains. The channels of
+# each group form one network; per group:
+#   - binned population rate: one bincount over every spike's bin
+#   - network bursts: runs of bins (bridging gaps of up to network_burst_max_gap) in
+#     which at least network_burst_min_fraction of the group's channels fire
+#   - STTC (Cutts & Eglen 2014) for every channel pair: nearest-neighbour lookups
+#     between the sorted trains (searchsorted) plus a coverage sum over each train
+# Everything is O(spikes log spikes); sample count never enters. Per-channel results
+# (sttc_mean, nb_participation, nb_spike_fraction) are merged into the feature rows;
+# per-recording tables go to output/network.
+
+log = logging.getLogger(__name__)
+
+
+def network_params(cfg):
+    # None when network analysis is switched off
+    if not cfg.get("network", True):
+        return None
+    return {
+        "bin_size": float(cfg.get("network_bin", 0.01)),
+        "min_fraction": float(cfg.get("network_burst_min_fraction", 0.25)),
+        "max_gap": float(cfg.get("network_burst_max_gap", 0.05)),
+        "sttc_dt": float(cfg.get("sttc_dt", 0.01)),
+        "groups": cfg.get("groups"),
+        "output_dir": os.path.join(cfg["output_dir"], "network")
+    }
+
+
+def population_rate(spike_times, t_start, t_end, bin_size):
+    # Spike counts of all trains together per bin of [t_start, t_end)
+    n_bins = max(int(np.ceil((t_end - t_start) / bin_size)), 1)
+    flat = np.concatenate(spike_times) if spike_times else np.empty(0)
+    bins = np.clip(((flat - t_start) / bin_size).astype(np.int64), 0, n_bins - 1)
+    return np.bincount(bins, minlength=n_bins)
+
+
+def active_channels(spike_times, t_start, n_bins, bin_size):
+    # Number of trains with at least one spike per bin
+    firing = []
+    for times in spike_times:
+        bins = np.clip(((times - t_start) / bin_size).astype(np.int64), 0, n_bins - 1)
+        firing.append(bins[np.r_[True, bins[1:] != bins[:-1]]] if len(bins) else bins)
+    flat = np.concatenate(firing) if firing else np.empty(0, dtype=np.int64)
+    return np.bincount(flat, minlength=n_bins)
+
+
+def network_bursts(active, min_channels, max_gap_bins):
+    # -> (first bin, last bin) of every run of bins with >= min_channels active trains
+    hot = np.flatnonzero(active >= min_channels)
+    if len(hot) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(hot) > max_gap_bins + 1)
+    return hot[np.r_[0, breaks + 1]], hot[np.r_[breaks, len(hot) - 1]]
+
+
+def _tiling(times, dt, t_start, t_end):
+    # Fraction of [t_start, t_end] within +-dt of a spike of the train
+    if len(times) == 0:
+        return 0.0
+    covered = np.minimum(np.diff(times), 2 * dt).sum() + 2 * dt
+    covered -= max(0.0, t_start - (times[0] - dt)) + max(0.0, times[-1] + dt - t_end)
+    return covered / (t_end - t_start)
+
+
+def _near_fraction(a, b, dt):
+    # Fraction of spikes of a within +-dt of a spike of b
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    pos = np.searchsorted(b, a)
+    before = np.abs(a - b[np.clip(pos - 1, 0, len(b) - 1)])
+    after = np.abs(b[np.clip(pos, 0, len(b) - 1)] - a)
+    return np.count_nonzero(np.minimum(before, after) <= dt) / len(a)
+
+
+def sttc_matrix(spike_times, dt, t_start, t_end):
+    n = len(spike_times)
+    tiling = np.array([_tiling(t, dt, t_start, t_end) for t in spike_times])
+    out = np.full((n, n), np.nan)
+    for i in range(n):
+        if len(spike_times[i]) == 0:
+            continue
+        out[i, i] = 1.0
+        for j in range(i + 1, n):
+            if len(spike_times[j]) == 0:
+                continue
+            p_a = _near_fraction(spike_times[i], spike_times[j], dt)
+            p_b = _near_fraction(spike_times[j], spike_times[i], dt)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out[i, j] = out[j, i] = 0.5 * ((p_a - tiling[j]) / (1 - p_a * tiling[j]) +
+                                               (p_b - tiling[i]) / (1 - p_b * tiling[i]))
+    return out
+
+
+def group_network(name, group, channels, spike_times, t_start, t_end, params):
+    # -> (summary row, per-channel dicts, burst rows, population rate, STTC matrix)
+    bin_size = params["bin_size"]
+    rate = population_rate(spike_times, t_start, t_end, bin_size)
+    active = active_channels(spike_times, t_start, len(rate), bin_size)
+    min_channels = max(int(np.ceil(params["min_fraction"] * len(channels))), 2)
+    first, last = network_bursts(active, min_channels, int(round(params["max_gap"] / bin_size)))
+    starts, ends = t_start + first * bin_size, t_start + (last + 1) * bin_size
+
+    # Burst membership of every spike by a sorted lookup against the burst starts
+    per_channel, burst_channels = [], np.zeros(len(first), dtype=np.int64)
+    burst_spikes = np.zeros(len(first), dtype=np.int64)
+    for times in spike_times:
+        k = np.searchsorted(starts, times, side="right") - 1
+        inside = (k >= 0) & (times < ends[np.clip(k, 0, None)]) if len(first) else np.zeros(len(times), bool)
+        ids = np.unique(k[inside])
+        burst_channels[ids] += 1
+        np.add.at(burst_spikes, k[inside], 1)
+        per_channel.append({
+            "nb_participation": len(ids) / len(first) if len(first) else np.nan,
+            "nb_spike_fraction": np.count_nonzero(inside) / len(times) if len(times) else np.nan
+        })
+
+    sttc = sttc_matrix(spike_times, params["sttc_dt"], t_start, t_end)
+    off_diag = sttc[~np.eye(len(channels), dtype=bool)].reshape(len(channels), -1) if len(channels) > 1 \
+        else np.full((len(channels), 1), np.nan)
+    finite = np.isfinite(off_diag)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sttc_mean = np.where(finite, off_diag, 0.0).sum(axis=1) / finite.sum(axis=1)
+    for row, value in zip(per_channel, sttc_mean):
+        row["sttc_mean"] = value
+
+    duration = t_end - t_start
+    n_spikes = int(rate.sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate_hz = rate / bin_size
+        summary = {
+            "recording": name,
+            "group": group,
+            "channels": len(channels),
+            "active_channels": int(sum(len(t) > 0 for t in spike_times)),
+            "spikes": n_spikes,
+            "array_rate": n_spikes / duration / len(channels) if duration > 0 else np.nan,
+            "population_rate_cv": rate_hz.std() / rate_hz.mean() if n_spikes else np.nan,
+            "network_burst_count": len(first),
+            "network_burst_rate": len(first) / duration * 60 if duration > 0 else np.nan,
+            "mean_nb_duration": float(np.mean(ends - starts)) if len(first) else np.nan,
+            "mean_nb_spikes": float(burst_spikes.mean()) if len(first) else np.nan,
+            "mean_nb_participation": float(burst_channels.mean() / len(channels)) if len(first) else np.nan,
+            "mean_inter_nb_interval": float(np.mean(starts[1:] - ends[:-1])) if len(first) > 1 else np.nan,
+            "pct_spikes_in_nb": 100.0 * burst_spikes.sum() / n_spikes if n_spikes else np.nan,
+            "mean_sttc": float(off_diag[finite].mean()) if finite.any() else np.nan
+        }
+    bursts = [{"recording": name, "group": group, "start": s, "end": e, "duration": e - s, "spikes": int(n),
+               "channels": int(c)} for s, e, n, c in zip(starts, ends, burst_spikes, burst_channels)]
+    return summary, per_channel, bursts, rate, sttc
+
+
+def network_path(params, name):
+    return os.path.join(params["output_dir"], f"{name}_network.csv")
+
+
+def analyze_network(name, channels, spike_times, t_start, t_end, params):
+    # Runs every group of one recording and writes output/network/{name}_*; returns
+    # {channel: per-channel network features}
+    groups = [assign_group(name, ch, params["groups"]) for ch in channels]
+    os.makedirs(params["output_dir"], exist_ok=True)
+    summaries, bursts, rates, per_channel = [], [], {}, {}
+    for group in group_order(groups, params["groups"]):
+        members = [i for i, g in enumerate(groups) if g == group]
+        summary, rows, group_bursts, rate, sttc = group_network(
+            name, group, [channels[i] for i in members], [spike_times[i] for i in members], t_start, t_end, params)
+        summaries.append(summary)
+        bursts.extend(group_bursts)
+        rates[group] = rate
+        per_channel.update({channels[i]: row for i, row in zip(members, rows)})
+        labels = [channels[i] for i in members]
+        pd.DataFrame(sttc, index=labels, columns=labels).to_csv(
+            os.path.join(params["output_dir"], f"{name}_{group}_sttc.csv"))
+
+    pd.DataFrame(summaries).to_csv(network_path(params, name), index=False)
+    pd.DataFrame(bursts, columns=["recording", "group", "start", "end", "duration", "spikes", "channels"]).to_csv(
+        os.path.join(params["output_dir"], f"{name}_network_bursts.csv"), index=False)
+    np.savez_compressed(os.path.join(params["output_dir"], f"{name}_population_rate.npz"), t_start=t_start,
+                        bin_size=params["bin_size"], **{f"rate_{g}": r for g, r in rates.items()})
+    log.info("  Network: %s network bursts in %s", sum(s['network_burst_count'] for s in summaries), name)
+    return per_channel
+
+
+def add_network_features(rows, name, channels, spike_times, t_start, t_end, params):
+    # Merges the per-channel network features into the recording's feature rows
+    if params is None:
+        return rows
+    per_channel = analyze_network(name, channels, spike_times, t_start, t_end, params)
+    for row in rows:
+        row.update(per_channel.get(row["channel"], {}))
+    return rows
+
+
+def save_network_summary(cfg, names):
+    # output/network/network_summary.csv: one row per recording and group, for the given
+    # recordings and every other recording in input_dir with a network table
+    params = network_params(cfg)
+    if params is None:
+        return None
+    names = recording_names(cfg, names)
+    tables = [pd.read_csv(network_path(params, name)) for name in names if os.path.exists(network_path(params, name))]
+    if not tables:
+        return None
+    summary = pd.concat(tables, ignore_index=True)
+    out_path = os.path.join(params["output_dir"], "network_summary.csv")
+    summary.to_csv(out_path, index=False)
+    log.info("Saved network summary: %s", out_path)
+    return summary
@@ -0,0 +1,104 @@
+import numpy as np
+from mea_pipeline.instrumentation import span
+
+# Per-channel noise statistics of a (samples x channels) array, gathered in one pass
+# over blocks of rows for all channels at once: moments of every sample (spike
+# thresholds), moments of the samples below noise_threshold (SNR noise), the peak, and,
+# only when spike_noise_estimator is mad, the MAD sigma median(|x|) / 0.6745. Block
+# statistics merge exactly, so streaming mode builds the same numbers chunk by chunk
+# with block_stats / merge_stats.
+
+MAD_SCALE = 0.6745
+
+
+def chunk_moments(x, mask=None):
+    # count / mean / sum of squared deviations per column, optionally over masked entries only
+    if mask is None:
+        n = np.full(x.shape[1], x.shape[0])
+        mean = x.mean(axis=0)
+        m2 = ((x - mean) ** 2).sum(axis=0)
+        return n, mean, m2
+    n = mask.sum(axis=0)
+    total = np.where(mask, x, 0.0).sum(axis=0)
+    mean = np.divide(total, n, out=np.zeros_like(total), where=n > 0)
+    m2 = (np.where(mask, x - mean, 0.0) ** 2).sum(axis=0)
+    return n, mean, m2
+
+
+def merge_moments(a, b):
+    # Chan et al. pairwise update, so the result matches a single pass over the full column
+    if a is None:
+        return b
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    safe_n = np.maximum(n, 1)
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / safe_n, m2_a + m2_b + delta ** 2 * n_a * n_b / safe_n
+
+
+def pooled_moments(moments):
+    n, mean, m2 = moments
+    n_tot = n.sum()
+    mean_tot = (n * mean).sum() / n_tot
+    return n_tot, mean_tot, m2.sum() + (n * (mean - mean_tot) ** 2).sum()
+
+
+def moments_std(moments, ddof=0):
+    n, _, m2 = moments
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(np.where(n - ddof > 0, m2 / np.maximum(n - ddof, 1), np.nan))
+
+
+def block_stats(x, noise_threshold=None):
+    stats = {"moments": chunk_moments(x), "max": x.max(axis=0)}
+    if noise_threshold is not None:
+        stats["noise"] = chunk_moments(x, np.abs(x) < noise_threshold)
+    return stats
+
+
+def merge_stats(a, b):
+    if a is None:
+        return b
+    out = {"moments": merge_moments(a["moments"], b["moments"]), "max": np.maximum(a["max"], b["max"])}
+    if "noise" in a:
+        out["noise"] = merge_moments(a["noise"], b["noise"])
+    return out
+
+
+def noise_stats(signals, noise_threshold=None, robust=False, block_size=200000):
+    # -> {"moments", "max", "noise" (with noise_threshold), "mad_sigma" (robust)}; the
+    # row blocks keep the |x| and mask temporaries at block_size x channels
+    stats = None
+    for a in range(0, signals.shape[0], block_size):
+        stats = merge_stats(stats, block_stats(np.asarray(signals[a:a + block_size]), noise_threshold))
+    if robust:
+        stats["mad_sigma"] = mad_sigma(signals)
+    return stats
+
+
+def mad_sigma(signals):
+    # Column by column, so the |x| temporary is one channel long, and partitioned in place
+    sigma = np.empty(signals.shape[1])
+    for c in range(signals.shape[1]):
+        sigma[c] = np.median(np.abs(np.asarray(signals[:, c])), overwrite_input=True)
+    return sigma / MAD_SCALE
+
+
+def recording_noise_stats(rec, cfg):
+    # The MAD pass is only paid for when the spike thresholds use it
+    with span("noise_stats", file=rec["name"]):
+        return noise_stats(rec["signals"], cfg["noise_threshold"],
+                           robust=cfg.get("spike_noise_estimator", "std") == "mad")
+
+
+def channel_snr(stats, max_valid_snr=None):
+    # Peak over the std (ddof=1) of the sub-noise_threshold samples -> (noise_std, snr, valid).
+    # Channels without noise samples or above max_valid_snr are not valid.
+    noise_std = moments_std(stats["noise"], ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        snr = np.where(noise_std != 0, stats["max"] / noise_std, 0.0)
+    valid = noise_std > 0
+    if max_valid_snr is not None:
+        valid &= snr <= float(max_valid_snr)
+    return noise_std, snr, valid
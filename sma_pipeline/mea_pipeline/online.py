@@ -0,0 +1,347 @@
+import io
+import os
+import csv
+import json
+import time
+import socket
+import logging
+import numpy as np
+from mea_pipeline.ingestion import iter_raw_chunks, header_columns
+from mea_pipeline.interpolation import fill_from_config
+from mea_pipeline.noiseStats import chunk_moments, merge_moments, pooled_moments, moments_std
+from mea_pipeline.spikeEngine import detect_multichannel
+
+# Online spike detection over a live stream of sample blocks. A source yields
+# (timestamps, block, channels, arrival) tuples:
+#   - replay_source   an existing recording at `speed` x real time (0 = as fast as possible)
+#   - tail_source     a CSV that another process is still writing
+#   - socket_source   CSV text from a local TCP socket (serve_replay emulates a sender)
+# OnlineDetector applies the batch logic block by block. Artifacts are samples whose
+# max |x| exceeds mean + z_score_threshold x std. They are filled once
+# online_lookahead samples of right-hand context have arrived. Spikes cross
+# spike_threshold_multiplier x std of the cleaned signal and are found with the batch
+# engine. The running moments forget with a time constant of online_noise_window
+# seconds (null = keep everything). A spike is committed once the refractory distance
+# after it has been seen, so the algorithmic delay is lookahead + 1 ms.
+
+log = logging.getLogger(__name__)
+
+
+def timestamp_scale(timestamps, fs):
+    # Timestamps in seconds or in samples, decided like the batch stages do
+    return 1.0 if len(timestamps) < 2 or timestamps[1] - timestamps[0] < 1 else float(fs)
+
+
+def _decay(moments, factor):
+    if moments is None or factor == 1.0:
+        return moments
+    n, mean, m2 = moments
+    return n * factor, mean, m2 * factor
+
+
+class OnlineDetector:
+    def __init__(self, channels, cfg):
+        if cfg.get("spike_noise_estimator", "std") != "std":
+            raise ValueError("Online mode only supports spike_noise_estimator: std")
+        self.channels = list(channels)
+        self.cfg = cfg
+        self.fs = float(cfg["fs"])
+        self.distance = int(0.001 * self.fs)
+        self.pad = 8 * self.distance
+        self.lookahead = int(cfg.get("online_lookahead") or cfg.get("interpolation_context", 300))
+        self.context = int(cfg.get("interpolation_context", 300))
+        window = cfg.get("online_noise_window")
+        self.memory = float(window) * self.fs if window else None
+        self.warmup = int(float(cfg.get("online_warmup", 1.0)) * self.fs)
+        self.rate_window = float(cfg.get("online_rate_window", 1.0))
+        self.scale = None
+
+        n = len(self.channels)
+        self.artifact_moments, self.noise_moments = None, None
+        self.pending = np.empty((0, n))
+        self.pending_ts = np.empty(0)
+        self.tail = np.empty((0, n))
+        self.det = np.empty((0, n))
+        self.det_ts = np.empty(0)
+        self.det_start = 0
+        self.released = 0
+        self.committed = 0
+        self.thresholds = np.full(n, np.inf)
+        self.recent = [np.empty(0) for _ in range(n)]
+        self.first_time = None
+        self.artifacts = 0
+
+    def _update(self, moments, new, n_new):
+        factor = np.exp(-n_new / self.memory) if self.memory else 1.0
+        return merge_moments(_decay(moments, factor), new)
+
+    def _mark_artifacts(self, x):
+        max_signal = np.abs(x).max(axis=1)
+        self.artifact_moments = self._update(self.artifact_moments, chunk_moments(max_signal[:, None]), len(x))
+        if self.artifact_moments[0][0] < 2:
+            return np.zeros(len(x), dtype=bool)
+        threshold = self.artifact_moments[1][0] + self.cfg["z_score_threshold"] * \
+            moments_std(self.artifact_moments, ddof=1)[0]
+        return max_signal > threshold
+
+    def _release(self, lookahead):
+        # Fills the pending samples that have `lookahead` samples after them
+        n_out = len(self.pending) - lookahead
+        if n_out <= 0:
+            return np.empty((0, self.pending.shape[1])), np.empty(0)
+        window = np.concatenate([self.tail, self.pending])
+        window = fill_from_config(window, np.isnan(window).any(axis=1), self.cfg)
+        cleaned = window[len(self.tail):len(self.tail) + n_out]
+        ts = self.pending_ts[:n_out]
+        # Plain [-context:] would keep the whole history when context is 0
+        tail = np.concatenate([self.tail, self.pending[:n_out]])
+        self.tail = tail[max(len(tail) - self.context, 0):]
+        self.pending, self.pending_ts = self.pending[n_out:], self.pending_ts[n_out:]
+        return cleaned, ts
+
+    def _thresholds(self):
+        moments = self.noise_moments
+        if self.cfg.get("spike_threshold_policy", "channel") == "global":
+            moments = tuple(np.full(len(self.channels), m) for m in pooled_moments(moments))
+        return float(self.cfg["spike_threshold_multiplier"]) * moments_std(moments)
+
+    def _detect(self, hold):
+        # Peaks in [committed, released - hold), searched with `pad` committed samples before
+        indices, amplitudes = detect_multichannel(self.det, self.thresholds, self.distance)
+        stop = max(self.released - hold, self.committed)
+        start = max(self.committed, self.warmup)
+        chans, times, amps = [], [], []
+        for i, (idx, amp) in enumerate(zip(indices, amplitudes)):
+            pos = idx + self.det_start
+            keep = (pos >= start) & (pos < stop)
+            chans.append(np.full(np.count_nonzero(keep), i))
+            times.append(self.det_ts[idx[keep]] / self.scale)
+            amps.append(amp[keep])
+        self.committed = stop
+        drop = max(stop - self.pad - self.det_start, 0)
+        self.det, self.det_ts, self.det_start = self.det[drop:], self.det_ts[drop:], self.det_start + drop
+        return np.concatenate(chans), np.concatenate(times), np.concatenate(amps)
+
+    def _rates(self, chans, times, now):
+        # Spikes per second over the last online_rate_window seconds, per channel
+        span = min(self.rate_window, max(now - self.first_time, 1.0 / self.fs))
+        rates = np.empty(len(self.channels))
+        for i in range(len(self.channels)):
+            recent = np.concatenate([self.recent[i], times[chans == i]])
+            self.recent[i] = recent[recent > now - self.rate_window]
+            rates[i] = len(self.recent[i]) / span
+        return rates
+
+    def process(self, timestamps, x, final=False):
+        # -> {"time", "channel", "spike_time", "amplitude", "rates", "thresholds"} for one block
+        if self.scale is None:
+            self.scale = timestamp_scale(timestamps, self.fs)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        x = np.array(x, dtype=np.float64)
+        if len(x):
+            if self.first_time is None:
+                self.first_time = timestamps[0] / self.scale
+            artifacts = self._mark_artifacts(x)
+            self.artifacts += int(np.count_nonzero(artifacts))
+            x[artifacts] = np.nan
+            self.pending = np.concatenate([self.pending, x])
+            self.pending_ts = np.concatenate([self.pending_ts, timestamps])
+
+        cleaned, ts = self._release(0 if final else self.lookahead)
+        if len(cleaned):
+            self.noise_moments = self._update(self.noise_moments, chunk_moments(cleaned), len(cleaned))
+            self.thresholds = self._thresholds()
+            self.det = np.concatenate([self.det, cleaned])
+            self.det_ts = np.concatenate([self.det_ts, ts])
+            self.released += len(cleaned)
+        chans, times, amps = self._detect(0 if final else self.distance) if len(self.det) > 2 else \
+            (np.empty(0, dtype=int), np.empty(0), np.empty(0))
+
+        # `time` is the last released sample (None before the first one)
+        now = self.det_ts[-1] / self.scale if len(self.det_ts) else None
+        return {"time": now, "channel": chans, "spike_time": times, "amplitude": amps,
+                "rates": self._rates(chans, times, now) if now is not None else np.zeros(len(self.channels)),
+                "thresholds": self.thresholds}
+
+    def delay(self):
+        # Algorithmic delay (s) between a sample arriving and its spikes being committed
+        return (self.lookahead + self.distance) / self.fs
+
+
+# Sources
+
+def replay_source(path, cfg, block_size, speed=1.0):
+    # Blocks of an existing recording, each released when its last sample would have been
+    # recorded at `speed` x real time
+    start, first, scale = time.perf_counter(), None, None
+    for ts, x, channels in iter_raw_chunks(path, max(int(cfg.get("chunk_size", 300000)), block_size), cfg):
+        if scale is None:
+            scale, first = timestamp_scale(ts, cfg["fs"]), ts[0]
+        for a in range(0, len(ts), block_size):
+            bt, bx = ts[a:a + block_size], x[a:a + block_size]
+            if speed > 0:
+                due = start + ((bt[-1] - first) / scale + 1.0 / cfg["fs"]) / speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                arrival = due
+            else:
+                arrival = time.perf_counter()
+            yield bt, bx, channels, arrival
+
+
+def _text_blocks(pieces, block_size):
+    # CSV text arriving in arbitrary pieces (header line first) -> blocks of parsed rows;
+    # an empty piece means nothing new has arrived yet
+    buffer, usecols, channels = "", None, None
+    rows, arrival = [], None
+    for piece in pieces:
+        buffer += piece
+        if usecols is None:
+            if "\n" not in buffer:
+                continue
+            line, buffer = buffer.split("\n", 1)
+            header = next(csv.reader([line.lstrip("\ufeff")]))
+            names, channels = header_columns(header)
+            usecols = [header.index(c) for c in names]
+        if "\n" in buffer:
+            text, buffer = buffer.rsplit("\n", 1)
+            data = np.loadtxt(io.StringIO(text), delimiter=",", usecols=usecols, ndmin=2)
+            rows.append(data)
+            arrival = arrival or time.perf_counter()
+        n = sum(len(r) for r in rows)
+        if n >= block_size:
+            data = np.concatenate(rows)
+            cut = n - n % block_size
+            for a in range(0, cut, block_size):
+                yield data[a:a + block_size, 0], data[a:a + block_size, 1:], channels, arrival
+            rows, arrival = ([data[cut:]], time.perf_counter()) if cut < n else ([], None)
+    if buffer.strip() and usecols is not None:
+        rows.append(np.loadtxt(io.StringIO(buffer), delimiter=",", usecols=usecols, ndmin=2))
+    if rows and sum(len(r) for r in rows):
+        data = np.concatenate(rows)
+        yield data[:, 0], data[:, 1:], channels, arrival or time.perf_counter()
+
+
+def tail_source(path, block_size, poll=0.01, idle_timeout=5.0):
+    # Follows a CSV that is still being written; ends after idle_timeout s without new data
+    def pieces():
+        idle_since = time.perf_counter()
+        with open(path, "r", newline="") as f:
+            while True:
+                piece = f.read()
+                if piece:
+                    idle_since = time.perf_counter()
+                    yield piece
+                elif time.perf_counter() - idle_since > idle_timeout:
+                    return
+                else:
+                    yield ""
+                    time.sleep(poll)
+    return _text_blocks(pieces(), block_size)
+
+
+def socket_source(address, block_size):
+    # CSV text (header line first) from a TCP sender on host:port; ends when it disconnects
+    host, port = address.rsplit(":", 1)
+
+    def pieces():
+        with socket.create_connection((host, int(port))) as conn:
+            while True:
+                data = conn.recv(1 << 16)
+                if not data:
+                    return
+                yield data.decode()
+    return _text_blocks(pieces(), block_size)
+
+
+def serve_replay(path, cfg, port, block_size, speed=1.0, host="127.0.0.1"):
+    # Sends a recording as CSV text to the first client, paced like replay_source
+    with socket.create_server((host, port)) as server:
+        log.info("Serving %s on %s:%s", os.path.basename(path), host, port)
+        conn, _ = server.accept()
+        with conn:
+            header_sent = False
+            for ts, x, channels, _ in replay_source(path, cfg, block_size, speed):
+                out = io.StringIO()
+                if not header_sent:
+                    out.write(",".join(["timestamps"] + list(channels)) + "\n")
+                    header_sent = True
+                np.savetxt(out, np.column_stack([ts, x]), delimiter=",", fmt="%.17g")
+                conn.sendall(out.getvalue().encode())
+
+
+# Runner
+
+def _latency_summary(latencies, samples, n_channels, wall, signal_seconds, delay, block_seconds):
+    lat = np.asarray(latencies) * 1000
+    pct = lambda q: float(np.percentile(lat, q)) if len(lat) else None
+    return {
+        "blocks": len(lat),
+        "samples": samples,
+        "signal_s": signal_seconds,
+        "wall_s": wall,
+        "realtime_factor": signal_seconds / wall if wall > 0 else None,
+        "channel_samples_per_s": samples * n_channels / wall if wall > 0 else None,
+        "block_ms": block_seconds * 1000,
+        "latency_ms": {"mean": float(lat.mean()) if len(lat) else None, "p50": pct(50), "p95": pct(95),
+                       "p99": pct(99), "max": float(lat.max()) if len(lat) else None},
+        "over_budget_blocks": int(np.count_nonzero(lat > block_seconds * 1000)),
+        "algorithmic_delay_ms": delay * 1000
+    }
+
+
+def run_online(source, cfg, name, max_seconds=None, on_block=None):
+    # Runs the detector over a source. Spike events go to output/online/{name}_spikes.csv
+    # and rolling rates (every online_rate_interval s of signal) to {name}_rates.csv as they
+    # are found; {name}_latency.json reports per-block latency (processing done - block
+    # arrival) and throughput.
+    out_dir = os.path.join(cfg["output_dir"], "online")
+    os.makedirs(out_dir, exist_ok=True)
+    interval = float(cfg.get("online_rate_interval", 1.0))
+    detector, latencies, samples, next_rate = None, [], 0, None
+    block_seconds, n_spikes = 0.0, 0
+    started = time.perf_counter()
+
+    with open(os.path.join(out_dir, f"{name}_spikes.csv"), "w") as spikes_file, \
+            open(os.path.join(out_dir, f"{name}_rates.csv"), "w") as rates_file:
+        spikes_file.write("time,channel,amplitude\n")
+
+        def emit(result):
+            nonlocal next_rate, n_spikes
+            for t, c, a in zip(result["spike_time"], result["channel"], result["amplitude"]):
+                spikes_file.write(f"{float(t)!r},{detector.channels[c]},{float(a)!r}\n")
+            n_spikes += len(result["channel"])
+            if result["time"] is not None and (next_rate is None or result["time"] >= next_rate):
+                rates_file.write(f"{float(result['time'])!r}," + ",".join(f"{r:.6g}" for r in result["rates"]) + "\n")
+                next_rate = result["time"] + interval
+            spikes_file.flush()
+            rates_file.flush()
+            if on_block is not None:
+                on_block(result)
+
+        for ts, x, channels, arrival in source:
+            if detector is None:
+                detector = OnlineDetector(channels, cfg)
+                rates_file.write(",".join(["time"] + detector.channels) + "\n")
+            emit(detector.process(ts, x))
+            latencies.append(time.perf_counter() - arrival)
+            samples += len(ts)
+            block_seconds = max(block_seconds, len(ts) / detector.fs)
+            if max_seconds is not None and samples / detector.fs >= max_seconds:
+                break
+        if detector is not None:
+            emit(detector.process(np.empty(0), np.empty((0, len(detector.channels))), final=True))
+
+    if detector is None:
+        log.warning("No samples received for %s", name)
+        return None
+    report = _latency_summary(latencies, samples, len(detector.channels), time.perf_counter() - started,
+                              samples / detector.fs, detector.delay(), block_seconds)
+    report.update({"recording": name, "spikes": n_spikes, "artifacts": detector.artifacts})
+    with open(os.path.join(out_dir, f"{name}_latency.json"), "w") as f:
+        json.dump(report, f, indent=1)
+    log.info("Online %s: %s spikes, %.1fx real time, latency p50 %.2f ms / p99 %.2f ms "
+             "(block %.1f ms, +%.1f ms lookahead)", name, n_spikes, report["realtime_factor"],
+             report["latency_ms"]["p50"], report["latency_ms"]["p99"], report["block_ms"], report["algorithmic_delay_ms"])
+    return report
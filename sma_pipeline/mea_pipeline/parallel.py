@@ -0,0 +1,104 @@
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from mea_pipeline.instrumentation import span, tracing, traced_call, attach
+
+# Process-pool helpers. Files are spread with an order-preserving map so merged
+# outputs match the serial run row for row; channel blocks of one recording read
+# the signals through shared memory (or the memory-mapped store) instead of pickling.
+
+
+def resolve_workers(cfg=None, workers=None):
+    if workers is None:
+        workers = (cfg or {}).get("workers", 1)
+    workers = int(workers or 1)
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def split_workers(n_files, workers):
+    # Files first; spare workers go to the channels of each file
+    file_workers = max(1, min(workers, n_files))
+    return file_workers, max(1, workers // file_workers)
+
+
+def imap_files(func, items, workers):
+    # Yields the results in item order, each as soon as it (and those before it) is done
+    items = list(items)
+    if workers <= 1 or len(items) < 2:
+        for item in items:
+            yield func(item)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as ex:
+        if not tracing():
+            yield from ex.map(func, items)
+            return
+        # Spans recorded in the workers come back with each result
+        for result, spans in ex.map(partial(traced_call, func), items):
+            attach(spans)
+            yield result
+
+
+def map_files(func, items, workers):
+    return list(imap_files(func, items, workers))
+
+
+def share_array(arr):
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    order = "F" if arr.flags.f_contiguous and not arr.flags.c_contiguous else "C"
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, order=order)
+    view[...] = arr
+    return shm, ("shm", shm.name, arr.shape, arr.dtype.str, order)
+
+
+def _array_spec(arr):
+    if isinstance(arr, np.memmap) and arr.filename:
+        order = "F" if arr.flags.f_contiguous and not arr.flags.c_contiguous else "C"
+        return None, ("mmap", arr.filename, arr.shape, arr.dtype.str, order, arr.offset)
+    return share_array(arr)
+
+
+def attach_array(spec):
+    kind, name, shape, dtype, order = spec[:5]
+    if kind == "mmap":
+        return None, np.memmap(name, dtype=np.dtype(dtype), mode="r", shape=shape, order=order, offset=spec[5])
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, order=order)
+
+
+def _run_block(spec, func, channels, args):
+    shm, signals = attach_array(spec)
+    try:
+        with span("channels", first=int(channels[0]), last=int(channels[-1])):
+            return func(signals, channels, *args)
+    finally:
+        del signals
+        if shm is not None:
+            shm.close()
+
+
+def map_channels(func, signals, workers, *args, min_samples=0):
+    # func(signals, channel_indices, *args) -> one result per channel, in channel order
+    n_channels = signals.shape[1]
+    if workers <= 1 or n_channels < 2 or signals.size < min_samples:
+        return func(signals, list(range(n_channels)), *args)
+
+    blocks = [list(b) for b in np.array_split(np.arange(n_channels), min(workers, n_channels))]
+    shm, spec = _array_spec(signals)
+    try:
+        with ProcessPoolExecutor(max_workers=len(blocks)) as ex:
+            if not tracing():
+                futures = [ex.submit(_run_block, spec, func, block, args) for block in blocks]
+                return [res for fut in futures for res in fut.result()]
+            futures = [ex.submit(traced_call, _run_block, spec, func, block, args) for block in blocks]
+            results = []
+            for fut in futures:
+                res, spans = fut.result()
+                attach(spans)
+                results.extend(res)
+            return results
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
@@ -1,15 +1,145 @@
-from mea_pipeline.preProcessing import clean_signals
-from mea_pipeline.spikes import detect_spikes
-from mea_pipeline.snr import compute_snr
-from mea_pipeline.features import extract_features
+import os
+import json
+from functools import partial
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging, start_run, finish_run, span
+from mea_pipeline.parallel import resolve_workers, split_workers, imap_files
+from mea_pipeline.preProcessing import clean_signals, clean_recording, raw_files, recording_bases
+from mea_pipeline.runCache import RunCache
+from mea_pipeline.signalStore import load_cleaned, recording_base, store_paths
+from mea_pipeline.spikes import detect_spikes, detect_recording_spikes
+from mea_pipeline.noiseStats import recording_noise_stats
+from mea_pipeline.snr import compute_snr, compute_recording_snr
+from mea_pipeline.features import (features_from_config, extract_recording_features, keep_feature_rows,
+                                   save_project_summaries)
 from mea_pipeline.featureComparison import run_feature_comparison
+from mea_pipeline.network import network_params
+from mea_pipeline.waveforms import waveform_params
+from mea_pipeline.featureStore import FeatureStore, feature_store_path
+from mea_pipeline.plotQueue import start_plots, finish_plots
+from mea_pipeline.streaming import run_streaming
 
-def run_pipeline():
-    clean_signals()
-    detect_spikes()
-    compute_snr()
-    extract_features()   
-    run_feature_comparison()
+def _fused_file(filepath, cfg, workers=1, reuse=()):
+    with span("file", file=os.path.basename(filepath)):
+        return _fused_stages(filepath, cfg, workers, reuse)
+
+def _fused_stages(filepath, cfg, workers=1, reuse=()):
+    # Recordings in `reuse` still have a current cleaned store and skip re-cleaning
+    if filepath in reuse:
+        base = recording_base(filepath)
+        rec = load_cleaned(store_paths(os.path.join(cfg["output_dir"], "cleaned"), base)["signals"])
+    else:
+        rec = clean_recording(filepath, cfg, save=cfg.get("save_intermediates", False))
+    # One noise-statistics pass serves both the spike thresholds and the SNR
+    stats = recording_noise_stats(rec, cfg)
+    spikes = detect_recording_spikes(rec, cfg, workers, stats)
+    compute_recording_snr(rec, cfg, stats)
+    with span("features", file=rec["name"]):
+        return extract_recording_features(rec, cfg["fs"], cfg["spike_threshold_multiplier"], cfg.get("burst_isi", 0.1),
+                                          spikes=spikes, burst_min_spikes=cfg.get("burst_min_spikes", 2),
+                                          groups=cfg.get("groups"), network=network_params(cfg),
+                                          waveforms=waveform_params(cfg))
+
+def run_fused(cfg, workers=1, cache=None, files=None, store=None):
+    # One load per raw recording; the cleaned arrays stay in memory for every downstream stage
+    files = raw_files(cfg, files)
+
+    todo, reuse = cache.stale_files(files) if cache is not None else (dict.fromkeys(files), set())
+    file_workers, channel_workers = split_workers(len(todo), workers)
+    computed = imap_files(partial(_fused_file, cfg=cfg, workers=channel_workers, reuse=frozenset(reuse)),
+                          list(todo), file_workers)
+
+    rows_by_base = keep_feature_rows(cfg, [recording_base(f) for f in files],
+                                     zip([recording_base(f) for f in todo], computed), store, cache,
+                                     {recording_base(f): keys for f, keys in todo.items()},
+                                     cfg.get("save_intermediates", False))
+    save_project_summaries(cfg, rows_by_base)
+
+def compare_features(features_dir, cfg, store, recordings, cache=None):
+    todo = None
+    if cache is not None:
+        # Keyed on the store batches the comparison reads, so unchanged features skip the statistics
+        version = store.version(recordings=recordings)
+        todo = cache.stale("comparison", {"summary": version}, lambda base, v: v)
+        if not todo:
+            return
+    run_feature_comparison(features_dir, cfg, store, recordings)
+    if todo:
+        cache.record_done("comparison", todo)
+
+def _stage(name, progress, i, n):
+    if progress is not None:
+        progress(name, i, n)
+    return span(name)
+
+def progress_writer(path):
+    # progress callback that keeps {stage, index, total} in a JSON file another process can poll
+    def progress(stage, index, total):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"stage": stage, "index": index, "total": total}, f)
+        os.replace(tmp, path)
+    return progress
+
+def run_pipeline(fused=None, streaming=None, workers=None, force=False, profile=None, files=None, progress=None):
+    # files: run only these raw recordings (paths or names in input_dir) instead of all of input_dir.
+    # progress(stage, index, n_stages) is called as each stage starts and with "done" at the end.
+    cfg = load_config()
+    setup_logging(cfg)
+    if fused is None:
+        fused = cfg.get("fused", False)
+    if streaming is None:
+        streaming = cfg.get("streaming", False)
+    workers = resolve_workers(cfg, workers)
+    mode = "streaming" if streaming else "fused" if fused else "serial"
+    cache = RunCache(cfg, force, mode) if cfg.get("cache", True) else None
+    features_dir = os.path.join(cfg["output_dir"], "features")
+    if files is not None:
+        files = raw_files(cfg, files)
+    bases = [recording_base(f) for f in files] if files is not None else None
+    n = 3 if streaming or fused else 6
+    store = FeatureStore(feature_store_path(cfg))
+    store.begin_run(cfg, mode)
+
+    # Stage spans are named after the functions they time; profile= picks one of them
+    start_run(cfg, profile)
+    # Figures render in the background while the next stage computes
+    start_plots(cfg)
+    try:
+        if streaming:
+            with _stage("run_streaming", progress, 0, n):
+                run_streaming(cfg, workers, cache, files, store)
+        elif fused:
+            with _stage("run_fused", progress, 0, n):
+                run_fused(cfg, workers, cache, files, store)
+        else:
+            with _stage("clean_signals", progress, 0, n):
+                clean_signals(workers, cache, files)
+            with _stage("detect_spikes", progress, 1, n):
+                detect_spikes(workers, cache, bases)
+            with _stage("compute_snr", progress, 2, n):
+                compute_snr(workers, cache, bases)
+            with _stage("extract_features", progress, 3, n):
+                features_from_config(cfg, workers, cache, bases, store)
+        with _stage("feature_comparison", progress, n - 2, n):
+            # Always over the whole project, so a --files run does not narrow the group statistics
+            compare_features(features_dir, cfg, store, recording_bases(cfg, bases or ()), cache)
+        if progress is not None:
+            progress("render_plots", n - 1, n)
+    finally:
+        finish_plots()
+        store.close()
+        # Saved even when a stage raised, so the recordings that finished are not redone
+        if cache is not None:
+            cache.save()
+
+    if cache is not None:
+        cache.report()
+    report = finish_run(cfg, mode=mode, workers=workers, files=files, run_id=store.run_id,
+                        cache=cache.counts if cache is not None else None)
+    if progress is not None:
+        progress("done", n, n)
+    return report
 
 if __name__ == "__main__":
     run_pipeline()
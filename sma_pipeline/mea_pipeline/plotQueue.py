@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from mea_pipeline.instrumentation import span, tracing, traced_call, attach
+from mea_pipeline.plotting import render_job
+
+# Plot jobs are handed off by the compute stages and rendered in a background
+# process pool, so figures are drawn while the next recording is processed.
+# Stages call submit_plot; the job builder only runs for enabled categories and
+# nothing imports matplotlib unless a job is actually rendered. Calls made outside
+# an active queue (e.g. inside file workers, or when a module is used directly)
+# render inline in the calling process.
+
+PLOT_CATEGORIES = ("artifacts", "cleaned", "spikes", "snr", "features")
+
+_active = None
+
+
+def plot_enabled(cfg, category):
+    return bool(cfg.get("plots", True)) and bool(cfg.get(f"plot_{category}", True))
+
+
+def _init_renderer():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+class PlotQueue:
+    def __init__(self, cfg, workers=None):
+        self.dpi = int(cfg.get("plot_dpi", 300))
+        workers = int(cfg.get("plot_workers", 1) if workers is None else workers)
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.pid = os.getpid()
+        self.executor = None
+        self.futures = []
+
+    def submit(self, job):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_renderer)
+        if tracing():
+            self.futures.append((self.executor.submit(traced_call, render_job, job, self.dpi), True))
+        else:
+            self.futures.append((self.executor.submit(render_job, job, self.dpi), False))
+
+    def close(self):
+        # Waits for every pending figure; rendering errors surface here. The wait (the
+        # time plotting adds after the last compute stage) and each render are traced.
+        try:
+            with span("plot_queue", jobs=len(self.futures)):
+                paths = []
+                for f, traced in self.futures:
+                    result = f.result()
+                    if traced:
+                        result, spans = result
+                        attach(spans)
+                    paths.append(result)
+                return paths
+        finally:
+            self.futures = []
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+def start_plots(cfg, workers=None):
+    global _active
+    _active = PlotQueue(cfg, workers)
+    return _active
+
+
+def finish_plots():
+    global _active
+    queue, _active = _active, None
+    return queue.close() if queue is not None else []
+
+
+def submit_plot(cfg, category, build, *args, **kwargs):
+    if not plot_enabled(cfg, category):
+        return
+    job = build(*args, max_points=int(cfg.get("plot_max_points", 4000)), **kwargs)
+    if _active is not None and _active.pid == os.getpid():
+        _active.submit(job)
+    else:
+        render_job(job, int(cfg.get("plot_dpi", 300)))
@@ -1,76 +1,165 @@
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
+import logging
+import numpy as np
+from mea_pipeline.instrumentation import span
+
+# Plots are built in two steps: a job builder reduces the data to what will be drawn
+# (numpy only, cheap to pickle), and render_job draws it. Long traces are reduced to a
+# min/max envelope of max_points samples, so rendering cost follows the pixel width of
+# the figure rather than the recording length. matplotlib and seaborn are imported on
+# the first render only.
+
+MAX_POINTS = 4000
+
+log = logging.getLogger(__name__)
+
 
 def ensure_dir(path):
     if path:
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-def _finalize_plot(out_path, show=False):
+def _pyplot():
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+def envelope(x, y, max_points=MAX_POINTS):
+    # Min/max of each of max_points/2 bins; y may be (samples,) or (samples x channels)
+    x, y = np.asarray(x), np.asarray(y)
+    bins = max_points // 2
+    if len(y) <= max_points or bins < 1:
+        return x, y
+    starts = np.linspace(0, len(y), bins + 1).astype(np.intp)[:-1]
+    lo, hi = np.minimum.reduceat(y, starts, axis=0), np.maximum.reduceat(y, starts, axis=0)
+    ends = np.append(starts[1:], len(y)) - 1
+    xs = np.column_stack([x[starts], x[ends]]).ravel()
+    ys = np.stack([lo, hi], axis=1).reshape((2 * bins,) + y.shape[1:])
+    return xs, ys
+
+def _thin(idx, max_points=MAX_POINTS):
+    # Evenly spaced subset of marker positions
+    idx = np.asarray(idx)
+    return idx if len(idx) <= max_points else idx[np.linspace(0, len(idx) - 1, max_points).astype(np.intp)]
+
+def _finalize_plot(plt, out_path, show=False, dpi=300):
     plt.tight_layout()
     if out_path:
-        plt.savefig(out_path, dpi=300, bbox_inches="tight")
-        print(f"Saved plot → {out_path}")
+        ensure_dir(out_path)
+        plt.savefig(out_path, dpi=dpi, bbox_inches="tight")
+        log.info("Saved plot → %s", out_path)
     if show:
         plt.show()
     plt.close()
 
-def plot_spikes(timestamps, signal, spike_indices, threshold, title, out_path=None, show=False):
-    ensure_dir(out_path)
+def spikes_job(timestamps, signal, spike_indices, threshold, title, out_path=None, max_points=MAX_POINTS):
+    timestamps, signal = np.asarray(timestamps), np.asarray(signal)
+    marks = _thin(spike_indices, max_points)
+    x, y = envelope(timestamps, signal, max_points)
+    return {"kind": "spikes", "x": x, "y": y, "mark_x": timestamps[marks], "mark_y": signal[marks],
+            "threshold": float(threshold), "title": title, "out_path": out_path}
+
+def artifact_job(timestamps, summed_signal, artifact_mask, threshold, out_path=None, max_points=MAX_POINTS):
+    timestamps, summed_signal = np.asarray(timestamps), np.asarray(summed_signal)
+    marks = _thin(np.flatnonzero(np.asarray(artifact_mask, dtype=bool)), max_points)
+    x, y = envelope(timestamps, summed_signal, max_points)
+    return {"kind": "artifacts", "x": x, "y": y, "mark_x": timestamps[marks], "mark_y": summed_signal[marks],
+            "threshold": float(threshold), "out_path": out_path}
+
+def multi_channel_job(timestamps, signals, title, out_path=None, max_points=MAX_POINTS):
+    x, y = envelope(timestamps, np.asarray(signals), max_points)
+    return {"kind": "multi_channel", "x": x, "y": y, "columns": list(signals.columns), "title": title,
+            "out_path": out_path}
+
+def snr_job(df, chunk_name, out_path=None, max_points=MAX_POINTS):
+    # Bar charts are already small; max_points is accepted so every builder shares one signature
+    return {"kind": "snr", "channels": list(df["channel"]), "snr": np.asarray(df["SNR"], dtype=float),
+            "title": chunk_name, "out_path": out_path}
+
+def feature_bar_job(df, feature, out_path=None, max_points=MAX_POINTS):
+    # Group means in order of appearance, as seaborn's barplot would aggregate them
+    means = df.groupby("group", sort=False)[feature].mean()
+    return {"kind": "feature_bar", "groups": list(means.index), "means": means.values, "feature": feature,
+            "out_path": out_path}
+
+def _render_spikes(plt, sns, job):
     plt.figure(figsize=(12, 4))
-    plt.plot(timestamps, signal, label="Signal")
-    plt.axhline(threshold, color="red", linestyle="--", label="Threshold")
-    plt.axhline(-threshold, color="red", linestyle="--")
-    plt.scatter(timestamps[spike_indices], signal[spike_indices], color="green", s=10, label="Spikes")
-    plt.title(title)
+    plt.plot(job["x"], job["y"], label="Signal")
+    plt.axhline(job["threshold"], color="red", linestyle="--", label="Threshold")
+    plt.axhline(-job["threshold"], color="red", linestyle="--")
+    plt.scatter(job["mark_x"], job["mark_y"], color="green", s=10, label="Spikes")
+    plt.title(job["title"])
     plt.legend()
-    _finalize_plot(out_path, show)
 
-def plot_artifact_mask(timestamps, summed_signal, artifact_mask, threshold, out_path=None, show=False):
-    ensure_dir(out_path)
+def _render_artifacts(plt, sns, job):
     plt.figure(figsize=(12, 4))
-    plt.plot(timestamps, summed_signal, label="Summed Signal")
-    plt.axhline(threshold, color="red", linestyle="--")
-    plt.scatter(timestamps[artifact_mask], summed_signal[artifact_mask], color="red", s=10)
+    plt.plot(job["x"], job["y"], label="Summed Signal")
+    plt.axhline(job["threshold"], color="red", linestyle="--")
+    plt.scatter(job["mark_x"], job["mark_y"], color="red", s=10)
     plt.title("Artifact Detection")
-    _finalize_plot(out_path, show)
-
-def plot_multi_channel_signals(timestamps, signals, title, out_path=None, show=False):
-    ensure_dir(out_path)
-    fig, axs = plt.subplots(signals.shape[1], 1, figsize=(12, 2*signals.shape[1]), sharex=True)
-    for i, col in enumerate(signals.columns):
-        axs[i].plot(timestamps, signals[col])
-        axs[i].set_title(col)
-    fig.suptitle(title)
-    _finalize_plot(out_path, show)
-
-def plot_snr_bar(df, chunk_name, out_path=None, show=False):
-    ensure_dir(out_path)
+
+def _render_multi_channel(plt, sns, job):
+    n = len(job["columns"])
+    fig, axs = plt.subplots(n, 1, figsize=(12, 2*n), sharex=True, squeeze=False)
+    for i, col in enumerate(job["columns"]):
+        axs[i, 0].plot(job["x"], job["y"][:, i])
+        axs[i, 0].set_title(col)
+    fig.suptitle(job["title"])
+
+def _render_snr(plt, sns, job):
     plt.figure(figsize=(12, 6))
-    sns.barplot(data=df, x="channel", y="SNR", palette="Set2", errorbar=None)
+    sns.barplot(x=job["channels"], y=job["snr"], hue=job["channels"], palette="Set2", errorbar=None, legend=False)
     plt.xticks(rotation=90)
-    plt.title(f"SNR per Channel – {chunk_name}")
+    plt.title(f"SNR per Channel – {job['title']}")
     plt.xlabel("Channel")
     plt.ylabel("SNR")
-    _finalize_plot(out_path, show)
 
-def plot_group_feature_bar(df, feature, out_path=None, show=False):
-    if feature not in df.columns:
-        return
+def _render_feature_bar(plt, sns, job):
+    feat = job["feature"]
+    sns.set_theme(style="whitegrid")
+    sns.set_context("talk")
+    plt.figure(figsize=(7,6))
+    palette = ["#4C72B0", "#55A868"][:len(job["groups"])] if len(job["groups"]) <= 2 else None
+    ax = sns.barplot(x=job["groups"], y=job["means"], hue=job["groups"], palette=palette, errorbar=None, legend=False)
+    for patch in ax.patches:
+        patch.set_edgecolor("black")
+        patch.set_linewidth(1.2)
+    plt.title(f"{feat.replace('_',' ').title()} – {' vs '.join(map(str, job['groups']))}", fontsize=16, weight="bold")
+    plt.ylabel(feat.replace("_"," ").title(), fontsize=14)
+    plt.xlabel("")
+    plt.xticks(fontsize=13, weight="bold")
+    plt.yticks(fontsize=12)
+
+RENDERERS = {
+    "spikes": _render_spikes,
+    "artifacts": _render_artifacts,
+    "multi_channel": _render_multi_channel,
+    "snr": _render_snr,
+    "feature_bar": _render_feature_bar
+}
+
+def render_job(job, dpi=300, show=False):
+    with span("plot", kind=job["kind"]):
+        plt, sns = _pyplot()
+        RENDERERS[job["kind"]](plt, sns, job)
+        _finalize_plot(plt, job["out_path"], show, dpi)
+    return job["out_path"]
+
+def plot_spikes(timestamps, signal, spike_indices, threshold, title, out_path=None, show=False, dpi=300):
+    render_job(spikes_job(timestamps, signal, spike_indices, threshold, title, out_path), dpi, show)
 
-    ensure_dir(out_path)
-    plt.figure(figsize=(6, 5))
+def plot_artifact_mask(timestamps, summed_signal, artifact_mask, threshold, out_path=None, show=False, dpi=300):
+    render_job(artifact_job(timestamps, summed_signal, artifact_mask, threshold, out_path), dpi, show)
 
-    group_means = df.groupby("group")[feature].mean().reindex(["Healthy", "SMA"])
-    sns.barplot(x=group_means.index, y=group_means.values, palette="Set2", errorbar=None)
+def plot_multi_channel_signals(timestamps, signals, title, out_path=None, show=False, dpi=300):
+    render_job(multi_channel_job(timestamps, signals, title, out_path), dpi, show)
 
-    plt.ylabel(feature)
-    plt.title(f"{feature} – Healthy vs SMA")
-    _finalize_plot(out_path, show)
+def plot_snr_bar(df, chunk_name, out_path=None, show=False, dpi=300):
+    render_job(snr_job(df, chunk_name, out_path), dpi, show)
 
-def plot_all_group_features(df, out_dir="output/features", show=False):
-    features = ["spike_count", "firing_rate", "isi_mean", "burst_count", "mean_spikes_per_burst"]
+def plot_all_group_features(store, out_dir="output/features", show=False, dpi=300, **filters):
+    # store: a FeatureStore; filters narrow the query (recordings, groups, channels, dates)
+    features = ["spike_count", "firing_rate", "isi_mean", "burst_count", "mean_spikes_per_burst", "mean_burst_duration"]
+    df = store.query(**filters)
     for feat in features:
         if feat in df.columns:
-            out_path = os.path.join(out_dir, f"{feat}_barplot.png")
-            plot_group_feature_bar(df, feat, out_path, show)
+            render_job(feature_bar_job(df, feat, os.path.join(out_dir, f"{feat}_barplot.png")), dpi, show)
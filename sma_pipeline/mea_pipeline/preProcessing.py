@@ -1,76 +1,140 @@
 import os
+import logging
+from functools import partial
 import pandas as pd
 import numpy as np
-import yaml
-from mea_pipeline.plotting import plot_artifact_mask, plot_multi_channel_signals
+from mea_pipeline.config import load_config
+from mea_pipeline.ingestion import load_raw, is_raw
+from mea_pipeline.instrumentation import setup_logging, span, add_samples
+from mea_pipeline.interpolation import fill_from_config
+from mea_pipeline.parallel import resolve_workers, map_files
+from mea_pipeline.plotting import artifact_job, multi_channel_job
+from mea_pipeline.plotQueue import submit_plot
+from mea_pipeline.signalStore import save_cleaned, recording_base
 
-def load_config():
-    with open("config/config.yaml", "r") as f:
-        return yaml.safe_load(f)
+log = logging.getLogger(__name__)
 
-def clean_signals():
-    cfg = load_config()
+def artifact_threshold(max_signal, z_score_threshold):
+    # max_signal: per-sample max |x| over channels (a pandas Series)
+    return max_signal.mean() + z_score_threshold * max_signal.std()
+
+def clean_recording(filepath, cfg, save=True):
+    with span("clean", file=os.path.basename(filepath)):
+        return _clean_recording(filepath, cfg, save)
 
-    input_dir = cfg["input_dir"]
+def _clean_recording(filepath, cfg, save=True):
     output_dir = os.path.join(cfg["output_dir"], "cleaned")
     mask_dir = os.path.join(cfg["output_dir"], "artifact_masks")
     plot_dir = os.path.join(cfg["output_dir"], "cleaned_plots")
 
-    os.makedirs(output_dir, exist_ok=True)
     os.makedirs(mask_dir, exist_ok=True)
-    os.makedirs(plot_dir, exist_ok=True)
 
-    for filename in sorted(os.listdir(input_dir)):
-        if not filename.endswith(".csv"):
-            continue
+    filename = os.path.basename(filepath)
+    log.info("Cleaning: %s", filename)
+    with span("read_raw"):
+        raw = load_raw(filepath, cfg)
+        timestamps = pd.Series(np.array(raw["timestamps"]))
+        signal_cols = raw["channels"]
+        signals = pd.DataFrame(np.array(raw["signals"]), columns=signal_cols)
+    add_samples(signals.size)
 
-        print(f"Cleaning: {filename}")
-        filepath = os.path.join(input_dir, filename)
-        df = pd.read_csv(filepath)
-        df.columns = df.columns.str.strip()
+    base = recording_base(filename)
 
-        timestamps = df[df.columns[0]]
-        signal_cols = [col for col in df.columns if col.endswith("_values")]
-        signals = df[signal_cols].copy()
+    max_signal = signals.abs().max(axis=1)
+    threshold = artifact_threshold(max_signal, cfg["z_score_threshold"])
+    artifact_mask = (max_signal > threshold)
+    log.info("  Artifacts detected: %s timepoints", artifact_mask.sum())
 
-        base = os.path.splitext(filename)[0].replace("_cleaned", "").replace("_CLEANED", "")
+    np.save(os.path.join(mask_dir, f"{base}_artifact_mask.npy"), artifact_mask)
 
-        max_signal = signals.abs().max(axis=1)
-        mean = max_signal.mean()
-        std = max_signal.std()
-        threshold = mean + cfg["z_score_threshold"] * std
-        artifact_mask = (max_signal > threshold)
-        print(f"  Artifacts detected: {artifact_mask.sum()} timepoints")
+    submit_plot(
+        cfg, "artifacts", artifact_job,
+        timestamps,
+        max_signal,
+        artifact_mask,
+        threshold,
+        os.path.join(plot_dir, f"{base}_artifact_debug.png")
+    )
 
-        np.save(os.path.join(mask_dir, f"{base}_artifact_mask.npy"), artifact_mask)
+    with span("interpolate"):
+        cleaned_signals = pd.DataFrame(fill_from_config(signals.values, artifact_mask.values, cfg),
+                                       columns=signal_cols, index=signals.index)
 
-        plot_artifact_mask(
-            timestamps,
-            max_signal,
-            artifact_mask,
-            threshold,
-            os.path.join(plot_dir, f"{base}_artifact_debug.png")
-        )
-
-        cleaned_signals = signals.copy()
-        for col in cleaned_signals.columns:
-            cleaned_signals.loc[artifact_mask, col] = np.nan
-            cleaned_signals[col] = cleaned_signals[col].interpolate(method="spline", order=2).bfill().ffill()
+    if save:
+        os.makedirs(output_dir, exist_ok=True)
+        with span("save_store"):
+            out_path = save_cleaned(output_dir, base, timestamps.values, cleaned_signals.values,
+                                    signal_cols, artifact_mask.values, cfg["fs"])
+        log.info("  Saved: %s", out_path)
 
+    if cfg.get("write_cleaned_csv", False):
+        os.makedirs(output_dir, exist_ok=True)
         cleaned_df = cleaned_signals.copy()
         cleaned_df.insert(0, "timestamps", timestamps)
-        out_path = os.path.join(output_dir, f"{base}_cleaned.csv")
-        cleaned_df.to_csv(out_path, index=False)
-        print(f"  Saved: {out_path}")
-
-       
-        s, d, n, c = cfg["plot_start_time"], cfg["duration"], cfg["downsample_factor"], cfg["channels_per_plot"]
-        ts_window = timestamps[(timestamps >= s) & (timestamps <= s + d)][::n]
-        signals_window = cleaned_signals[(timestamps >= s) & (timestamps <= s + d)].iloc[::n]
-
-        plot_multi_channel_signals(
-            ts_window,
-            signals_window.iloc[:, :c],
-            f"{base} - Cleaned",
-            os.path.join(plot_dir, f"{base}_CLEANED_SAMPLE.png")
-        )
+        csv_path = os.path.join(output_dir, f"{base}_cleaned.csv")
+        with span("write_csv"):
+            cleaned_df.to_csv(csv_path, index=False)
+        log.info("  Saved: %s", csv_path)
+
+    s, d, n, c = cfg["plot_start_time"], cfg["duration"], cfg["downsample_factor"], cfg["channels_per_plot"]
+    ts_window = timestamps[(timestamps >= s) & (timestamps <= s + d)][::n]
+    signals_window = cleaned_signals[(timestamps >= s) & (timestamps <= s + d)].iloc[::n]
+
+    submit_plot(
+        cfg, "cleaned", multi_channel_job,
+        ts_window,
+        signals_window.iloc[:, :c],
+        f"{base} - Cleaned",
+        os.path.join(plot_dir, f"{base}_CLEANED_SAMPLE.png")
+    )
+
+    return {
+        "name": f"{base}_cleaned",
+        "base": base,
+        "signals": np.asfortranarray(cleaned_signals.values),
+        "timestamps": timestamps.values,
+        "channels": signal_cols,
+        "artifact_mask": artifact_mask.values,
+        "fs": float(cfg["fs"])
+    }
+
+def _clean_file(filepath, cfg):
+    # Only the on-disk store is needed afterwards; don't ship the arrays back from a worker
+    clean_recording(filepath, cfg)
+
+def raw_files(cfg, files=None):
+    # Every raw recording in input_dir, or the given ones (paths, or names inside input_dir)
+    if files is None:
+        return [os.path.join(cfg["input_dir"], f) for f in sorted(os.listdir(cfg["input_dir"])) if is_raw(f)]
+    resolved = []
+    for f in files:
+        path = f if os.path.exists(f) else os.path.join(cfg["input_dir"], f)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Raw recording not found: {f}")
+        resolved.append(path)
+    return resolved
+
+def recording_bases(cfg, bases=()):
+    # The project's recordings: every raw file in input_dir, then any other given bases
+    known = [recording_base(f) for f in raw_files(cfg)] if os.path.isdir(cfg["input_dir"]) else []
+    return known + [b for b in bases if b not in known]
+
+def recording_names(cfg, names=()):
+    # Same as recording_bases, as "{base}_cleaned" names
+    bases = [n[:-len("_cleaned")] if n.endswith("_cleaned") else n for n in names]
+    return [f"{b}_cleaned" for b in recording_bases(cfg, bases)]
+
+def clean_signals(workers=None, cache=None, files=None):
+    cfg = load_config()
+    setup_logging(cfg)
+
+    files = raw_files(cfg, files)
+    if cache is not None:
+        todo = cache.stale("clean", {recording_base(f): f for f in files}, lambda base, f: cache.file_hash(f),
+                           save_store=True)
+        files = [f for f, _ in todo.values()]
+
+    map_files(partial(_clean_file, cfg=cfg), files, resolve_workers(cfg, workers))
+
+    if cache is not None:
+        cache.record_done("clean", todo)
@@ -0,0 +1,202 @@
+import os
+import json
+import logging
+import hashlib
+import importlib
+from mea_pipeline.signalStore import recording_base, store_paths
+
+# Manifest-backed incremental re-runs. Every (stage, recording) entry stores a key
+# derived from its upstream key, the config values the stage reads and the source
+# of the modules that implement it; the raw file's content hash roots the chain.
+# A stage is skipped for a recording when its key is unchanged and its outputs exist.
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+STAGES = ("clean", "spikes", "snr", "features", "comparison")
+
+STAGE_CONFIG = {
+    "clean": ["fs", "raw_dtype", "z_score_threshold", "interpolation_method", "interpolation_context",
+              "interpolation_order", "write_cleaned_csv", "plot_start_time", "duration", "downsample_factor",
+              "channels_per_plot"],
+    "spikes": ["fs", "spike_threshold_multiplier", "spike_threshold_policy", "spike_noise_estimator",
+               "write_dense_spike_mask"],
+    "snr": ["noise_threshold", "max_valid_snr"],
+    "features": ["fs", "burst_isi", "burst_min_spikes", "groups", "network", "network_bin",
+                 "network_burst_min_fraction", "network_burst_max_gap", "sttc_dt", "waveforms", "waveform_pre",
+                 "waveform_post", "waveform_pcs", "waveform_max_units", "waveform_min_unit_spikes",
+                 "waveform_refractory", "waveform_seed"],
+    "comparison": ["stats_features", "stats_permutations", "stats_bootstrap", "stats_ci", "stats_correction",
+                   "stats_seed"]
+}
+
+# Chunked cleaning depends on the chunking, so streaming runs add these to the clean key
+STREAMING_CONFIG = ["chunk_size", "chunk_overlap"]
+
+STAGE_MODULES = {
+    "clean": ["mea_pipeline.ingestion", "mea_pipeline.preProcessing", "mea_pipeline.interpolation",
+              "mea_pipeline.signalStore", "mea_pipeline.streaming"],
+    "spikes": ["mea_pipeline.spikes", "mea_pipeline.spikeEngine", "mea_pipeline.spikeTrains", "mea_pipeline.noiseStats"],
+    "snr": ["mea_pipeline.snr", "mea_pipeline.noiseStats"],
+    "features": ["mea_pipeline.features", "mea_pipeline.bursts", "mea_pipeline.groupStats", "mea_pipeline.network",
+                 "mea_pipeline.waveforms"],
+    "comparison": ["mea_pipeline.featureComparison", "mea_pipeline.featureStore", "mea_pipeline.groupStats"]
+}
+
+UPSTREAM = {"spikes": "clean", "snr": "clean", "features": "spikes"}
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def code_version(stage):
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for name in STAGE_MODULES[stage]:
+        with open(importlib.import_module(name).__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def feature_rows_path(cfg, base):
+    return os.path.join(cfg["output_dir"], "features", "per_file", f"{base}_cleaned.csv")
+
+
+def stage_outputs(cfg, stage, base, save_store=True):
+    out = cfg["output_dir"]
+    if stage == "clean":
+        outputs = [os.path.join(out, "artifact_masks", f"{base}_artifact_mask.npy")]
+        if save_store:
+            outputs += list(store_paths(os.path.join(out, "cleaned"), base).values())
+        return outputs
+    if stage == "spikes":
+        return [os.path.join(out, "spike", "trains", f"{base}_cleaned_spikes.npz"),
+                os.path.join(out, "spike", "info", f"{base}_cleaned_spikes_info.csv")]
+    if stage == "snr":
+        return [os.path.join(out, "snr", f"{base}_cleaned_snr.txt"),
+                os.path.join(out, "snr", f"{base}_cleaned_snr.csv")]
+    if stage == "features":
+        outputs = [feature_rows_path(cfg, base)]
+        if cfg.get("network", True):
+            outputs.append(os.path.join(out, "network", f"{base}_cleaned_network.csv"))
+        if cfg.get("waveforms", True):
+            outputs.append(os.path.join(out, "spike", "waveforms", f"{base}_cleaned_units.csv"))
+        return outputs
+    return [os.path.join(out, "features", "grouped_features.csv"),
+            os.path.join(out, "features", "feature_stats.csv")]
+
+
+class RunCache:
+    def __init__(self, cfg, force=False, mode="serial"):
+        self.cfg = cfg
+        self.force = force
+        self.mode = mode
+        self.path = os.path.join(cfg["output_dir"], ".cache", "manifest.json")
+        self.manifest = {"files": {}, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+        self.counts = {stage: {"hit": 0, "miss": 0} for stage in STAGES}
+        self._code = {}
+
+    def file_hash(self, path):
+        # Content hash, re-read only when size or mtime changed since the last run
+        st = os.stat(path)
+        known = self.manifest["files"].get(os.path.abspath(path))
+        if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+            return known["sha256"]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.manifest["files"][os.path.abspath(path)] = {
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        return h.hexdigest()
+
+    def stage_key(self, stage, upstream_key):
+        if upstream_key is None:
+            return None
+        if stage not in self._code:
+            self._code[stage] = code_version(stage)
+        params = {k: self.cfg.get(k) for k in STAGE_CONFIG[stage]}
+        if stage == "clean" and self.mode == "streaming":
+            params.update({k: self.cfg.get(k) for k in STREAMING_CONFIG}, mode=self.mode)
+        return _digest([stage, upstream_key, params, self._code[stage]])
+
+    def recorded_key(self, stage, base):
+        return self.manifest["stages"].get(stage, {}).get(base, {}).get("key")
+
+    def upstream_key(self, stage, base):
+        return self.recorded_key(UPSTREAM[stage], base)
+
+    def is_current(self, stage, base, key, save_store=None, count=True):
+        # save_store=True also demands the cleaned store, which a fused run may not have written
+        entry = self.manifest["stages"].get(stage, {}).get(base)
+        if entry is None:
+            hit = False
+        else:
+            outputs = entry["outputs"] if save_store is None else stage_outputs(self.cfg, stage, base, save_store)
+            hit = (not self.force and key is not None and entry["key"] == key
+                   and all(os.path.exists(p) for p in outputs))
+        if count:
+            self.counts[stage]["hit" if hit else "miss"] += 1
+        return hit
+
+    def record(self, stage, base, key, outputs):
+        self.manifest["stages"].setdefault(stage, {})[base] = {"key": key, "outputs": list(outputs)}
+
+    def stale(self, stage, items, upstream=None, save_store=None):
+        # items: {base: payload} -> {base: (payload, key)} for the recordings that must rerun
+        upstream = upstream or (lambda base, payload: self.upstream_key(stage, base))
+        todo = {}
+        for base, payload in items.items():
+            key = self.stage_key(stage, upstream(base, payload))
+            if not self.is_current(stage, base, key, save_store):
+                todo[base] = (payload, key)
+        return todo
+
+    def record_done(self, stage, todo, save_store=True):
+        for base, (_, key) in todo.items():
+            self.record(stage, base, key, stage_outputs(self.cfg, stage, base, save_store))
+
+    def file_keys(self, filepath):
+        # The whole per-recording key chain, for the modes that run every stage in one pass
+        keys = {"clean": self.stage_key("clean", self.file_hash(filepath))}
+        keys["spikes"] = self.stage_key("spikes", keys["clean"])
+        keys["snr"] = self.stage_key("snr", keys["clean"])
+        keys["features"] = self.stage_key("features", keys["spikes"])
+        return keys
+
+    def stale_files(self, files):
+        # -> ({filepath: keys} that must rerun, set of those whose cleaned store is still current)
+        todo, reuse = {}, set()
+        for f in files:
+            base, keys = recording_base(f), self.file_keys(f)
+            current = {stage: self.is_current(stage, base, key) for stage, key in keys.items()}
+            if all(current.values()):
+                continue
+            todo[f] = keys
+            if current["clean"] and os.path.exists(store_paths(os.path.join(self.cfg["output_dir"], "cleaned"), base)["signals"]):
+                reuse.add(f)
+        return todo, reuse
+
+    def record_file(self, base, keys, save_store=True):
+        for stage, key in keys.items():
+            self.record(stage, base, key, stage_outputs(self.cfg, stage, base, save_store))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.manifest["last_report"] = self.counts
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def report(self):
+        for stage in STAGES:
+            c = self.counts[stage]
+            if c["hit"] or c["miss"]:
+                log.info("Cache %s: %s hit, %s miss", stage, c['hit'], c['miss'])
+        return self.counts
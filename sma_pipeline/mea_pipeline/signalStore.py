@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pandas as pd
+
+STORE_SUFFIX = "_cleaned.npy"
+
+
+def recording_base(filename):
+    return os.path.splitext(os.path.basename(filename))[0].replace("_cleaned", "").replace("_CLEANED", "")
+
+
+def store_base(data_path):
+    return os.path.basename(data_path)[:-len(STORE_SUFFIX)]
+
+
+def store_paths(out_dir, base):
+    stem = os.path.join(out_dir, f"{base}_cleaned")
+    return {
+        "signals": f"{stem}.npy",
+        "timestamps": f"{stem}_timestamps.npy",
+        "artifact_mask": f"{stem}_artifacts.npy",
+        "meta": f"{stem}_meta.npz"
+    }
+
+
+def _save_meta(paths, channels, fs):
+    np.savez(paths["meta"], channels=np.asarray(channels, dtype=str), fs=float(fs))
+
+
+def save_cleaned(out_dir, base, timestamps, signals, channels, artifact_mask, fs):
+    paths = store_paths(out_dir, base)
+
+    # (samples x channels) in Fortran order so every channel is one contiguous block on disk
+    np.save(paths["signals"], np.asfortranarray(signals))
+    np.save(paths["timestamps"], np.asarray(timestamps))
+    np.save(paths["artifact_mask"], np.asarray(artifact_mask, dtype=bool))
+    _save_meta(paths, channels, fs)
+    return paths["signals"]
+
+
+def create_cleaned(out_dir, base, n_samples, channels, fs, dtype=np.float64, ts_dtype=np.float64):
+    # Preallocated on-disk store that can be filled chunk by chunk
+    paths = store_paths(out_dir, base)
+    _save_meta(paths, channels, fs)
+    open_memmap = np.lib.format.open_memmap
+    return {
+        "name": f"{base}_cleaned",
+        "base": base,
+        "path": paths["signals"],
+        "signals": open_memmap(paths["signals"], mode="w+", dtype=dtype,
+                               shape=(n_samples, len(channels)), fortran_order=True),
+        "timestamps": open_memmap(paths["timestamps"], mode="w+", dtype=ts_dtype, shape=(n_samples,)),
+        "artifact_mask": open_memmap(paths["artifact_mask"], mode="w+", dtype=bool, shape=(n_samples,)),
+        "channels": list(channels),
+        "fs": float(fs)
+    }
+
+
+def load_cleaned(data_path, mmap=True):
+    base = store_base(data_path)
+    paths = store_paths(os.path.dirname(data_path), base)
+    mode = "r" if mmap else None
+    with np.load(paths["meta"]) as meta:
+        channels = [str(ch) for ch in meta["channels"]]
+        fs = float(meta["fs"])
+    return {
+        "name": f"{base}_cleaned",
+        "base": base,
+        "path": data_path,
+        "signals": np.load(paths["signals"], mmap_mode=mode),
+        "timestamps": np.load(paths["timestamps"], mmap_mode=mode),
+        "artifact_mask": np.load(paths["artifact_mask"], mmap_mode=mode),
+        "channels": channels,
+        "fs": fs
+    }
+
+
+def list_cleaned(cleaned_dir, bases=None):
+    # bases: optional recording bases to restrict the listing to
+    if not os.path.exists(cleaned_dir):
+        return []
+    stores = [os.path.join(cleaned_dir, f) for f in sorted(os.listdir(cleaned_dir)) if f.endswith(STORE_SUFFIX)]
+    return stores if bases is None else [s for s in stores if store_base(s) in set(bases)]
+
+
+def channel_view(rec, ch):
+    return rec["signals"][:, rec["channels"].index(ch)]
+
+
+def to_dataframe(rec):
+    df = pd.DataFrame(np.asarray(rec["signals"]), columns=rec["channels"])
+    df.insert(0, "timestamps", rec["timestamps"])
+    return df
+
+
+def export_cleaned_csv(data_path, out_path=None):
+    rec = load_cleaned(data_path)
+    if out_path is None:
+        out_path = data_path[:-len(".npy")] + ".csv"
+    to_dataframe(rec).to_csv(out_path, index=False)
+    return out_path
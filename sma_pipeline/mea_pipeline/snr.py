@@ -1,49 +1,96 @@
 import os
+import logging
+from functools import partial
 import pandas as pd
 import numpy as np
-import yaml
-from mea_pipeline.plotting import plot_snr_bar
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging, span, add_samples
+from mea_pipeline.noiseStats import recording_noise_stats, channel_snr, moments_std
+from mea_pipeline.parallel import resolve_workers, map_files
+from mea_pipeline.plotting import snr_job
+from mea_pipeline.plotQueue import submit_plot
+from mea_pipeline.preProcessing import recording_names
+from mea_pipeline.signalStore import list_cleaned, load_cleaned, store_base
 
-def load_config():
-    with open("config/config.yaml", "r") as f:
-        cfg = yaml.safe_load(f)
-        cfg["noise_threshold"] = float(cfg["noise_threshold"])
-        return cfg
+log = logging.getLogger(__name__)
 
-def compute_snr():
-    cfg = load_config()
-    input_dir = os.path.join(cfg["output_dir"], "cleaned")
+def compute_recording_snr(rec, cfg, stats=None):
+    # `stats` is recording_noise_stats' result when the caller already has it (fused mode)
+    with span("snr", file=rec["name"]):
+        add_samples(rec["signals"].size)
+        return _compute_recording_snr(rec, cfg, stats)
+
+def _compute_recording_snr(rec, cfg, stats=None):
+    if stats is None:
+        stats = recording_noise_stats(rec, cfg)
+    return save_snr_report(snr_table(rec["channels"], stats, cfg.get("max_valid_snr")), rec["name"], cfg)
+
+def snr_table(channels, stats, max_valid_snr=None):
+    noise_std, snr, valid = channel_snr(stats, max_valid_snr)
+    return pd.DataFrame({
+        "channel": channels,
+        "SNR": snr,
+        "noise_std": noise_std,
+        "mad_sigma": stats.get("mad_sigma", np.full(len(channels), np.nan)),
+        "std": moments_std(stats["moments"]),
+        "peak": stats["max"],
+        "valid": valid
+    })
+
+def snr_table_path(cfg, name):
+    return os.path.join(cfg["output_dir"], "snr", f"{name}_snr.csv")
+
+def save_snr_report(table, base, cfg):
+    # The full table goes to {base}_snr.csv; the text report and plot only keep valid channels
     output_dir = os.path.join(cfg["output_dir"], "snr")
     os.makedirs(output_dir, exist_ok=True)
+    table.to_csv(snr_table_path(cfg, base), index=False)
+
+    df_snr = table.loc[table["valid"], ["channel", "SNR"]].reset_index(drop=True)
+    excluded = len(table) - len(df_snr)
+    if excluded:
+        log.info("  %s channel(s) without noise samples or with SNR above max_valid_snr excluded", excluded)
+
+    out_txt = os.path.join(output_dir, f"{base}_snr.txt")
+    with open(out_txt, "w") as f:
+        for ch, snr_val in df_snr.itertuples(index=False):
+            f.write(f"{ch}\tSNR: {snr_val:.3f}\n")
+    log.info("Saved SNR report: %s", out_txt)
+
+    out_png = os.path.join(output_dir, f"{base}_snr.png")
+    submit_plot(cfg, "snr", snr_job, df_snr, base, out_png)
+    return df_snr
+
+def save_snr_summary(cfg, names):
+    # output/snr/snr_summary.csv: every channel, valid or not, of the given recordings and of
+    # every other recording in input_dir that has an SNR table, so partial runs keep the rest
+    names = recording_names(cfg, names)
+    tables = [pd.read_csv(snr_table_path(cfg, name)).assign(recording=name) for name in names
+              if os.path.exists(snr_table_path(cfg, name))]
+    if not tables:
+        return None
+    summary = pd.concat(tables, ignore_index=True)
+    summary = summary[["recording"] + [c for c in summary.columns if c != "recording"]]
+    out_path = os.path.join(cfg["output_dir"], "snr", "snr_summary.csv")
+    summary.to_csv(out_path, index=False)
+    log.info("Saved SNR summary: %s", out_path)
+    return summary
+
+def _snr_file(filepath, cfg):
+    return compute_recording_snr(load_cleaned(filepath), cfg)
+
+def compute_snr(workers=None, cache=None, bases=None):
+    cfg = load_config()
+    setup_logging(cfg)
+    input_dir = os.path.join(cfg["output_dir"], "cleaned")
+    files = list_cleaned(input_dir, bases)
+    names = [f"{store_base(f)}_cleaned" for f in files]
+    if cache is not None:
+        todo = cache.stale("snr", {store_base(f): f for f in files})
+        files = [f for f, _ in todo.values()]
+
+    map_files(partial(_snr_file, cfg=cfg), files, resolve_workers(cfg, workers))
+    save_snr_summary(cfg, names)
 
-    for filename in sorted(os.listdir(input_dir)):
-        if not filename.endswith("_cleaned.csv"):
-            continue
-
-        filepath = os.path.join(input_dir, filename)
-        df = pd.read_csv(filepath)
-        if "timestamps" not in df.columns:
-            continue
-
-        signals = df.drop(columns=["timestamps"])
-        snr_results = []
-
-        for col in signals.columns:
-            signal = signals[col]
-            noise_std = signal[signal.abs() < cfg["noise_threshold"]].std()
-            signal_max = signal.max()
-            snr = signal_max / noise_std if noise_std != 0 else 0.0
-            snr_results.append((col, snr))
-
-        base = os.path.splitext(filename)[0]
-
-     
-        out_txt = os.path.join(output_dir, f"{base}_snr.txt")
-        with open(out_txt, "w") as f:
-            for ch, snr_val in snr_results:
-                f.write(f"{ch}\tSNR: {snr_val:.3f}\n")
-        print(f"Saved SNR report: {out_txt}")
-
-        df_snr = pd.DataFrame(snr_results, columns=["channel", "SNR"])
-        out_png = os.path.join(output_dir, f"{base}_snr.png")
-        plot_snr_bar(df_snr, base, out_png)
+    if cache is not None:
+        cache.record_done("snr", todo)
@@ -0,0 +1,173 @@
+import time
+import logging
+import numpy as np
+from scipy.signal import find_peaks
+from mea_pipeline.noiseStats import MAD_SCALE, noise_stats, moments_std, pooled_moments
+from mea_pipeline.parallel import map_channels
+
+try:
+    # Private scipy helper; requirements.txt pins the scipy range it was checked against
+    from scipy.signal._peak_finding_utils import _select_by_peak_distance
+except ImportError:
+    _select_by_peak_distance = None
+
+# One bipolar threshold-crossing detector for a whole (samples x channels) array.
+# Candidates are found with vectorized comparisons over blocks of rows for all
+# channels at once; only the (few) supra-threshold local extrema then go through
+# the same refractory/distance selection scipy's find_peaks applies, so the
+# result matches find_peaks(signal, height=thr, distance=d) on +signal and -signal.
+# Without scipy's private distance helper the same selection runs as a Python loop
+# over the candidates: about 15% slower overall on `benchmark()` (60 channels firing
+# at 20 Hz), more on busier channels.
+
+log = logging.getLogger(__name__)
+
+if _select_by_peak_distance is None:
+    log.warning("scipy.signal._peak_finding_utils._select_by_peak_distance is unavailable; "
+                "using the slower pure-Python peak distance selection")
+
+def noise_levels(signals, policy="channel", estimator="std", stats=None):
+    # `stats` is noise_stats' result for `signals` when the caller already has it
+    if estimator not in ("std", "mad"):
+        raise ValueError(f"Unknown spike noise estimator: {estimator}")
+    n_channels = signals.shape[1]
+    if estimator == "mad" and policy == "global":
+        return np.full(n_channels, np.median(np.abs(signals)) / MAD_SCALE)
+    if stats is None or (estimator == "mad" and "mad_sigma" not in stats):
+        stats = noise_stats(signals, robust=estimator == "mad")
+    if estimator == "mad":
+        # Quiroga et al. 2004: sigma = median(|x|) / 0.6745, robust to the spikes themselves
+        return stats["mad_sigma"]
+    if policy == "global":
+        return np.full(n_channels, moments_std(pooled_moments(stats["moments"])))
+    return moments_std(stats["moments"])
+
+
+def spike_thresholds(signals, multiplier, policy="channel", estimator="std", stats=None):
+    if policy not in ("channel", "global"):
+        raise ValueError(f"Unknown spike threshold policy: {policy}")
+    return float(multiplier) * noise_levels(signals, policy, estimator, stats)
+
+
+def _select_by_distance(peaks, priority, distance):
+    if _select_by_peak_distance is not None:
+        return _select_by_peak_distance(peaks, priority.astype(np.float64), np.float64(distance))
+
+    keep = np.ones(len(peaks), dtype=bool)
+    for i in np.argsort(priority)[::-1]:
+        if not keep[i]:
+            continue
+        j = i - 1
+        while j >= 0 and peaks[i] - peaks[j] < distance:
+            keep[j] = False
+            j -= 1
+        j = i + 1
+        while j < len(peaks) and peaks[j] - peaks[i] < distance:
+            keep[j] = False
+            j += 1
+    return keep
+
+
+def _split_by_channel(cols, rows, n_channels):
+    counts = np.bincount(cols, minlength=n_channels)
+    return np.split(rows, np.cumsum(counts)[:-1])
+
+
+def _candidates(signals, thresholds, block_size):
+    n_samples, n_channels = signals.shape
+    pos = [[] for _ in range(n_channels)]
+    neg = [[] for _ in range(n_channels)]
+    plateau = np.zeros(n_channels, dtype=bool)
+
+    for a in range(1, n_samples - 1, block_size):
+        b = min(a + block_size, n_samples - 1)
+        x = np.asarray(signals[a - 1:b + 1])
+        mid = x[1:-1]
+
+        # One dense pass for the threshold; the local-maximum tests only touch the
+        # supra-threshold samples. Transposing keeps the hits channel-major.
+        cols, rows = np.nonzero((np.abs(mid) >= thresholds).T)
+        vals, left, right = mid[rows, cols], x[rows, cols], x[rows + 2, cols]
+        thr = thresholds[cols]
+
+        up = (vals >= thr) & (vals > left)
+        down = (-vals >= thr) & (vals < left)
+        for out, hit in ((pos, up & (vals > right)), (neg, down & (vals < right))):
+            for i, idx in enumerate(_split_by_channel(cols[hit], rows[hit] + a, n_channels)):
+                if len(idx):
+                    out[i].append(idx)
+
+        # Flat-topped maxima are rare in float data; those channels fall back to find_peaks
+        plateau[cols[(up | down) & (vals == right)]] = True
+
+    join = lambda parts: np.concatenate(parts) if parts else np.empty(0, dtype=np.intp)
+    return [join(p) for p in pos], [join(n) for n in neg], plateau
+
+
+def _detect_block(signals, channels, thresholds, distance, block_size):
+    sub = signals[:, channels] if len(channels) != signals.shape[1] else signals
+    thr = np.asarray(thresholds, dtype=float)[channels]
+    pos, neg, plateau = _candidates(sub, thr, block_size)
+
+    results = []
+    for k, ch in enumerate(channels):
+        signal = signals[:, ch]
+        if plateau[k]:
+            pos_idx, _ = find_peaks(signal, height=thr[k], distance=distance)
+            neg_idx, _ = find_peaks(-signal, height=thr[k], distance=distance)
+        else:
+            pos_idx = pos[k][_select_by_distance(pos[k], signal[pos[k]], distance)] if distance > 1 else pos[k]
+            neg_idx = neg[k][_select_by_distance(neg[k], -signal[neg[k]], distance)] if distance > 1 else neg[k]
+        idx = np.sort(np.concatenate([pos_idx, neg_idx])).astype(np.intp)
+        results.append((idx, np.asarray(signal[idx])))
+    return results
+
+
+def detect_multichannel(signals, thresholds, distance, workers=1, min_samples=0, block_size=200000):
+    per_channel = map_channels(_detect_block, signals, workers, thresholds, distance, block_size,
+                               min_samples=min_samples)
+    return [idx for idx, _ in per_channel], [amp for _, amp in per_channel]
+
+
+def detect_recording(rec, cfg, workers=1, stats=None):
+    thresholds = spike_thresholds(rec["signals"], cfg["spike_threshold_multiplier"],
+                                  cfg.get("spike_threshold_policy", "channel"),
+                                  cfg.get("spike_noise_estimator", "std"), stats)
+    indices, amplitudes = detect_multichannel(rec["signals"], thresholds, int(0.001 * cfg["fs"]), workers,
+                                              cfg.get("parallel_min_samples", 0))
+    return {"thresholds": thresholds, "indices": indices, "amplitudes": amplitudes}
+
+
+def _legacy_detect(signals, thresholds, distance):
+    out = []
+    for i in range(signals.shape[1]):
+        pos_idx, _ = find_peaks(signals[:, i], height=thresholds[i], distance=distance)
+        neg_idx, _ = find_peaks(-signals[:, i], height=thresholds[i], distance=distance)
+        out.append(np.sort(np.concatenate([pos_idx, neg_idx])))
+    return out
+
+
+def benchmark(n_channels=60, seconds=20, fs=30000, multiplier=4, repeats=3, seed=0):
+    rng = np.random.default_rng(seed)
+    signals = np.asfortranarray(rng.normal(0, 1e-5, (int(seconds * fs), n_channels)))
+    spikes = rng.random(signals.shape) < 20 / fs
+    signals[spikes] -= 8e-5
+
+    thresholds = spike_thresholds(signals, multiplier)
+    distance = int(0.001 * fs)
+    results = {}
+    for name, fn in (("legacy_find_peaks", lambda: _legacy_detect(signals, thresholds, distance)),
+                     ("engine", lambda: detect_multichannel(signals, thresholds, distance)[0])):
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            found = fn()
+            best = min(best, time.perf_counter() - start)
+        results[name] = {"seconds": best, "channel_samples_per_s": signals.size / best, "spikes": sum(map(len, found))}
+    return results
+
+
+if __name__ == "__main__":
+    for name, res in benchmark().items():
+        print(f"{name:>18}: {res['channel_samples_per_s'] / 1e6:8.1f} M channel-samples/s "
+              f"({res['seconds']:.3f} s, {res['spikes']} spikes)")
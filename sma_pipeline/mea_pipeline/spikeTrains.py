@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+# Sparse (CSR-style) spike trains: channel i owns indices[offsets[i]:offsets[i + 1]],
+# sorted sample indices into the recording, with matching times and amplitudes.
+
+
+def to_sparse(indices, amplitudes=None):
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(idx) for idx in indices])
+    flat = np.concatenate(indices).astype(np.int64) if len(indices) else np.empty(0, dtype=np.int64)
+    amps = None
+    if amplitudes is not None:
+        amps = np.concatenate(amplitudes).astype(np.float32) if len(amplitudes) else np.empty(0, dtype=np.float32)
+    return offsets, flat, amps
+
+
+def save_spike_train(path, channels, indices, timestamps, fs, amplitudes=None, thresholds=None):
+    offsets, flat, amps = to_sparse(indices, amplitudes)
+    arrays = {
+        "offsets": offsets,
+        "indices": flat,
+        "times": np.asarray(timestamps[flat], dtype=np.float64),
+        "channels": np.asarray(channels, dtype=str),
+        "n_samples": len(timestamps),
+        "fs": float(fs)
+    }
+    if amps is not None:
+        arrays["amplitudes"] = amps
+    if thresholds is not None:
+        arrays["thresholds"] = np.asarray(thresholds, dtype=np.float64)
+    np.savez(path, **arrays)
+    return path
+
+
+def load_spike_train(path):
+    with np.load(path) as data:
+        train = {key: data[key] for key in data.files}
+    train["channels"] = [str(ch) for ch in train["channels"]]
+    train["n_samples"] = int(train["n_samples"])
+    train["fs"] = float(train["fs"])
+    return train
+
+
+def channel_slice(train, i):
+    return slice(train["offsets"][i], train["offsets"][i + 1])
+
+
+def split_channels(train, key="indices"):
+    return [train[key][channel_slice(train, i)] for i in range(len(train["channels"]))]
+
+
+def as_spikes(train):
+    # Same shape as spikeEngine.detect_recording's result
+    spikes = {"indices": split_channels(train)}
+    if "amplitudes" in train:
+        spikes["amplitudes"] = split_channels(train, "amplitudes")
+    if "thresholds" in train:
+        spikes["thresholds"] = train["thresholds"]
+    return spikes
+
+
+def time_window(train, t_start, t_end):
+    # Per-channel spikes with t_start <= time < t_end; times are sorted within each channel
+    out = []
+    for i in range(len(train["channels"])):
+        sl = channel_slice(train, i)
+        times = train["times"][sl]
+        lo, hi = np.searchsorted(times, t_start, side="left"), np.searchsorted(times, t_end, side="left")
+        out.append(train["indices"][sl][lo:hi])
+    return out
+
+
+def dense_mask(train, start=0, stop=None):
+    # Rebuilds the old 0/1 (samples x channels) mask for rows [start, stop)
+    stop = train["n_samples"] if stop is None else stop
+    mask = np.zeros((stop - start, len(train["channels"])), dtype=np.int64)
+    for i in range(len(train["channels"])):
+        idx = train["indices"][channel_slice(train, i)]
+        idx = idx[np.searchsorted(idx, start):np.searchsorted(idx, stop)]
+        mask[idx - start, i] = 1
+    return mask
+
+
+def dense_mask_frame(train, timestamps, start=0, stop=None):
+    stop = len(timestamps) if stop is None else stop
+    df = pd.DataFrame(dense_mask(train, start, stop), columns=train["channels"])
+    df.insert(0, "timestamps", np.asarray(timestamps[start:stop]))
+    return df
+
+
+def spike_events_frame(train):
+    # One row per spike; the compact CSV export of a spike train
+    counts = np.diff(train["offsets"])
+    df = pd.DataFrame({
+        "channel": np.repeat(np.asarray(train["channels"], dtype=object), counts),
+        "sample_index": train["indices"],
+        "time": train["times"]
+    })
+    if "amplitudes" in train:
+        df["amplitude"] = train["amplitudes"]
+    return df
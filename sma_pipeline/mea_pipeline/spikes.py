@@ -1,71 +1,108 @@
 import os
+import logging
+from functools import partial
 import pandas as pd
 import numpy as np
-import yaml
-from scipy.signal import find_peaks
-from mea_pipeline.plotting import plot_spikes
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging, span, add_samples
+from mea_pipeline.parallel import resolve_workers, split_workers, map_files
+from mea_pipeline.plotting import spikes_job
+from mea_pipeline.plotQueue import submit_plot
+from mea_pipeline.signalStore import list_cleaned, load_cleaned, store_base
+from mea_pipeline.spikeEngine import detect_recording
+from mea_pipeline.spikeTrains import save_spike_train, dense_mask_frame, load_spike_train
 
-def load_config():
-    with open("config/config.yaml", "r") as f:
-        return yaml.safe_load(f)
+log = logging.getLogger(__name__)
 
-def detect_spikes():
-    cfg = load_config()
+def channel_spike_info(filename, ch, spike_indices, amplitudes, timestamps, duration):
+    isis = np.diff(timestamps[spike_indices])
 
-    input_dir = os.path.join(cfg["output_dir"], "cleaned")
+    return {
+        "file": filename,
+        "channel": ch,
+        "spike_count": len(spike_indices),
+        "firing_rate": len(spike_indices) / duration if duration > 0 else 0,
+        "isi_mean": np.mean(isis) if len(isis) > 0 else np.nan,
+        "isi_std": np.std(isis) if len(isis) > 0 else np.nan,
+        "isi_cv": np.std(isis)/np.mean(isis) if len(isis) > 1 and np.mean(isis) > 0 else np.nan,
+        "max_amplitude": np.max(amplitudes) if len(spike_indices) > 0 else np.nan,
+        "mean_amplitude": np.mean(amplitudes) if len(spike_indices) > 0 else np.nan
+    }
+
+def spike_output_dirs(cfg):
     mask_out_dir = os.path.join(cfg["output_dir"], "spike", "masks")
     info_out_dir = os.path.join(cfg["output_dir"], "spike", "info")
-    os.makedirs(mask_out_dir, exist_ok=True)
+    train_out_dir = os.path.join(cfg["output_dir"], "spike", "trains")
     os.makedirs(info_out_dir, exist_ok=True)
+    os.makedirs(train_out_dir, exist_ok=True)
+    return mask_out_dir, info_out_dir, train_out_dir
+
+def train_path(cfg, name):
+    return os.path.join(cfg["output_dir"], "spike", "trains", f"{name}_spikes.npz")
+
+def save_dense_mask(train_path, timestamps, mask_out_dir, name, chunk_size=300000):
+    # Optional export of the old dense 0/1 CSV, rebuilt from the sparse train a chunk at a time
+    os.makedirs(mask_out_dir, exist_ok=True)
+    train = load_spike_train(train_path)
+    out_path = os.path.join(mask_out_dir, f"{name}_spikes.csv")
+    for start in range(0, train["n_samples"], chunk_size):
+        stop = min(start + chunk_size, train["n_samples"])
+        dense_mask_frame(train, timestamps, start, stop).to_csv(out_path, mode="w" if start == 0 else "a",
+                                                                header=start == 0, index=False)
+    return out_path
+
+def detect_recording_spikes(rec, cfg, workers=1, stats=None):
+    with span("spikes", file=rec["name"]):
+        add_samples(rec["signals"].size)
+        return _detect_recording_spikes(rec, cfg, workers, stats)
+
+def _detect_recording_spikes(rec, cfg, workers=1, stats=None):
+    mask_out_dir, info_out_dir, _ = spike_output_dirs(cfg)
+
+    filename = rec["name"]
+
+    log.info("Detecting spikes in: %s", filename)
+    timestamps = rec["timestamps"]
+    duration = timestamps[-1] - timestamps[0]
+    with span("detect"):
+        spikes = detect_recording(rec, cfg, workers, stats)
+    channel_info = []
+
+    for i, ch in enumerate(rec["channels"]):
+        spike_indices = spikes["indices"][i]
+
+        channel_info.append(channel_spike_info(filename, ch, spike_indices, spikes["amplitudes"][i],
+                                               timestamps, duration))
+
+        if i < 3:
+            submit_plot(cfg, "spikes", spikes_job, timestamps, rec["signals"][:, i], spike_indices,
+                        spikes["thresholds"][i], f"{filename} – {ch}",
+                        os.path.join(info_out_dir, f"{filename}_{ch}_spikes.png"))
+
+    with span("save"):
+        out_train = save_spike_train(train_path(cfg, filename), rec["channels"], spikes["indices"], timestamps,
+                                     rec["fs"], spikes["amplitudes"], spikes["thresholds"])
+        if cfg.get("write_dense_spike_mask", False):
+            save_dense_mask(out_train, timestamps, mask_out_dir, filename)
+        pd.DataFrame(channel_info).to_csv(os.path.join(info_out_dir, f"{filename}_spikes_info.csv"), index=False)
+
+    log.info("Saved spike train and info for %s", filename)
+    return spikes
+
+def _detect_file(filepath, cfg, workers=1):
+    detect_recording_spikes(load_cleaned(filepath), cfg, workers)
+
+def detect_spikes(workers=None, cache=None, bases=None):
+    cfg = load_config()
+    setup_logging(cfg)
+    input_dir = os.path.join(cfg["output_dir"], "cleaned")
+    files = list_cleaned(input_dir, bases)
+    if cache is not None:
+        todo = cache.stale("spikes", {store_base(f): f for f in files})
+        files = [f for f, _ in todo.values()]
+
+    file_workers, channel_workers = split_workers(len(files), resolve_workers(cfg, workers))
+    map_files(partial(_detect_file, cfg=cfg, workers=channel_workers), files, file_workers)
 
-    thresh_mult = float(cfg["spike_threshold_multiplier"])
-
-    for filename in sorted(os.listdir(input_dir)):
-        if not filename.endswith(".csv"):
-            continue
-
-        print(f"Detecting spikes in: {filename}")
-        filepath = os.path.join(input_dir, filename)
-        df = pd.read_csv(filepath)
-        timestamps = df["timestamps"].values
-        duration = timestamps[-1] - timestamps[0]
-
-        spike_df = pd.DataFrame({"timestamps": timestamps})
-        channel_info = []
-
-        for ch in df.columns[1:]:
-            signal = df[ch].values
-            noise_std = np.std(signal)
-
-           
-            threshold = thresh_mult * noise_std
-            spike_idx_pos, _ = find_peaks(signal, height=threshold, distance=int(0.001 * cfg["fs"]))
-            spike_idx_neg, _ = find_peaks(-signal, height=threshold, distance=int(0.001 * cfg["fs"]))
-            spike_indices = np.sort(np.concatenate([spike_idx_pos, spike_idx_neg]))
-
-            spike_times = timestamps[spike_indices]
-            spike_df[ch] = 0
-            spike_df.loc[spike_indices, ch] = 1
-
-            isis = np.diff(spike_times)
-
-            channel_info.append({
-                "file": filename,
-                "channel": ch,
-                "spike_count": len(spike_indices),
-                "firing_rate": len(spike_indices) / duration if duration > 0 else 0,
-                "isi_mean": np.mean(isis) if len(isis) > 0 else np.nan,
-                "isi_std": np.std(isis) if len(isis) > 0 else np.nan,
-                "isi_cv": np.std(isis)/np.mean(isis) if len(isis) > 1 and np.mean(isis) > 0 else np.nan,
-                "max_amplitude": np.max(signal[spike_indices]) if len(spike_indices) > 0 else np.nan,
-                "mean_amplitude": np.mean(signal[spike_indices]) if len(spike_indices) > 0 else np.nan
-            })
-
-            if list(df.columns[1:]).index(ch) < 3:  
-                plot_spikes(timestamps, signal, spike_indices, threshold, f"{filename} – {ch}",
-                            os.path.join(info_out_dir, f"{filename.replace('.csv','')}_{ch}_spikes.png"))
-
-        spike_df.to_csv(os.path.join(mask_out_dir, filename.replace(".csv", "_spikes.csv")), index=False)
-        pd.DataFrame(channel_info).to_csv(os.path.join(info_out_dir, filename.replace(".csv", "_spikes_info.csv")), index=False)
-
-        print(f"Saved mask and info for {filename}")
+    if cache is not None:
+        cache.record_done("spikes", todo)
@@ -0,0 +1,233 @@
+import os
+import logging
+from functools import partial
+import numpy as np
+import pandas as pd
+from mea_pipeline.plotting import artifact_job, multi_channel_job, spikes_job
+from mea_pipeline.plotQueue import submit_plot
+from mea_pipeline.ingestion import iter_raw_chunks
+from mea_pipeline.instrumentation import span, add_samples
+from mea_pipeline.interpolation import fill_from_config
+from mea_pipeline.parallel import imap_files
+from mea_pipeline.preProcessing import raw_files
+from mea_pipeline.signalStore import create_cleaned, recording_base
+from mea_pipeline.spikes import channel_spike_info, spike_output_dirs, train_path, save_dense_mask
+from mea_pipeline.spikeTrains import save_spike_train
+from mea_pipeline.spikeEngine import detect_multichannel
+from mea_pipeline.noiseStats import (chunk_moments, merge_moments, pooled_moments, moments_std, block_stats,
+                                     merge_stats)
+from mea_pipeline.snr import save_snr_report, snr_table
+from mea_pipeline.network import network_params, add_network_features
+from mea_pipeline.waveforms import waveform_params, add_unit_features
+from mea_pipeline.features import channel_features, keep_feature_rows, save_project_summaries
+
+# Chunked processing for recordings that do not fit in memory. Every pass holds at
+# most one chunk (plus overlap) of samples; the cleaned signals live in the
+# memory-mapped store and are re-read chunk by chunk by the downstream stages.
+
+log = logging.getLogger(__name__)
+
+
+def _plot_slice(timestamps, cfg):
+    s, d = cfg["plot_start_time"], cfg["duration"]
+    return slice(np.searchsorted(timestamps, s, side="left"), np.searchsorted(timestamps, s + d, side="right"))
+
+
+def scan_artifact_stats(filepath, chunk_size, cfg=None):
+    # First pass: sample count and the max_signal mean/std behind the artifact z-score
+    n_samples, signal_cols, moments = 0, None, None
+    for _, x, signal_cols in iter_raw_chunks(filepath, chunk_size, cfg):
+        max_signal = np.abs(x).max(axis=1)[:, None]
+        moments = merge_moments(moments, chunk_moments(max_signal))
+        n_samples += len(x)
+
+    mean = float(moments[1][0])
+    std = float(moments_std(moments, ddof=1)[0])
+    return n_samples, signal_cols, mean, std
+
+
+def stream_clean(filepath, cfg):
+    chunk_size = int(cfg.get("chunk_size", 300000))
+    overlap = int(cfg.get("chunk_overlap", 3000))
+    if overlap < int(cfg.get("interpolation_context", 300)):
+        log.warning("chunk_overlap (%s) is below interpolation_context (%s); fills near chunk boundaries will "
+                    "differ from a whole-file run", overlap, cfg.get("interpolation_context", 300))
+
+    output_dir = os.path.join(cfg["output_dir"], "cleaned")
+    mask_dir = os.path.join(cfg["output_dir"], "artifact_masks")
+    plot_dir = os.path.join(cfg["output_dir"], "cleaned_plots")
+    for d in (output_dir, mask_dir):
+        os.makedirs(d, exist_ok=True)
+
+    filename = os.path.basename(filepath)
+    base = recording_base(filename)
+    log.info("Cleaning (streaming): %s", filename)
+
+    n_samples, signal_cols, mean, std = scan_artifact_stats(filepath, chunk_size, cfg)
+    threshold = mean + cfg["z_score_threshold"] * std
+
+    rec = create_cleaned(output_dir, base, n_samples, signal_cols, cfg["fs"])
+    stats = {"cleaned": None}
+
+    def flush(pos, x, tail, head):
+        # Fill with the neighbouring chunks as context; as long as chunk_overlap covers
+        # interpolation_context plus the artifact run, this matches the whole-file fill
+        window = np.concatenate([tail, x, head])
+        window = fill_from_config(window, np.isnan(window).any(axis=1), cfg)
+        cleaned = window[len(tail):len(tail) + len(x)]
+        rec["signals"][pos:pos + len(x)] = cleaned
+
+        stats["cleaned"] = merge_stats(stats["cleaned"], block_stats(cleaned, cfg["noise_threshold"]))
+
+    # Plots only cover the configured plot window so they stay bounded too
+    s, d = cfg["plot_start_time"], cfg["duration"]
+    plot_rows = []
+
+    pos, pending = 0, None
+    tail = np.empty((0, len(signal_cols)))
+    for ts, x, _ in iter_raw_chunks(filepath, chunk_size, cfg):
+        max_signal = np.abs(x).max(axis=1)
+        artifacts = max_signal > threshold
+        rec["timestamps"][pos:pos + len(x)] = ts
+        rec["artifact_mask"][pos:pos + len(x)] = artifacts
+
+        in_window = (ts >= s) & (ts <= s + d)
+        if in_window.any():
+            plot_rows.append(np.column_stack([ts[in_window], max_signal[in_window], artifacts[in_window]]))
+
+        x = x.astype(float, copy=True)
+        x[artifacts] = np.nan
+
+        if pending is not None:
+            flush(pending[0], pending[1], tail, x[:overlap])
+            # Plain [-overlap:] would keep the whole history when overlap is 0
+            tail = np.concatenate([tail, pending[1]])
+            tail = tail[max(len(tail) - overlap, 0):]
+        pending = (pos, x)
+        pos += len(x)
+
+    if pending is not None:
+        flush(pending[0], pending[1], tail, np.empty((0, len(signal_cols))))
+
+    artifact_count = int(np.count_nonzero(rec["artifact_mask"]))
+    log.info("  Artifacts detected: %s timepoints", artifact_count)
+    np.save(os.path.join(mask_dir, f"{base}_artifact_mask.npy"), rec["artifact_mask"])
+    rec["signals"].flush()
+    log.info("  Saved: %s", rec['path'])
+
+    plot_rows = np.concatenate(plot_rows) if plot_rows else np.empty((0, 3))
+    ts_window = pd.Series(plot_rows[:, 0])
+    submit_plot(cfg, "artifacts", artifact_job, ts_window, plot_rows[:, 1], plot_rows[:, 2].astype(bool), threshold,
+                os.path.join(plot_dir, f"{base}_artifact_debug.png"))
+
+    window = _plot_slice(rec["timestamps"], cfg)
+    n, c = cfg["downsample_factor"], cfg["channels_per_plot"]
+    signals_window = pd.DataFrame(np.asarray(rec["signals"][window][::n, :c]), columns=signal_cols[:c])
+    submit_plot(cfg, "cleaned", multi_channel_job, ts_window[::n].reset_index(drop=True), signals_window,
+                f"{base} - Cleaned", os.path.join(plot_dir, f"{base}_CLEANED_SAMPLE.png"))
+
+    return rec, stats["cleaned"]
+
+
+def stream_detect(rec, cfg, thresholds):
+    # Chunked run of the spike engine. Each chunk is searched with `pad` extra samples on
+    # both sides and only peaks inside the chunk are kept, so the height/distance
+    # decisions near a boundary see the same neighbourhood as a whole-file run.
+    chunk_size = int(cfg.get("chunk_size", 300000))
+    distance = int(0.001 * cfg["fs"])
+    pad = max(int(cfg.get("chunk_overlap", 3000)), 8 * distance)
+    n_samples, n_channels = rec["signals"].shape
+
+    found = [[] for _ in range(n_channels)]
+    amps = [[] for _ in range(n_channels)]
+    for a in range(0, n_samples, chunk_size):
+        b = min(a + chunk_size, n_samples)
+        lo, hi = max(a - pad, 0), min(b + pad, n_samples)
+        indices, amplitudes = detect_multichannel(np.asarray(rec["signals"][lo:hi]), thresholds, distance)
+        for i, (idx, amp) in enumerate(zip(indices, amplitudes)):
+            keep = (idx + lo >= a) & (idx + lo < b)
+            found[i].append(idx[keep] + lo)
+            amps[i].append(amp[keep])
+
+    return {"thresholds": thresholds,
+            "indices": [np.concatenate(ch) if ch else np.empty(0, dtype=np.intp) for ch in found],
+            "amplitudes": [np.concatenate(ch) if ch else np.empty(0) for ch in amps]}
+
+
+def stream_downstream(rec, stats, cfg):
+    mask_out_dir, info_out_dir, _ = spike_output_dirs(cfg)
+    filename = rec["name"]
+    log.info("Detecting spikes in (streaming): %s", filename)
+
+    # Thresholds come from the moments merged while cleaning; MAD would need a full-column median
+    if cfg.get("spike_noise_estimator", "std") != "std":
+        raise ValueError("Streaming mode only supports spike_noise_estimator: std")
+    moments = stats["moments"]
+    if cfg.get("spike_threshold_policy", "channel") == "global":
+        moments = tuple(np.full(len(rec["channels"]), m) for m in pooled_moments(moments))
+    thresholds = float(cfg["spike_threshold_multiplier"]) * moments_std(moments)
+    spikes = stream_detect(rec, cfg, thresholds)
+    spike_indices = spikes["indices"]
+
+    timestamps = rec["timestamps"]
+    out_train = save_spike_train(train_path(cfg, filename), rec["channels"], spike_indices, timestamps,
+                                 rec["fs"], spikes["amplitudes"], thresholds)
+    if cfg.get("write_dense_spike_mask", False):
+        save_dense_mask(out_train, timestamps, mask_out_dir, filename, int(cfg.get("chunk_size", 300000)))
+
+    duration = timestamps[-1] - timestamps[0]
+    window = _plot_slice(timestamps, cfg)
+    channel_info = []
+    for i, ch in enumerate(rec["channels"]):
+        channel_info.append(channel_spike_info(filename, ch, spike_indices[i], spikes["amplitudes"][i],
+                                               timestamps, duration))
+
+        if i < 3:
+            idx = spike_indices[i]
+            idx = idx[(idx >= window.start) & (idx < window.stop)] - window.start
+            submit_plot(cfg, "spikes", spikes_job, np.asarray(timestamps[window]), np.asarray(rec["signals"][window, i]),
+                        idx, thresholds[i], f"{filename} – {ch}", os.path.join(info_out_dir, f"{filename}_{ch}_spikes.png"))
+
+    pd.DataFrame(channel_info).to_csv(os.path.join(info_out_dir, f"{filename}_spikes_info.csv"), index=False)
+    log.info("Saved spike train and info for %s", filename)
+
+    # MAD sigma would need a full-column median, so it stays empty in streaming mode
+    save_snr_report(snr_table(rec["channels"], stats, cfg.get("max_valid_snr")), filename, cfg)
+
+    fs = cfg["fs"]
+    ts_sec = timestamps if timestamps[1] - timestamps[0] < 1 else timestamps / fs
+    duration_sec = ts_sec[-1] - ts_sec[0]
+    features = []
+    for col, idx in zip(rec["channels"], spike_indices):
+        row = channel_features(filename, col, np.asarray(ts_sec[idx]), duration_sec,
+                               cfg.get("burst_isi", 0.1), cfg.get("burst_min_spikes", 2), cfg.get("groups"))
+        if row is not None:
+            features.append(row)
+    features = add_unit_features(features, filename, rec["signals"], list(rec["channels"]), spike_indices, ts_sec,
+                                 waveform_params(cfg))
+    spike_times = [np.asarray(ts_sec[idx]) for idx in spike_indices]
+    return add_network_features(features, filename, list(rec["channels"]), spike_times, ts_sec[0], ts_sec[-1],
+                                network_params(cfg))
+
+
+def _stream_file(filepath, cfg):
+    with span("file", file=os.path.basename(filepath)):
+        with span("clean"):
+            rec, stats = stream_clean(filepath, cfg)
+            add_samples(rec["signals"].size)
+        with span("downstream"):
+            return stream_downstream(rec, stats, cfg)
+
+
+def run_streaming(cfg, workers=1, cache=None, files=None, store=None):
+    # Each worker streams its own file, so peak memory is bounded by workers x chunk size.
+    # With a cache, recordings are skipped or rerun whole: the chunked passes share state.
+    files = raw_files(cfg, files)
+
+    todo = cache.stale_files(files)[0] if cache is not None else dict.fromkeys(files)
+    computed = imap_files(partial(_stream_file, cfg=cfg), list(todo), workers)
+
+    rows_by_base = keep_feature_rows(cfg, [recording_base(f) for f in files],
+                                     zip([recording_base(f) for f in todo], computed), store, cache,
+                                     {recording_base(f): keys for f, keys in todo.items()})
+    save_project_summaries(cfg, rows_by_base)
@@ -0,0 +1,125 @@
+import os
+import logging
+import itertools
+from functools import partial
+import numpy as np
+import pandas as pd
+from mea_pipeline.config import load_config
+from mea_pipeline.features import channel_features
+from mea_pipeline.ingestion import load_raw
+from mea_pipeline.instrumentation import setup_logging, start_run, finish_run, span, add_samples
+from mea_pipeline.interpolation import fill_from_config
+from mea_pipeline.noiseStats import noise_stats
+from mea_pipeline.parallel import resolve_workers, split_workers, map_files
+from mea_pipeline.preProcessing import artifact_threshold, raw_files
+from mea_pipeline.signalStore import recording_base
+from mea_pipeline.spikeEngine import noise_levels, detect_multichannel
+
+# Parameter sweep over z_score_threshold x spike_threshold_multiplier x burst_isi
+# (sweep_* config lists; null = the single configured value). Each raw recording is
+# read once and cleaned once per z-score. Peaks are found once at the lowest
+# multiplier's thresholds. Raising the threshold keeps exactly the peaks at or above it:
+# the distance selection only lets a peak be suppressed by a higher one, which passes
+# the higher threshold too. Higher multipliers therefore filter the candidates by
+# |amplitude|. Trains that filtering leaves unchanged reuse their burst features. No
+# plots or intermediate stores are written. Output: output/sweep/sweep_features.csv,
+# one feature row per channel and combination, and sweep_summary.csv with per-group
+# means.
+
+log = logging.getLogger(__name__)
+
+PARAMETERS = ("z_score_threshold", "spike_threshold_multiplier", "burst_isi")
+
+
+def sweep_grid(cfg):
+    # {parameter: sorted values}
+    grid = {}
+    for name in PARAMETERS:
+        values = cfg.get(f"sweep_{name}")
+        if values is None:
+            values = [cfg.get(name, 0.1 if name == "burst_isi" else None)]
+        grid[name] = sorted(float(v) for v in np.atleast_1d(values))
+    return grid
+
+
+def _sweep_recording(filepath, cfg, grid, workers=1):
+    name = f"{recording_base(filepath)}_cleaned"
+    fs = cfg["fs"]
+    distance = int(0.001 * fs)
+    policy, estimator = cfg.get("spike_threshold_policy", "channel"), cfg.get("spike_noise_estimator", "std")
+    rows = []
+    with span("sweep", file=os.path.basename(filepath)):
+        raw = load_raw(filepath, cfg)
+        channels = raw["channels"]
+        signals = np.array(raw["signals"])
+        timestamps = np.array(raw["timestamps"])
+        add_samples(signals.size)
+        ts_sec = timestamps if timestamps[1] - timestamps[0] < 1 else timestamps / fs
+        duration = ts_sec[-1] - ts_sec[0]
+        max_signal = pd.DataFrame(signals).abs().max(axis=1)
+
+        for z in grid["z_score_threshold"]:
+            artifact_mask = (max_signal > artifact_threshold(max_signal, z)).values
+            with span("interpolate", z_score_threshold=z):
+                cleaned = fill_from_config(signals, artifact_mask, cfg)
+            noise = noise_levels(cleaned, policy, estimator,
+                                 noise_stats(cleaned, robust=estimator == "mad"))
+
+            multipliers = grid["spike_threshold_multiplier"]
+            with span("find_peaks", z_score_threshold=z):
+                indices, amplitudes = detect_multichannel(cleaned, float(multipliers[0]) * noise, distance, workers,
+                                                          cfg.get("parallel_min_samples", 0))
+
+            for c, (col, idx, amp) in enumerate(zip(channels, indices, amplitudes)):
+                magnitude = np.abs(amp)
+                reuse = {}
+                for mult in multipliers:
+                    # Same expression as spike_thresholds, so the cut matches a run at `mult`
+                    keep = idx[magnitude >= (float(mult) * noise)[c]]
+                    for burst_isi in grid["burst_isi"]:
+                        key = (len(keep), burst_isi)
+                        if key not in reuse:
+                            reuse[key] = channel_features(name, col, ts_sec[keep], duration, burst_isi,
+                                                          cfg.get("burst_min_spikes", 2), cfg.get("groups"))
+                        if reuse[key] is not None:
+                            rows.append({"z_score_threshold": z, "spike_threshold_multiplier": mult,
+                                         "burst_isi": burst_isi, **reuse[key]})
+            log.info("  %s: z-score %g swept over %s multiplier(s) x %s burst ISI(s)", name, z, len(multipliers),
+                     len(grid["burst_isi"]))
+    return rows
+
+
+def sweep_summary(table):
+    # Per combination and group: channel count and the mean of every numeric feature
+    keys = list(PARAMETERS) + ["group"]
+    features = [c for c in table.select_dtypes("number").columns if c not in keys]
+    summary = table.groupby(keys, sort=True)[features].mean()
+    summary.insert(0, "channels", table.groupby(keys, sort=True).size())
+    return summary.reset_index()
+
+
+def run_sweep(workers=None, files=None):
+    cfg = load_config()
+    setup_logging(cfg)
+    workers = resolve_workers(cfg, workers)
+    files = raw_files(cfg, files)
+    grid = sweep_grid(cfg)
+    n_combinations = int(np.prod([len(v) for v in grid.values()]))
+    log.info("Sweeping %s parameter combination(s) over %s recording(s)", n_combinations, len(files))
+
+    start_run(cfg)
+    with span("run_sweep"):
+        file_workers, channel_workers = split_workers(len(files), workers)
+        results = map_files(partial(_sweep_recording, cfg=cfg, grid=grid, workers=channel_workers), files,
+                            file_workers)
+
+    out_dir = os.path.join(cfg["output_dir"], "sweep")
+    os.makedirs(out_dir, exist_ok=True)
+    table = pd.DataFrame(list(itertools.chain.from_iterable(results)))
+    out_path = os.path.join(out_dir, "sweep_features.csv")
+    table.to_csv(out_path, index=False)
+    log.info("Sweep features saved to %s", out_path)
+    if len(table):
+        sweep_summary(table).to_csv(os.path.join(out_dir, "sweep_summary.csv"), index=False)
+    finish_run(cfg, mode="sweep", workers=workers, files=files, grid=grid)
+    return table
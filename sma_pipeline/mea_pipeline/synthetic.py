@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic raw recordings in the format clean_signals reads: a timestamps column in
+# seconds plus one `*_values` column per channel. Gaussian noise, biphasic spikes
+# (Poisson singles plus bursts) and large common-mode artifacts are injected, and the
+# ground truth is saved next to the CSV as {base}_truth.npz.
+
+GROUP_LETTERS = "ABCD"
+
+
+def channel_names(n_channels):
+    # With the default groups mapping A/B channels fall in the SMA group, C/D in Healthy
+    return [f"highpass_{GROUP_LETTERS[i % 4]}{i + 1}_values" for i in range(n_channels)]
+
+
+def spike_waveform(fs, amplitude):
+    # Negative trough followed by a smaller, slower positive rebound, ~1.5 ms long
+    t = np.arange(int(0.0015 * fs)) / fs
+    wave = -np.exp(-((t - 0.0003) / 0.00012) ** 2) + 0.35 * np.exp(-((t - 0.0008) / 0.00025) ** 2)
+    return amplitude * wave / np.abs(wave).max()
+
+
+def _spike_times(rng, duration, spike_rate, burst_rate, burst_spikes, burst_isi):
+    singles = rng.uniform(0, duration, rng.poisson(spike_rate * duration))
+    bursts = []
+    for start in rng.uniform(0, duration, rng.poisson(burst_rate * duration)):
+        times = start + np.cumsum(np.r_[0, rng.uniform(0.5, 1.0, burst_spikes - 1) * burst_isi])
+        bursts.append(times[times < duration])
+    return np.sort(np.concatenate([singles] + bursts)), len(bursts)
+
+
+def _refractory(samples, gap):
+    # Drop spikes closer than `gap` samples to the previous kept one
+    keep = []
+    for s in samples:
+        if not keep or s - keep[-1] >= gap:
+            keep.append(s)
+    return np.array(keep, dtype=np.int64)
+
+
+def generate_recording(path, n_channels=16, fs=30000, duration=10.0, noise_std=1e-5, spike_rate=5.0,
+                       spike_amplitude=8e-5, burst_rate=0.2, burst_spikes=5, burst_isi=0.01, n_artifacts=3,
+                       artifact_amplitude=5e-3, artifact_duration=0.005, seed=0):
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * fs)
+    signals = rng.normal(0, noise_std, (n_samples, n_channels))
+
+    wave = spike_waveform(fs, spike_amplitude)
+    trough = int(np.argmax(-wave))
+    spikes, n_bursts = [], []
+    for ch in range(n_channels):
+        times, bursts = _spike_times(rng, duration, spike_rate, burst_rate, burst_spikes, burst_isi)
+        samples = _refractory((times * fs).astype(np.int64), int(0.002 * fs))
+        samples = samples[samples + len(wave) < n_samples]
+        for s in samples:
+            signals[s:s + len(wave), ch] += wave
+        spikes.append(samples + trough)
+        n_bursts.append(bursts)
+
+    artifact_mask = np.zeros(n_samples, dtype=bool)
+    length = max(int(artifact_duration * fs), 1)
+    for start in rng.integers(0, max(n_samples - length, 1), n_artifacts):
+        signals[start:start + length] += artifact_amplitude * rng.choice([-1, 1])
+        artifact_mask[start:start + length] = True
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df = pd.DataFrame(signals, columns=channel_names(n_channels))
+    df.insert(0, "timestamps", np.arange(n_samples) / fs)
+    df.to_csv(path, index=False)
+
+    truth = {
+        "channels": np.array(channel_names(n_channels)),
+        "fs": float(fs),
+        "spike_counts": np.array([len(s) for s in spikes]),
+        "spike_samples": np.concatenate(spikes) if spikes else np.empty(0, dtype=np.int64),
+        "burst_counts": np.array(n_bursts),
+        "artifact_mask": artifact_mask
+    }
+    np.savez_compressed(truth_path(path), **truth)
+    return truth
+
+
+def truth_path(csv_path):
+    return os.path.splitext(csv_path)[0] + "_truth.npz"
+
+
+def load_truth(csv_path):
+    with np.load(truth_path(csv_path)) as z:
+        truth = {k: z[k] for k in z.files}
+    offsets = np.r_[0, np.cumsum(truth["spike_counts"])]
+    truth["spikes"] = [truth["spike_samples"][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+    return truth
+
+
+def generate_dataset(out_dir, n_files=2, seed=0, **kwargs):
+    # Truth files live beside the CSVs; raw_files skips them (see ingestion.is_raw)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(out_dir, f"synthetic_{i:03d}.csv")
+        generate_recording(path, seed=seed + i, **kwargs)
+        paths.append(path)
+    return paths
+
+
+def match_spikes(detected, truth, tolerance):
+    # Greedy one-to-one matching within `tolerance` samples -> (hits, misses, false positives)
+    detected, truth = np.sort(np.asarray(detected)), np.sort(np.asarray(truth))
+    if len(detected) == 0 or len(truth) == 0:
+        return 0, len(truth), len(detected)
+    pos = np.searchsorted(detected, truth)
+    used = np.zeros(len(detected), dtype=bool)
+    hits = 0
+    for t, p in zip(truth, pos):
+        for j in (p - 1, p):
+            if 0 <= j < len(detected) and not used[j] and abs(detected[j] - t) <= tolerance:
+                used[j] = True
+                hits += 1
+                break
+    return hits, len(truth) - hits, len(detected) - hits
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic raw MEA recordings with ground truth")
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=16)
+    parser.add_argument("--fs", type=float, default=30000)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per recording")
+    parser.add_argument("--noise", type=float, default=1e-5, help="noise standard deviation")
+    parser.add_argument("--spike-rate", type=float, default=5.0, help="single spikes per second per channel")
+    parser.add_argument("--burst-rate", type=float, default=0.2, help="bursts per second per channel")
+    parser.add_argument("--artifacts", type=int, default=3, help="artifacts per recording")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for p in generate_dataset(args.out_dir, args.files, args.seed, n_channels=args.channels, fs=args.fs,
+                              duration=args.duration, noise_std=args.noise, spike_rate=args.spike_rate,
+                              burst_rate=args.burst_rate, n_artifacts=args.artifacts):
+        print(f"Wrote {p}")
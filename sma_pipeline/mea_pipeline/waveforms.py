@@ -0,0 +1,230 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from mea_pipeline.groupStats import assign_group
+from mea_pipeline.parallel import map_channels
+from mea_pipeline.preProcessing import recording_names
+
+# Spike waveforms and single-electrode unit separation. Windows of waveform_pre +
+# waveform_post ms around every detected peak are gathered from a sliding-window view
+# of the channel, so no per-spike slices are made, and are kept as float32. Per block of
+# channels, the covariances of all channels go through one batched eigh (PCA). Each
+# channel is then clustered with k-means on its first waveform_pcs scores, with k from 1
+# to waveform_max_units picked by BIC. The fit uses at most FIT_SPIKES spikes and every
+# spike is then assigned to its nearest center. Units below waveform_min_unit_spikes
+# are labelled -1. Outputs: output/spike/waveforms/{name}_waveforms.npz (CSR like the
+# spike trains) and {name}_units.csv with per-unit firing rates and ISI statistics.
+# Each channel's feature row gets n_units and the UNIT_AGGREGATES of its units.
+
+log = logging.getLogger(__name__)
+
+GATHER_BLOCK = 65536
+
+# k-means is fitted on at most this many spikes of a channel; the rest are assigned
+FIT_SPIKES = 10000
+
+UNIT_COLUMNS = ["file", "channel", "unit", "spike_count", "firing_rate", "isi_mean", "isi_cv",
+                "pct_refractory_violations", "amplitude_mean", "group"]
+
+# feature column -> (units.csv column, aggregation over the channel's units)
+UNIT_AGGREGATES = {
+    "unit_firing_rate_mean": ("firing_rate", "mean"),
+    "unit_firing_rate_max": ("firing_rate", "max"),
+    "unit_isi_cv_mean": ("isi_cv", "mean"),
+    "unit_pct_refractory_violations_max": ("pct_refractory_violations", "max")
+}
+
+
+def waveform_params(cfg):
+    # None when waveform sorting is switched off
+    if not cfg.get("waveforms", True):
+        return None
+    fs = cfg["fs"]
+    return {
+        "pre": int(round(float(cfg.get("waveform_pre", 0.5)) * fs / 1000)),
+        "post": int(round(float(cfg.get("waveform_post", 1.0)) * fs / 1000)),
+        "n_pcs": int(cfg.get("waveform_pcs", 3)),
+        "max_units": int(cfg.get("waveform_max_units", 3)),
+        "min_unit_spikes": int(cfg.get("waveform_min_unit_spikes", 20)),
+        "refractory": float(cfg.get("waveform_refractory", 0.002)),
+        "seed": int(cfg.get("waveform_seed", 0)),
+        "fs": fs,
+        "groups": cfg.get("groups"),
+        "output_dir": os.path.join(cfg["output_dir"], "spike", "waveforms")
+    }
+
+
+def cut_waveforms(signal, indices, pre, post):
+    # -> (float32 (spikes x pre + post) waveforms, mask of the spikes far enough from the edges)
+    indices = np.asarray(indices, dtype=np.int64)
+    ok = (indices >= pre) & (indices + post <= len(signal))
+    starts = indices[ok] - pre
+    windows = sliding_window_view(signal, pre + post)
+    out = np.empty((len(starts), pre + post), dtype=np.float32)
+    for a in range(0, len(starts), GATHER_BLOCK):
+        out[a:a + GATHER_BLOCK] = windows[starts[a:a + GATHER_BLOCK]]
+    return out, ok
+
+
+def batched_pca(waves, n_pcs):
+    # One eigh over the stacked covariances of every channel -> per-channel scores
+    width = waves[0].shape[1]
+    means = np.stack([w.mean(axis=0) if len(w) else np.zeros(width, dtype=np.float32) for w in waves])
+    covs = np.stack([(w - m).T @ (w - m) / max(len(w) - 1, 1) for w, m in zip(waves, means)])
+    _, vectors = np.linalg.eigh(covs.astype(np.float64))
+    components = vectors[:, :, ::-1][:, :, :n_pcs].astype(np.float32)
+    return [(w - m) @ c for w, m, c in zip(waves, means, components)]
+
+
+def _distances(x, centers):
+    # Squared distances from a matrix product: |x|^2 - 2 x.c + |c|^2
+    d = (x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)
+    return np.maximum(d, 0.0)
+
+
+def kmeans(x, k, rng, iterations=50):
+    # k-means++ seeding then Lloyd iterations -> (centers, labels, sum of squared distances)
+    centers = x[[rng.integers(len(x))]]
+    for _ in range(1, k):
+        d = _distances(x, centers).min(axis=1)
+        if d.sum() == 0:
+            break
+        centers = np.vstack([centers, x[rng.choice(len(x), p=d / d.sum())]])
+    labels = np.zeros(len(x), dtype=np.int64)
+    for it in range(iterations):
+        d = _distances(x, centers)
+        new = d.argmin(axis=1)
+        if it and np.array_equal(new, labels):
+            break
+        labels = new
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.stack([np.bincount(labels, weights=x[:, j], minlength=len(centers)) for j in range(x.shape[1])], 1)
+        centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+    return centers, labels, float(d[np.arange(len(x)), labels].sum())
+
+
+def cluster_units(scores, max_units, min_spikes, rng):
+    # k by BIC of a spherical Gaussian mixture; units numbered by size, small ones -> -1
+    n, dims = scores.shape
+    labels = np.zeros(n, dtype=np.int64)
+    if n >= 2 * min_spikes and dims:
+        x = scores.astype(np.float64)
+        fit = x[np.sort(rng.choice(n, FIT_SPIKES, replace=False))] if n > FIT_SPIKES else x
+        m, best = len(fit), None
+        for k in range(1, max_units + 1):
+            if n < k * min_spikes:
+                break
+            centers, _, sse = kmeans(fit, k, rng)
+            bic = m * dims * np.log(max(sse, 1e-300) / (m * dims)) + k * dims * np.log(m)
+            if best is None or bic < best[0]:
+                best = (bic, centers)
+        labels = _distances(x, best[1]).argmin(axis=1)
+    counts = np.bincount(labels) if n else np.empty(0, dtype=np.int64)
+    order = [u for u in np.argsort(-counts, kind="stable") if counts[u] >= min_spikes]
+    remap = np.full(max(len(counts), 1), -1, dtype=np.int16)
+    remap[order] = np.arange(len(order))
+    return remap[labels] if n else np.empty(0, dtype=np.int16)
+
+
+def _sort_block(signals, channels, indices, params):
+    waves, masks = [], []
+    for ch in channels:
+        w, ok = cut_waveforms(signals[:, ch], indices[ch], params["pre"], params["post"])
+        waves.append(w)
+        masks.append(ok)
+    scores = batched_pca(waves, params["n_pcs"])
+    out = []
+    for ch, w, ok, s in zip(channels, waves, masks, scores):
+        rng = np.random.default_rng([params["seed"], ch])
+        out.append((w, ok, cluster_units(s, params["max_units"], params["min_unit_spikes"], rng), s))
+    return out
+
+
+def sort_recording(signals, indices, params, workers=1, min_samples=0):
+    # -> per channel (waveforms, kept-spike mask, unit labels, PCA scores)
+    return map_channels(_sort_block, signals, workers, list(indices), params, min_samples=min_samples)
+
+
+def unit_rows(name, channels, indices, sorted_channels, ts_sec, duration, params):
+    rows = []
+    for ch, idx, (w, ok, labels, _) in zip(channels, indices, sorted_channels):
+        times = np.asarray(ts_sec[np.asarray(idx)[ok]])
+        for unit in range(int(labels.max()) + 1 if len(labels) else 0):
+            t = times[labels == unit]
+            isi = np.diff(t)
+            rows.append({
+                "file": name,
+                "channel": ch,
+                "unit": unit,
+                "spike_count": len(t),
+                "firing_rate": len(t) / duration if duration > 0 else np.nan,
+                "isi_mean": isi.mean() if len(isi) else np.nan,
+                "isi_cv": isi.std() / isi.mean() if len(isi) > 1 and isi.mean() > 0 else np.nan,
+                "pct_refractory_violations": 100.0 * np.mean(isi < params["refractory"]) if len(isi) else np.nan,
+                "amplitude_mean": float(w[labels == unit, params["pre"]].mean()),
+                "group": assign_group(name, ch, params["groups"])
+            })
+    return rows
+
+
+def save_waveforms(path, channels, indices, sorted_channels, params):
+    kept = [np.asarray(idx)[ok] for idx, (_, ok, _, _) in zip(indices, sorted_channels)]
+    offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(k) for k in kept])
+    width, n_pcs = params["pre"] + params["post"], params["n_pcs"]
+    join = lambda parts, shape, dtype: np.concatenate(parts).astype(dtype) if parts else np.empty(shape, dtype)
+    np.savez(path,
+             offsets=offsets,
+             indices=join(kept, 0, np.int64),
+             waveforms=join([w for w, _, _, _ in sorted_channels], (0, width), np.float32),
+             units=join([u for _, _, u, _ in sorted_channels], 0, np.int16),
+             scores=join([s for _, _, _, s in sorted_channels], (0, n_pcs), np.float32),
+             channels=np.asarray(channels, dtype=str), pre=params["pre"], post=params["post"], fs=float(params["fs"]))
+    return path
+
+
+def units_path(params, name):
+    return os.path.join(params["output_dir"], f"{name}_units.csv")
+
+
+def add_unit_features(rows, name, signals, channels, indices, ts_sec, params, workers=1, min_samples=0):
+    # Sorts every channel, writes the waveform and unit files and adds n_units and the
+    # per-channel unit aggregates to the rows (NaN on channels without units)
+    if params is None:
+        return rows
+    os.makedirs(params["output_dir"], exist_ok=True)
+    sorted_channels = sort_recording(signals, indices, params, workers, min_samples)
+    save_waveforms(os.path.join(params["output_dir"], f"{name}_waveforms.npz"), channels, indices, sorted_channels,
+                   params)
+    units = unit_rows(name, channels, indices, sorted_channels, ts_sec, ts_sec[-1] - ts_sec[0], params)
+    table = pd.DataFrame(units, columns=UNIT_COLUMNS)
+    table.to_csv(units_path(params, name), index=False)
+    n_units = {ch: int(labels.max()) + 1 if len(labels) else 0 for ch, (_, _, labels, _) in zip(channels, sorted_channels)}
+    aggregates = table.groupby("channel").agg(**UNIT_AGGREGATES).to_dict("index")
+    for row in rows:
+        row["n_units"] = n_units.get(row["channel"], 0)
+        channel = aggregates.get(row["channel"], {})
+        for feature in UNIT_AGGREGATES:
+            row[feature] = float(channel.get(feature, np.nan))
+    log.info("  Waveforms: %s units on %s channels of %s", len(units), len(channels), name)
+    return rows
+
+
+def save_unit_summary(cfg, names):
+    # output/features/units_summary.csv: one row per unit of the given recordings and of every
+    # other recording in input_dir with a units table
+    params = waveform_params(cfg)
+    if params is None:
+        return None
+    names = recording_names(cfg, names)
+    tables = [pd.read_csv(units_path(params, name)) for name in names if os.path.exists(units_path(params, name))]
+    if not tables:
+        return None
+    summary = pd.concat(tables, ignore_index=True)
+    out_path = os.path.join(cfg["output_dir"], "features", "units_summary.csv")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    summary.to_csv(out_path, index=False)
+    log.info("Saved unit summary: %s", out_path)
+    return summary
@@ -0,0 +1,37 @@
+import argparse
+from mea_pipeline.config import load_config
+from mea_pipeline.instrumentation import setup_logging
+from mea_pipeline.online import run_online, replay_source, tail_source, socket_source, serve_replay
+from mea_pipeline.signalStore import recording_base
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online spike detection on a live or replayed stream")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", metavar="FILE", help="replay a raw recording")
+    source.add_argument("--tail", metavar="CSV", help="follow a CSV that is still being written")
+    source.add_argument("--socket", metavar="HOST:PORT", help="read CSV text from a local TCP sender")
+    source.add_argument("--serve", metavar="FILE", help="send a raw recording to one --socket client and exit")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="replay speed as a multiple of real time (0 = as fast as possible)")
+    parser.add_argument("--block-size", type=int, default=None, help="samples per block")
+    parser.add_argument("--port", type=int, default=5555, help="port for --serve")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this much signal")
+    parser.add_argument("--name", default=None, help="output name (default: from the source)")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    setup_logging(cfg)
+    block_size = args.block_size or int(cfg.get("online_block_size", 300))
+    speed = args.speed if args.speed is not None else float(cfg.get("online_speed", 1.0))
+
+    if args.serve:
+        serve_replay(args.serve, cfg, args.port, block_size, speed)
+    else:
+        if args.replay:
+            stream, name = replay_source(args.replay, cfg, block_size, speed), recording_base(args.replay)
+        elif args.tail:
+            stream = tail_source(args.tail, block_size, idle_timeout=float(cfg.get("online_idle_timeout", 5.0)))
+            name = recording_base(args.tail)
+        else:
+            stream, name = socket_source(args.socket, block_size), "socket_" + args.socket.replace(":", "_")
+        run_online(stream, cfg, args.name or name, args.seconds)
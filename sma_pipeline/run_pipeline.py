@@ -1,4 +1,30 @@
-from mea_pipeline.pipeline import run_pipeline
+import argparse
+from mea_pipeline.pipeline import run_pipeline, progress_writer
+from mea_pipeline.sweep import run_sweep
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description="Run the MEA spike analysis pipeline")
+    parser.add_argument("--fused", action="store_true", default=None,
+                        help="load each recording once and run every stage on it in memory")
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="process recordings in fixed-size chunks with bounded memory")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for files and channels (0 = all cores, default from config.yaml)")
+    parser.add_argument("--sweep", action="store_true",
+                        help="run the sweep_* parameter grid into output/sweep instead of the pipeline")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the run cache and recompute every stage for every recording")
+    parser.add_argument("--profile", default=None, metavar="STAGE",
+                        help="profile one stage (e.g. clean_signals) into output/reports")
+    parser.add_argument("--files", nargs="+", default=None, metavar="CSV",
+                        help="process only these raw recordings (paths or names in input_dir)")
+    parser.add_argument("--progress-file", default=None, metavar="JSON",
+                        help="keep the current stage ({stage, index, total}) in this file while running")
+    args = parser.parse_args()
+
+    if args.sweep:
+        run_sweep(workers=args.workers, files=args.files)
+    else:
+        run_pipeline(fused=args.fused, streaming=args.streaming, workers=args.workers, force=args.force,
+                     profile=args.profile, files=args.files,
+                     progress=progress_writer(args.progress_file) if args.progress_file else None)
@@ -0,0 +1,30 @@
+import os
+import numpy as np
+from mea_pipeline.ingestion import load_raw
+
+
+def _write_csv(path, value, encoding="utf-8"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding=encoding) as f:
+        f.write("timestamp,A1_values,other\n")
+        for i in range(5):
+            f.write(f"{i / 30000},{value},{i}\n")
+
+
+def test_csv_with_bom(tmp_path):
+    path = str(tmp_path / "raw" / "rec.csv")
+    _write_csv(path, 1.5, encoding="utf-8-sig")
+    rec = load_raw(path, {"raw_cache": False})
+    assert rec["channels"] == ["A1_values"]
+    assert np.allclose(rec["signals"], 1.5)
+
+
+def test_cache_keeps_same_name_in_different_dirs(tmp_path):
+    cfg = {"output_dir": str(tmp_path / "out")}
+    paths = [str(tmp_path / d / "rec.csv") for d in ("a", "b")]
+    for value, path in enumerate(paths):
+        _write_csv(path, value)
+        load_raw(path, cfg)
+    assert len(os.listdir(tmp_path / "out" / ".raw_cache")) == 2
+    for value, path in enumerate(paths):
+        assert np.allclose(load_raw(path, cfg)["signals"], value)
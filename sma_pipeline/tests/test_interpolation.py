@@ -0,0 +1,36 @@
+import pytest
+import numpy as np
+from mea_pipeline.interpolation import compare_with_pandas, fill_artifacts
+
+
+def test_fill_matches_pandas_spline_within_noise():
+    result = compare_with_pandas(n_channels=4, seconds=1, n_artifacts=10)
+    assert result["clean_samples_unchanged"]
+    assert result["max_diff_in_noise_std"] < 1.0
+
+
+def test_clean_samples_unchanged():
+    rng = np.random.default_rng(1)
+    signals = rng.normal(0, 1.0, (2000, 3))
+    artifact_mask = np.zeros(len(signals), dtype=bool)
+    artifact_mask[[0, 1, 500, 501, 502, 1999]] = True
+    for method in ("spline", "linear", "zero"):
+        filled = fill_artifacts(signals, artifact_mask, method, context=50)
+        assert np.array_equal(filled[~artifact_mask], signals[~artifact_mask])
+        assert np.isfinite(filled).all()
+
+
+def test_runs_without_clean_context_are_zeroed():
+    signals = np.full((100, 2), 5.0)
+    signals[40:60] = np.nan
+    artifact_mask = np.ones(len(signals), dtype=bool)
+    for method in ("spline", "linear"):
+        assert np.array_equal(fill_artifacts(signals, artifact_mask, method), np.zeros_like(signals))
+
+
+def test_context_below_one_is_rejected():
+    artifact_mask = np.zeros(10, dtype=bool)
+    artifact_mask[5] = True
+    with pytest.raises(ValueError):
+        fill_artifacts(np.ones((10, 1)), artifact_mask, "spline", context=0)
+    assert fill_artifacts(np.ones((10, 1)), artifact_mask, "zero", context=0)[5, 0] == 0.0
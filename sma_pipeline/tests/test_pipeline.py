@@ -0,0 +1,42 @@
+import os
+import yaml
+import pytest
+from mea_pipeline import pipeline
+from mea_pipeline.synthetic import generate_dataset
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "config.yaml")
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    # Two short synthetic recordings and a config that skips plots and the slower analyses
+    generate_dataset(str(tmp_path / "Data" / "raw"), 2, n_channels=4, duration=1.0)
+    with open(CONFIG) as f:
+        cfg = yaml.safe_load(f)
+    cfg.update(input_dir="Data/raw", output_dir="output", plots=False, waveforms=False, network=False, workers=1)
+    os.makedirs(tmp_path / "config")
+    with open(tmp_path / "config" / "config.yaml", "w") as f:
+        yaml.safe_dump(cfg, f)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_finished_recordings_survive_a_failed_run(project, monkeypatch):
+    fused_stages = pipeline._fused_stages
+    calls, failing = [], {"synthetic_001.csv"}
+
+    def stages(filepath, *args):
+        calls.append(os.path.basename(filepath))
+        if os.path.basename(filepath) in failing:
+            raise RuntimeError("recording failed")
+        return fused_stages(filepath, *args)
+
+    monkeypatch.setattr(pipeline, "_fused_stages", stages)
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(fused=True)
+    assert calls == ["synthetic_000.csv", "synthetic_001.csv"]
+
+    calls.clear()
+    failing.clear()
+    pipeline.run_pipeline(fused=True)
+    assert calls == ["synthetic_001.csv"]
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from mea_pipeline import spikeEngine
+from mea_pipeline.spikeEngine import detect_multichannel, spike_thresholds, _legacy_detect
+
+
+@pytest.fixture
+def signals():
+    rng = np.random.default_rng(0)
+    x = rng.normal(0, 1.0, (60000, 4))
+    x[rng.random(x.shape) < 0.002] -= 8.0
+    return x
+
+
+@pytest.mark.parametrize("scipy_helper", [True, False])
+def test_matches_find_peaks(signals, monkeypatch, scipy_helper):
+    if not scipy_helper:
+        monkeypatch.setattr(spikeEngine, "_select_by_peak_distance", None)
+    thresholds = spike_thresholds(signals, 4)
+    indices, _ = detect_multichannel(signals, thresholds, 30)
+    for found, expected in zip(indices, _legacy_detect(signals, thresholds, 30)):
+        assert np.array_equal(np.sort(found), expected)